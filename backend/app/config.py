@@ -33,6 +33,24 @@ class Settings(BaseSettings):
     # tags_dict 更新间隔（秒）
     tags_dict_update_interval: int = 900
 
+    # 内存位图搜索引擎（高级搜索走位图求值，仅回表取当前页；关闭时走 SQL）
+    bitmap_search_enabled: bool = False
+
+    # 搜索结果缓存条目数（LRU，0 表示关闭）
+    search_cache_size: int = 256
+
+    # 批量搜索单次请求的最大查询数
+    search_batch_max_queries: int = 50
+
+    # count_mode=estimate 时的计数上限（超出显示为 "上限+"）
+    search_count_estimate_cap: int = 10000
+
+    # 近似重复判定的感知哈希（64 位 dHash）最大汉明距离
+    near_duplicate_max_distance: int = 6
+
+    # 规则变更日志保留的结构化操作版本数（更早的版本只保留摘要，增量同步退回全量快照）
+    rules_changes_retention: int = 1000
+
     class Config:
         env_prefix = "BQBQ_"
 
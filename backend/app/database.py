@@ -1,13 +1,75 @@
 """
 数据库连接和初始化
 """
+import json
 import sqlite3
 from pathlib import Path
 from contextlib import contextmanager
-from typing import Generator
+from typing import Callable, Generator
 
 from .config import settings
 
+# 将空格分隔的标签字符串转换为 JSON 数组（供 json_each 拆分，json_quote 负责转义）
+TAGS_JSON_ARRAY_SQL = (
+    "'[\"' || replace(substr(json_quote(COALESCE({col}, '')), 2, "
+    "length(json_quote(COALESCE({col}, ''))) - 2), ' ', '\",\"') || '\"]'"
+)
+
+
+# 标签数量（空格分隔计数，与旧版 SQL 表达式一致），作为 images.tag_count 生成列。
+# 使用 VIRTUAL 而非 STORED：SQLite 不支持 ALTER TABLE ADD COLUMN 添加 STORED 列，已有数据库
+# 只能以 VIRTUAL 补齐；持久化由 idx_images_tag_count 承担，索引中保存计算结果并随写入维护，
+# 筛选与排序只读索引，不会逐行重新计算。
+TAG_COUNT_SQL = (
+    "CASE WHEN tags IS NULL OR tags = '' THEN 0 "
+    "ELSE length(tags) - length(replace(tags, ' ', '')) + 1 END"
+)
+
+# 小写扩展名（最后一个点之后的部分，无点时为空串），作为 images.ext 生成列；
+# rtrim 去掉末尾所有非点字符，得到截至最后一个点的前缀
+EXT_SQL = (
+    "CASE WHEN instr(filename, '.') = 0 THEN '' "
+    "ELSE lower(substr(filename, length(rtrim(filename, replace(filename, '.', ''))) + 1)) END"
+)
+
+# 宽高比分类，作为 images.aspect 生成列：宽高之比不小于 ASPECT_RATIO_THRESHOLD 为 wide，
+# 高宽之比不小于该值为 tall，其余为 square；尺寸未知时为空串（整数运算，避免浮点边界误差）
+ASPECT_RATIO_THRESHOLD = (5, 4)
+ASPECT_SQL = (
+    "CASE WHEN width <= 0 OR height <= 0 THEN '' "
+    f"WHEN width * {ASPECT_RATIO_THRESHOLD[1]} >= height * {ASPECT_RATIO_THRESHOLD[0]} THEN 'wide' "
+    f"WHEN height * {ASPECT_RATIO_THRESHOLD[1]} >= width * {ASPECT_RATIO_THRESHOLD[0]} THEN 'tall' "
+    "ELSE 'square' END"
+)
+
+# 像素数（百万像素），作为 images.megapixels 生成列
+MEGAPIXELS_SQL = "width * height / 1000000.0"
+
+# 是否动图（帧数大于 1），作为 images.is_animated 生成列
+IS_ANIMATED_SQL = "frame_count > 1"
+
+# 字符串各位置下标（json_each 的 key 为 0..length-1，触发器内不能使用 WITH 递归生成序列）
+POSITIONS_JSON_SQL = "'[' || substr(replace(hex(zeroblob(length({col}))), '00', ',0'), 2) || ']'"
+
+# 图片数据变更监听器（内存索引等通过它感知写操作）
+_images_listeners: list[Callable[[list[int] | None], None]] = []
+
+# tags_dict 重建监听器（回调参数为新的 标签 -> 使用次数）
+_tags_dict_listeners: list[Callable[[dict[str, int]], None]] = []
+
+# 进程内数据代号：图片 / 规则写操作提交后递增，供各类缓存判断是否过期
+_images_generation = 0
+_rules_generation = 0
+
+# 每递增多少个规则版本清理一次过期的结构化变更
+RULES_CHANGES_COMPACT_INTERVAL = 100
+
+# 本次请求中递增过规则版本号的连接（连接关闭时即已提交，再递增规则代号）
+_rules_dirty_connections: set[int] = set()
+
+# trigram 索引可用性（首次查询时检测）
+_trigram_available: bool | None = None
+
 
 def get_db_path() -> Path:
     """获取数据库路径"""
@@ -20,7 +82,7 @@ def init_database():
         cursor = conn.cursor()
 
         # 图片表
-        cursor.execute("""
+        cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS images (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 filename TEXT NOT NULL,
@@ -29,10 +91,73 @@ def init_database():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 file_size INTEGER DEFAULT 0,
                 width INTEGER DEFAULT 0,
-                height INTEGER DEFAULT 0
+                height INTEGER DEFAULT 0,
+                tag_count INTEGER GENERATED ALWAYS AS ({TAG_COUNT_SQL}) VIRTUAL,
+                ext TEXT GENERATED ALWAYS AS ({EXT_SQL}) VIRTUAL,
+                phash INTEGER,
+                visual_signature BLOB,
+                frame_count INTEGER NOT NULL DEFAULT 0,
+                duration_ms INTEGER NOT NULL DEFAULT 0,
+                features_failed INTEGER NOT NULL DEFAULT 0,
+                is_animated INTEGER GENERATED ALWAYS AS ({IS_ANIMATED_SQL}) VIRTUAL,
+                aspect TEXT GENERATED ALWAYS AS ({ASPECT_SQL}) VIRTUAL,
+                megapixels REAL GENERATED ALWAYS AS ({MEGAPIXELS_SQL}) VIRTUAL
             )
         """)
 
+        # 添加标签数量生成列（如果不存在）：由 tags 自动计算，所有写入路径无需额外维护
+        try:
+            cursor.execute(f"ALTER TABLE images ADD COLUMN tag_count INTEGER GENERATED ALWAYS AS ({TAG_COUNT_SQL}) VIRTUAL")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+
+        # 添加扩展名生成列（如果不存在）
+        try:
+            cursor.execute(f"ALTER TABLE images ADD COLUMN ext TEXT GENERATED ALWAYS AS ({EXT_SQL}) VIRTUAL")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+
+        # 添加感知哈希字段（如果不存在）：64 位 dHash，历史图片由后台任务回填
+        try:
+            cursor.execute("ALTER TABLE images ADD COLUMN phash INTEGER")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+
+        # 添加视觉特征字段（如果不存在）：float32 向量 BLOB，历史图片由后台任务回填
+        try:
+            cursor.execute("ALTER TABLE images ADD COLUMN visual_signature BLOB")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+
+        # 添加动图字段（如果不存在）：帧数（0 表示未知）与总时长，历史图片由后台任务回填
+        try:
+            cursor.execute("ALTER TABLE images ADD COLUMN frame_count INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+        try:
+            cursor.execute("ALTER TABLE images ADD COLUMN duration_ms INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+        # 添加特征计算失败标记（如果不存在）：无法解码的图片不再反复回填
+        try:
+            cursor.execute("ALTER TABLE images ADD COLUMN features_failed INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+        try:
+            cursor.execute(f"ALTER TABLE images ADD COLUMN is_animated INTEGER GENERATED ALWAYS AS ({IS_ANIMATED_SQL}) VIRTUAL")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+
+        # 添加宽高比分类与像素数生成列（如果不存在）：由 width / height 自动计算
+        try:
+            cursor.execute(f"ALTER TABLE images ADD COLUMN aspect TEXT GENERATED ALWAYS AS ({ASPECT_SQL}) VIRTUAL")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+        try:
+            cursor.execute(f"ALTER TABLE images ADD COLUMN megapixels REAL GENERATED ALWAYS AS ({MEGAPIXELS_SQL}) VIRTUAL")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+
         # FTS5 全文搜索索引
         cursor.execute("""
             CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
@@ -62,6 +187,91 @@ def init_database():
             END
         """)
 
+        # 标签词表（每个不同标签一行）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL
+            )
+        """)
+
+        # 图片-标签倒排表（按 tag_id 聚簇，便于按标签取图片集合）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS image_tags (
+                tag_id INTEGER NOT NULL,
+                image_id INTEGER NOT NULL,
+                PRIMARY KEY (tag_id, image_id),
+                FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE,
+                FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_tags_image ON image_tags(image_id)")
+
+        # 倒排表触发器（与 images.tags 保持同步）
+        split_new = TAGS_JSON_ARRAY_SQL.format(col="new.tags")
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS image_tags_ai AFTER INSERT ON images BEGIN
+                INSERT OR IGNORE INTO tags(name)
+                    SELECT value FROM json_each({split_new}) WHERE value != '';
+                INSERT OR IGNORE INTO image_tags(tag_id, image_id)
+                    SELECT t.id, new.id FROM tags t
+                    WHERE t.name IN (SELECT value FROM json_each({split_new}));
+            END
+        """)
+
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS image_tags_ad AFTER DELETE ON images BEGIN
+                DELETE FROM image_tags WHERE image_id = old.id;
+            END
+        """)
+
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS image_tags_au AFTER UPDATE OF tags ON images
+            WHEN old.tags IS NOT new.tags BEGIN
+                DELETE FROM image_tags WHERE image_id = old.id;
+                INSERT OR IGNORE INTO tags(name)
+                    SELECT value FROM json_each({split_new}) WHERE value != '';
+                INSERT OR IGNORE INTO image_tags(tag_id, image_id)
+                    SELECT t.id, new.id FROM tags t
+                    WHERE t.name IN (SELECT value FROM json_each({split_new}));
+            END
+        """)
+
+        # 旧库首次升级：回填倒排表
+        backfill_image_tags(conn)
+
+        # 短词（1~2 字）子串索引：标签词表的所有 1-gram / 2-gram（小写）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tag_grams (
+                gram TEXT NOT NULL,
+                tag_id INTEGER NOT NULL,
+                PRIMARY KEY (gram, tag_id),
+                FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+
+        positions = POSITIONS_JSON_SQL.format(col="new.name")
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS tag_grams_ai AFTER INSERT ON tags BEGIN
+                INSERT OR IGNORE INTO tag_grams(gram, tag_id)
+                    SELECT lower(substr(new.name, p.key + 1, 1)), new.id FROM json_each({positions}) p;
+                INSERT OR IGNORE INTO tag_grams(gram, tag_id)
+                    SELECT lower(substr(new.name, p.key + 1, 2)), new.id FROM json_each({positions}) p
+                    WHERE p.key + 2 <= length(new.name);
+            END
+        """)
+
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS tag_grams_ad AFTER DELETE ON tags BEGIN
+                DELETE FROM tag_grams WHERE tag_id = old.id;
+            END
+        """)
+
+        backfill_tag_grams(conn)
+
+        # 三元组 FTS5 索引（子串匹配，3 字及以上关键词走索引）
+        ensure_trigram_index(conn)
+
         # 规则组表
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS search_groups (
@@ -147,15 +357,33 @@ def init_database():
             )
         """)
 
+        # 版本日志结构化变更（JSON 操作列表，供增量同步回放；压缩后为 NULL）
+        try:
+            cursor.execute("ALTER TABLE search_version_log ADD COLUMN changes TEXT")
+        except sqlite3.OperationalError:
+            pass  # 字段已存在
+
         # 创建性能优化索引
         try:
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_keywords_group ON search_keywords(group_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_hierarchy_ancestor ON search_hierarchy(ancestor_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_hierarchy_descendant ON search_hierarchy(descendant_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_hierarchy_edges_child ON search_hierarchy_edges(child_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_version_log_version ON search_version_log(version_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_created ON images(created_at DESC)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_size ON images(file_size DESC)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_resolution ON images(height DESC, width DESC)")
+            # 标签数量筛选（含 max_tags=0 的未打标视图）与按标签数排序共用
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_tag_count ON images(tag_count, created_at)")
+            # 扩展名筛选（如"仅 GIF"视图）
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_ext ON images(ext, created_at)")
+            # 动图筛选与按帧数 / 时长排序
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_animated ON images(is_animated, created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_frames ON images(frame_count, created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_duration ON images(duration_ms, created_at)")
+            # 宽高比分类与像素数筛选
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_aspect ON images(aspect, created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_megapixels ON images(megapixels, created_at)")
         except sqlite3.OperationalError:
             pass  # 索引已存在
 
@@ -177,6 +405,71 @@ def get_connection() -> Generator[sqlite3.Connection, None, None]:
         yield conn
     finally:
         conn.close()
+        if id(conn) in _rules_dirty_connections:
+            _rules_dirty_connections.discard(id(conn))
+            notify_rules_changed()
+
+
+def add_images_listener(callback: Callable[[list[int] | None], None]) -> None:
+    """注册图片数据变更监听器"""
+    _images_listeners.append(callback)
+
+
+def notify_images_changed(image_ids: list[int] | None = None) -> None:
+    """
+    通知图片数据已变更（在写操作提交后调用）。
+
+    Args:
+        image_ids: 变更的图片 ID 列表；None 表示批量变更（导入、扫描等）
+    """
+    global _images_generation
+    _images_generation += 1
+    for callback in list(_images_listeners):
+        try:
+            callback(image_ids)
+        except Exception as e:
+            print(f"[Images] Change listener failed: {e}")
+
+
+def get_images_generation() -> int:
+    """图片数据代号（每次图片写操作提交后递增）"""
+    return _images_generation
+
+
+def notify_rules_changed() -> None:
+    """
+    通知规则数据已变更（在写操作提交后调用）。
+    经 increment_rules_version 的写操作在连接关闭时自动通知；
+    导入等直接改写规则表的路径需显式调用。
+    """
+    global _rules_generation
+    _rules_generation += 1
+
+
+def get_rules_generation() -> int:
+    """
+    规则数据代号（每次规则写操作提交后递增）。
+    与 rules_version 不同，导入重置版本号时同样会递增，可作为进程内缓存的失效依据。
+    代号只在本进程内递增，看不到其他进程的写入：以它为键的缓存（搜索结果、规则膨胀）
+    假定只有单个进程写库（run.py 以单进程运行 uvicorn）；需跨进程一致的缓存用 read_rules_state。
+    """
+    return _rules_generation
+
+
+def read_rules_state(cursor) -> tuple[int, int]:
+    """
+    规则数据状态 (rules_version, rules_epoch)，取自数据库，多进程间一致。
+    写操作都会递增版本号；导入可能重置版本号或不改变版本号，但会递增纪元。
+    """
+    cursor.execute("SELECT key, value FROM system_meta WHERE key IN ('rules_version', 'rules_epoch')")
+    values = {row['key']: int(row['value']) for row in cursor.fetchall()}
+    return values.get('rules_version', 0), values.get('rules_epoch', 0)
+
+
+def get_rules_state() -> tuple[int, int]:
+    """读取当前规则数据状态（见 read_rules_state）"""
+    with get_connection() as conn:
+        return read_rules_state(conn.cursor())
 
 
 def get_rules_version() -> int:
@@ -188,8 +481,19 @@ def get_rules_version() -> int:
         return int(row['value']) if row else 0
 
 
-def increment_rules_version(conn: sqlite3.Connection, client_id: str, operation: str, details: str = "") -> int:
-    """递增规则版本号并记录日志"""
+def increment_rules_version(
+    conn: sqlite3.Connection,
+    client_id: str,
+    operation: str,
+    details: str = "",
+    changes: list[dict] | None = None
+) -> int:
+    """
+    递增规则版本号并记录日志。
+
+    Args:
+        changes: 本版本的结构化操作列表（见 rules_changes），供 /api/rules/changes 增量回放
+    """
     cursor = conn.cursor()
 
     # 递增版本号
@@ -204,13 +508,43 @@ def increment_rules_version(conn: sqlite3.Connection, client_id: str, operation:
 
     # 记录日志
     cursor.execute("""
-        INSERT INTO search_version_log (version_id, client_id, operation, details)
-        VALUES (?, ?, ?, ?)
-    """, (new_version, client_id, operation, details))
+        INSERT INTO search_version_log (version_id, client_id, operation, details, changes)
+        VALUES (?, ?, ?, ?, ?)
+    """, (
+        new_version, client_id, operation, details,
+        json.dumps(changes, ensure_ascii=False, separators=(",", ":")) if changes is not None else None
+    ))
+
+    # 定期清理超出保留范围的结构化变更（摘要保留）
+    if new_version % RULES_CHANGES_COMPACT_INTERVAL == 0:
+        cursor.execute(
+            "UPDATE search_version_log SET changes = NULL WHERE version_id <= ? AND changes IS NOT NULL",
+            (new_version - settings.rules_changes_retention,)
+        )
 
+    _rules_dirty_connections.add(id(conn))
     return new_version
 
 
+def reset_rules_changes(conn: sqlite3.Connection) -> None:
+    """
+    导入等整体改写规则表之后调用：此前的日志行不再参与增量回放
+    （版本号可能被重置，旧日志中的版本号会与之后的新版本重复），
+    并递增 rules_epoch，使各进程按 (版本号, 纪元) 缓存的规则快照失效。
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO system_meta (key, value) VALUES ('rules_epoch', '1')
+        ON CONFLICT (key) DO UPDATE SET value = CAST(CAST(value AS INTEGER) + 1 AS TEXT)
+    """)
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM search_version_log")
+    floor_id = cursor.fetchone()[0]
+    cursor.execute(
+        "INSERT OR REPLACE INTO system_meta (key, value) VALUES ('rules_changes_floor', ?)",
+        (str(floor_id),)
+    )
+
+
 def get_conflict_info(base_version: int) -> dict:
     """
     获取版本冲突的详细信息。
@@ -272,9 +606,128 @@ def rebuild_tags_dict():
 
         conn.commit()
 
+    for callback in list(_tags_dict_listeners):
+        try:
+            callback(tag_counts)
+        except Exception as e:
+            print(f"[Tags Dict] Change listener failed: {e}")
+
     print(f"[Tags Dict] Rebuilt with {len(tag_counts)} unique tags.")
 
 
+def add_tags_dict_listener(callback: Callable[[dict[str, int]], None]) -> None:
+    """注册 tags_dict 重建监听器"""
+    _tags_dict_listeners.append(callback)
+
+
+def backfill_image_tags(conn: sqlite3.Connection) -> None:
+    """
+    为升级前已存在的图片回填 tags / image_tags 倒排表。
+    仅在倒排表为空而图片已有标签时执行一次，之后由触发器维护。
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM image_tags LIMIT 1")
+    if cursor.fetchone():
+        return
+    cursor.execute("SELECT 1 FROM images WHERE tags != '' LIMIT 1")
+    if not cursor.fetchone():
+        return
+
+    print("[Image Tags] Backfilling inverted index...")
+    split_tags = TAGS_JSON_ARRAY_SQL.format(col="i.tags")
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO tags(name)
+        SELECT DISTINCT j.value FROM images i, json_each({split_tags}) j
+        WHERE j.value != ''
+    """)
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO image_tags(tag_id, image_id)
+        SELECT t.id, i.id FROM images i, json_each({split_tags}) j
+        JOIN tags t ON t.name = j.value
+    """)
+    conn.commit()
+
+
+def backfill_tag_grams(conn: sqlite3.Connection) -> None:
+    """为升级前已存在的标签回填 1-gram / 2-gram 索引（之后由触发器维护）"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM tag_grams LIMIT 1")
+    if cursor.fetchone():
+        return
+    cursor.execute("SELECT 1 FROM tags LIMIT 1")
+    if not cursor.fetchone():
+        return
+
+    positions = POSITIONS_JSON_SQL.format(col="t.name")
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO tag_grams(gram, tag_id)
+        SELECT lower(substr(t.name, p.key + 1, 1)), t.id FROM tags t, json_each({positions}) p
+    """)
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO tag_grams(gram, tag_id)
+        SELECT lower(substr(t.name, p.key + 1, 2)), t.id FROM tags t, json_each({positions}) p
+        WHERE p.key + 2 <= length(t.name)
+    """)
+    conn.commit()
+
+
+def ensure_trigram_index(conn: sqlite3.Connection) -> bool:
+    """
+    创建 images_fts_trigram（trigram 分词的外部内容 FTS5 表）及同步触发器。
+    SQLite < 3.34 不支持 trigram 分词，此时返回 False，子串搜索退回词表匹配。
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts_trigram'")
+    created = cursor.fetchone() is None
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS images_fts_trigram USING fts5(
+                tags,
+                content='images',
+                content_rowid='id',
+                tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"[FTS] Trigram tokenizer unavailable: {e}")
+        return False
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_trigram_ai AFTER INSERT ON images BEGIN
+            INSERT INTO images_fts_trigram(rowid, tags) VALUES (new.id, new.tags);
+        END
+    """)
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_trigram_ad AFTER DELETE ON images BEGIN
+            INSERT INTO images_fts_trigram(images_fts_trigram, rowid, tags) VALUES('delete', old.id, old.tags);
+        END
+    """)
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS images_trigram_au AFTER UPDATE OF tags ON images BEGIN
+            INSERT INTO images_fts_trigram(images_fts_trigram, rowid, tags) VALUES('delete', old.id, old.tags);
+            INSERT INTO images_fts_trigram(rowid, tags) VALUES (new.id, new.tags);
+        END
+    """)
+
+    if created:
+        cursor.execute("INSERT INTO images_fts_trigram(images_fts_trigram) VALUES('rebuild')")
+    conn.commit()
+    return True
+
+
+def has_trigram_index() -> bool:
+    """当前数据库是否具备 trigram 子串索引"""
+    global _trigram_available
+    if _trigram_available is None:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts_trigram'")
+            _trigram_available = cursor.fetchone() is not None
+    return _trigram_available
+
+
 def ensure_hierarchy_edges(conn: sqlite3.Connection) -> None:
     """确保旧项目层级边表存在并用现有 parent_id 补齐一次"""
     cursor = conn.cursor()
@@ -303,42 +756,50 @@ def ensure_hierarchy_edges(conn: sqlite3.Connection) -> None:
     conn.commit()
 
 
-def rebuild_hierarchy_from_edges(conn: sqlite3.Connection) -> None:
-    """基于 search_hierarchy_edges 重建闭包表 search_hierarchy"""
-    cursor = conn.cursor()
-    ensure_hierarchy_edges(conn)
-
-    cursor.execute("DELETE FROM search_hierarchy")
+def hierarchy_closure_rows(cursor) -> dict[tuple[int, int], int]:
+    """
+    按边表全量推导闭包：(祖先, 后代) -> 最短深度（含每个组的自身行）。
+    路径字符串两端带分隔符，按完整 ID 判断是否回到已访问节点（避免 ",3" 误匹配 ",33"）。
+    """
+    rows: dict[tuple[int, int], int] = {}
     cursor.execute("SELECT id FROM search_groups")
-    ids = [row['id'] for row in cursor.fetchall()]
-    if ids:
-        cursor.executemany(
-            "INSERT OR IGNORE INTO search_hierarchy (ancestor_id, descendant_id, depth) VALUES (?, ?, 0)",
-            [(gid, gid) for gid in ids]
-        )
+    for row in cursor.fetchall():
+        rows[(row['id'], row['id'])] = 0
 
-    cursor.execute("SELECT parent_id, child_id FROM search_hierarchy_edges WHERE parent_id != 0")
-    edges = cursor.fetchall()
-    if edges:
-        cursor.executemany(
-            "INSERT OR IGNORE INTO search_hierarchy (ancestor_id, descendant_id, depth) VALUES (?, ?, 1)",
-            [(row['parent_id'], row['child_id']) for row in edges]
+    cursor.execute("""
+        WITH RECURSIVE rel(ancestor_id, descendant_id, depth, path) AS (
+            SELECT parent_id, child_id, 1, printf(',%d,%d,', parent_id, child_id)
+            FROM search_hierarchy_edges
+            WHERE parent_id != 0
+            UNION ALL
+            SELECT r.ancestor_id, e.child_id, r.depth + 1, r.path || e.child_id || ','
+            FROM rel r
+            JOIN search_hierarchy_edges e ON r.descendant_id = e.parent_id
+            WHERE e.parent_id != 0
+              AND instr(r.path, printf(',%d,', e.child_id)) = 0
         )
+        SELECT ancestor_id, descendant_id, MIN(depth) as depth FROM rel
+        GROUP BY ancestor_id, descendant_id
+    """)
+    for row in cursor.fetchall():
+        pair = (row['ancestor_id'], row['descendant_id'])
+        if pair not in rows:
+            rows[pair] = row['depth']
+    return rows
 
-        cursor.execute("""
-            WITH RECURSIVE rel(ancestor_id, descendant_id, depth, path) AS (
-                SELECT parent_id, child_id, 1, printf('%d,%d', parent_id, child_id)
-                FROM search_hierarchy_edges
-                WHERE parent_id != 0
-                UNION ALL
-                SELECT r.ancestor_id, e.child_id, r.depth + 1, r.path || ',' || e.child_id
-                FROM rel r
-                JOIN search_hierarchy_edges e ON r.descendant_id = e.parent_id
-                WHERE e.parent_id != 0
-                  AND instr(r.path, printf(',%d', e.child_id)) = 0
-            )
-            INSERT OR IGNORE INTO search_hierarchy (ancestor_id, descendant_id, depth)
-            SELECT ancestor_id, descendant_id, depth FROM rel
-        """)
 
+def rebuild_hierarchy_from_edges(conn: sqlite3.Connection) -> None:
+    """
+    基于 search_hierarchy_edges 全量重建闭包表 search_hierarchy。
+    日常的规则修改由 hierarchy_closure 增量维护，这里用于导入与一致性修复。
+    """
+    cursor = conn.cursor()
+    ensure_hierarchy_edges(conn)
+
+    rows = hierarchy_closure_rows(cursor)
+    cursor.execute("DELETE FROM search_hierarchy")
+    cursor.executemany(
+        "INSERT INTO search_hierarchy (ancestor_id, descendant_id, depth) VALUES (?, ?, ?)",
+        [(ancestor_id, descendant_id, depth) for (ancestor_id, descendant_id), depth in rows.items()]
+    )
     conn.commit()
@@ -0,0 +1,247 @@
+"""
+闭包表增量维护
+
+search_hierarchy 为 search_hierarchy_edges（允许多父的有向无环图，parent_id = 0 表示根级标记）
+的传递闭包：每个组有一行 (自身, 自身, 0)，其余每对可达的 (祖先, 后代) 一行，depth 为最短路径长度。
+
+- 插入边 p -> c：p 的全部祖先（含自身）与 c 的全部后代（含自身）两两组合，深度取较小值
+- 删除边：受影响的只有 (p 的祖先) x (c 的后代) 这些对，沿剩余边从较少的一侧重新求最短路径，
+  只遍历这些端点原有的后代（或祖先）子图，其余行保持不变
+- 删除组：被删除的组集合包含其全部后代，不会有经过它们的其他路径，直接删除相关行
+
+全量重建（rebuild_hierarchy_from_edges）保留为导入与一致性校验使用。
+"""
+from collections import deque
+
+from .database import hierarchy_closure_rows
+
+# 一致性校验报告中每类差异最多列出的行数
+VERIFY_SAMPLE_LIMIT = 100
+
+
+def add_group_closure(cursor, group_id: int) -> None:
+    """新建组：写入自身行"""
+    cursor.execute(
+        "INSERT OR IGNORE INTO search_hierarchy (ancestor_id, descendant_id, depth) VALUES (?, ?, 0)",
+        (group_id, group_id)
+    )
+
+
+def insert_hierarchy_edge(cursor, parent_id: int, child_id: int) -> bool:
+    """插入父子边并更新闭包，边已存在时返回 False"""
+    cursor.execute(
+        "INSERT OR IGNORE INTO search_hierarchy_edges (parent_id, child_id) VALUES (?, ?)",
+        (parent_id, child_id)
+    )
+    if cursor.rowcount == 0:
+        return False
+    if parent_id == 0:
+        return True
+
+    # 祖先 / 后代集合各自补上端点本身（端点可能没有自身行）
+    cursor.execute("""
+        INSERT INTO search_hierarchy (ancestor_id, descendant_id, depth)
+        SELECT a.ancestor_id, d.descendant_id, a.depth + 1 + d.depth
+        FROM (
+            SELECT ancestor_id, depth FROM search_hierarchy WHERE descendant_id = ?
+            UNION ALL SELECT ?, 0
+        ) a, (
+            SELECT descendant_id, depth FROM search_hierarchy WHERE ancestor_id = ?
+            UNION ALL SELECT ?, 0
+        ) d
+        WHERE true
+        ON CONFLICT (ancestor_id, descendant_id) DO UPDATE SET depth = MIN(depth, excluded.depth)
+    """, (parent_id, parent_id, child_id, child_id))
+    return True
+
+
+def _ancestors(cursor, group_id: int) -> set[int]:
+    cursor.execute("SELECT ancestor_id FROM search_hierarchy WHERE descendant_id = ?", (group_id,))
+    return {row['ancestor_id'] for row in cursor.fetchall()} | {group_id}
+
+
+def _descendants(cursor, group_id: int) -> set[int]:
+    cursor.execute("SELECT descendant_id FROM search_hierarchy WHERE ancestor_id = ?", (group_id,))
+    return {row['descendant_id'] for row in cursor.fetchall()} | {group_id}
+
+
+def delete_hierarchy_edges(cursor, edges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """删除父子边并重算受影响的闭包行，返回实际删除的边"""
+    edges = list(dict.fromkeys(edges))
+    if not edges:
+        return []
+
+    # 受影响的 (祖先集合, 后代集合) 须按删除前的闭包求出
+    blocks = [
+        (_ancestors(cursor, parent_id), _descendants(cursor, child_id))
+        for parent_id, child_id in edges
+        if parent_id != 0
+    ]
+
+    removed: list[tuple[int, int]] = []
+    for parent_id, child_id in edges:
+        cursor.execute(
+            "DELETE FROM search_hierarchy_edges WHERE parent_id = ? AND child_id = ?",
+            (parent_id, child_id)
+        )
+        if cursor.rowcount > 0:
+            removed.append((parent_id, child_id))
+
+    if blocks:
+        _recompute_pairs(cursor, blocks)
+    return removed
+
+
+def delete_child_edges(cursor, child_id: int) -> list[tuple[int, int]]:
+    """删除某组的全部入边（移动到新父节点之前）"""
+    cursor.execute("SELECT parent_id FROM search_hierarchy_edges WHERE child_id = ?", (child_id,))
+    return delete_hierarchy_edges(cursor, [(row['parent_id'], child_id) for row in cursor.fetchall()])
+
+
+def move_groups(
+    cursor, child_ids: list[int], parent_id: int | None
+) -> tuple[list[tuple[int, int]], list[tuple[int, int]]]:
+    """
+    将一批组移动到 parent_id 下（None / 0 表示根级）：先一次性删除它们的全部入边并合并重算，
+    再逐条插入新边。闭包只取决于最终边集，与逐个移动的结果一致。返回 (删除的边, 新增的边)。
+    """
+    if not child_ids:
+        return [], []
+    placeholders = ",".join(["?"] * len(child_ids))
+    cursor.execute(
+        f"SELECT parent_id, child_id FROM search_hierarchy_edges WHERE child_id IN ({placeholders})",
+        list(child_ids)
+    )
+    removed = delete_hierarchy_edges(cursor, [(row['parent_id'], row['child_id']) for row in cursor.fetchall()])
+    added: list[tuple[int, int]] = []
+    if parent_id not in (None, 0):
+        for child_id in child_ids:
+            if insert_hierarchy_edge(cursor, parent_id, child_id):
+                added.append((parent_id, child_id))
+    return removed, added
+
+
+def _recompute_pairs(cursor, blocks: list[tuple[set[int], set[int]]]) -> None:
+    """
+    重算 blocks 中各 (祖先 x 后代) 对的最短深度，与现有行比较后写回差异。
+
+    祖先较少时从每个祖先沿子边 BFS，后代较少时从每个后代沿父边反向 BFS；
+    新路径只可能经过受影响端点原有的后代（或祖先），因此只读取该子图的边。
+    """
+    sources: dict[int, set[int]] = {}
+    sinks: dict[int, set[int]] = {}
+    for ancestors, descendants in blocks:
+        for ancestor_id in ancestors:
+            sources.setdefault(ancestor_id, set()).update(descendants)
+        for descendant_id in descendants:
+            sinks.setdefault(descendant_id, set()).update(ancestors)
+
+    forward = len(sources) <= len(sinks)
+    starts = sources if forward else sinks
+    # 正向：start 为祖先，沿 parent -> child；反向：start 为后代，沿 child -> parent
+    near, far, start_col, other_col = (
+        ("parent_id", "child_id", "ancestor_id", "descendant_id") if forward
+        else ("child_id", "parent_id", "descendant_id", "ancestor_id")
+    )
+
+    start_ids = list(starts)
+    placeholders = ",".join(["?"] * len(start_ids))
+    cursor.execute(f"""
+        SELECT {near} as near_id, {far} as far_id FROM search_hierarchy_edges
+        WHERE parent_id != 0 AND (
+            {near} IN ({placeholders})
+            OR {near} IN (SELECT {other_col} FROM search_hierarchy WHERE {start_col} IN ({placeholders}))
+        )
+    """, start_ids + start_ids)
+    adjacency: dict[int, list[int]] = {}
+    for row in cursor.fetchall():
+        adjacency.setdefault(row['near_id'], []).append(row['far_id'])
+
+    removed: list[tuple[int, int]] = []
+    changed: list[tuple[int, int, int]] = []
+    for start_id, targets in starts.items():
+        depths = _shortest_depths(adjacency, start_id, targets)
+        cursor.execute(
+            f"SELECT {other_col} as other_id, depth FROM search_hierarchy WHERE {start_col} = ?",
+            (start_id,)
+        )
+        current = {row['other_id']: row['depth'] for row in cursor.fetchall()}
+        for other_id in targets:
+            if other_id == start_id:
+                continue  # 自身行不受边影响
+            pair = (start_id, other_id) if forward else (other_id, start_id)
+            depth = depths.get(other_id)
+            if depth is None:
+                if other_id in current:
+                    removed.append(pair)
+            elif current.get(other_id) != depth:
+                changed.append(pair + (depth,))
+
+    if removed:
+        cursor.executemany(
+            "DELETE FROM search_hierarchy WHERE ancestor_id = ? AND descendant_id = ?",
+            removed
+        )
+    if changed:
+        cursor.executemany(
+            "INSERT OR REPLACE INTO search_hierarchy (ancestor_id, descendant_id, depth) VALUES (?, ?, ?)",
+            changed
+        )
+
+
+def _shortest_depths(adjacency: dict[int, list[int]], source: int, targets: set[int]) -> dict[int, int]:
+    """BFS 最短深度（找齐全部目标后提前结束）"""
+    depths: dict[int, int] = {}
+    remaining = set(targets)
+    remaining.discard(source)
+    queue = deque([(source, 0)])
+    seen = {source}
+    while queue and remaining:
+        node, depth = queue.popleft()
+        for neighbor in adjacency.get(node, ()):
+            if neighbor in seen:
+                continue
+            seen.add(neighbor)
+            depths[neighbor] = depth + 1
+            remaining.discard(neighbor)
+            queue.append((neighbor, depth + 1))
+    return depths
+
+
+def remove_groups_closure(cursor, group_ids: list[int]) -> None:
+    """删除组集合（须包含其全部后代）的闭包行"""
+    if not group_ids:
+        return
+    placeholders = ",".join(["?"] * len(group_ids))
+    cursor.execute(
+        f"DELETE FROM search_hierarchy WHERE ancestor_id IN ({placeholders}) OR descendant_id IN ({placeholders})",
+        group_ids + group_ids
+    )
+
+
+def verify_hierarchy_closure(cursor) -> dict:
+    """将当前闭包表与按边表全量推导的结果比较，返回差异报告"""
+    expected = hierarchy_closure_rows(cursor)
+    cursor.execute("SELECT ancestor_id, descendant_id, depth FROM search_hierarchy")
+    actual = {(row['ancestor_id'], row['descendant_id']): row['depth'] for row in cursor.fetchall()}
+
+    missing = sorted(pair for pair in expected if pair not in actual)
+    extra = sorted(pair for pair in actual if pair not in expected)
+    depth_mismatch = sorted(
+        (pair, actual[pair], depth) for pair, depth in expected.items()
+        if pair in actual and actual[pair] != depth
+    )
+    return {
+        "consistent": not (missing or extra or depth_mismatch),
+        "rows": len(actual),
+        "expected_rows": len(expected),
+        "missing": [list(pair) for pair in missing[:VERIFY_SAMPLE_LIMIT]],
+        "extra": [list(pair) for pair in extra[:VERIFY_SAMPLE_LIMIT]],
+        "depth_mismatch": [
+            {"ancestor_id": pair[0], "descendant_id": pair[1], "depth": depth, "expected_depth": expected_depth}
+            for pair, depth, expected_depth in depth_mismatch[:VERIFY_SAMPLE_LIMIT]
+        ],
+        "missing_count": len(missing),
+        "extra_count": len(extra),
+        "depth_mismatch_count": len(depth_mismatch),
+    }
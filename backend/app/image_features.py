@@ -0,0 +1,190 @@
+"""
+入库图片特征
+
+上传、扫描导入时由同一次解码得到的预览图计算：
+- images.phash：感知哈希（近似去重，见 perceptual_hash）
+- images.visual_signature：视觉特征（相似图片搜索，见 visual_search）
+- images.frame_count / duration_ms：动图帧数与总时长（is_animated 为其生成列）
+历史图片由后台回填任务补算；无法解码的图片记 images.features_failed = 1，回填时跳过。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from .config import settings
+from .database import get_connection, notify_images_changed
+from .perceptual_hash import dhash, to_db
+from .visual_search import compute_signature, signature_to_blob
+
+# 入库时计算的 images 列（INSERT / UPDATE 均按此顺序）
+FEATURE_COLUMNS = ("phash", "visual_signature", "frame_count", "duration_ms", "features_failed")
+
+# 预览图边长（特征均在该尺寸上计算）
+PREVIEW_SIZE = 64
+
+# 回填每批处理的图片数
+BACKFILL_BATCH_SIZE = 200
+
+
+def decode_preview(img: Image.Image) -> Image.Image:
+    """解码为白底 RGB 预览图（动图取第一帧；JPEG 直接按缩小尺寸解码）"""
+    img.draft("RGB", (PREVIEW_SIZE, PREVIEW_SIZE))
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        frame = Image.alpha_composite(background, rgba).convert("RGB")
+    else:
+        frame = img.convert("RGB")
+    return frame.resize((PREVIEW_SIZE, PREVIEW_SIZE), Image.BILINEAR)
+
+
+def animation_info(img: Image.Image) -> tuple[int, int]:
+    """返回 (帧数, 总时长毫秒)；静态图为 (1, 0)"""
+    frame_count = getattr(img, "n_frames", 1) or 1
+    if frame_count <= 1:
+        return 1, 0
+    duration = 0
+    try:
+        for index in range(frame_count):
+            img.seek(index)
+            duration += int(img.info.get("duration") or 0)
+    finally:
+        img.seek(0)
+    return frame_count, duration
+
+
+def empty_features() -> dict:
+    """无法解码时的特征值（frame_count 为 0 表示未知，features_failed 标记后回填任务不再尝试）"""
+    return {"phash": None, "visual_signature": None, "frame_count": 0, "duration_ms": 0, "features_failed": 1}
+
+
+def compute_features(img: Image.Image) -> dict:
+    """返回可直接写入 images 表 FEATURE_COLUMNS 各列的值"""
+    try:
+        preview = decode_preview(img)
+        frame_count, duration_ms = animation_info(img)
+        return {
+            "phash": to_db(dhash(preview)),
+            "visual_signature": signature_to_blob(compute_signature(preview)),
+            "frame_count": frame_count,
+            "duration_ms": duration_ms,
+            "features_failed": 0,
+        }
+    except Exception:
+        return empty_features()
+
+
+def feature_values(features: dict) -> tuple:
+    """按 FEATURE_COLUMNS 顺序取出特征值（用于 INSERT / UPDATE 参数）"""
+    return tuple(features[column] for column in FEATURE_COLUMNS)
+
+
+def features_from_file(path: Path) -> dict:
+    """读取图片文件计算特征"""
+    try:
+        with Image.open(path) as img:
+            return compute_features(img)
+    except Exception:
+        return empty_features()
+
+
+def store_features(conn, image_ids: list[int], features: list[dict]) -> None:
+    """写入特征并通知图片变更（动图字段参与搜索筛选，内存索引经监听器同步）"""
+    conn.executemany(
+        f"UPDATE images SET {', '.join(f'{column} = ?' for column in FEATURE_COLUMNS)} WHERE id = ?",
+        [feature_values(item) + (image_id,) for image_id, item in zip(image_ids, features)]
+    )
+    conn.commit()
+    notify_images_changed(list(image_ids))
+
+
+# ----- 历史图片回填 -----
+
+backfill_status = {"running": False, "processed": 0, "failed": 0, "remaining": None}
+_backfill_lock = threading.Lock()
+
+# 待回填：特征缺失且未被标记为解码失败
+MISSING_FEATURES_SQL = "features_failed = 0 AND (phash IS NULL OR visual_signature IS NULL OR frame_count = 0)"
+
+
+def features_counts() -> dict:
+    """当前待回填与解码失败的图片数"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT COALESCE(SUM({MISSING_FEATURES_SQL}), 0) as missing,
+                   COALESCE(SUM(features_failed != 0), 0) as decode_failed
+            FROM images
+        """)
+        row = cursor.fetchone()
+        return {"missing": row['missing'], "decode_failed": row['decode_failed']}
+
+
+def reset_failed_features() -> int:
+    """清除解码失败标记（文件修复后重新回填），返回清除的行数"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE images SET features_failed = 0 WHERE features_failed != 0")
+        conn.commit()
+        return cursor.rowcount
+
+
+def _backfill_batch(after_id: int) -> tuple[list, int | None]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT id, filename FROM images WHERE ({MISSING_FEATURES_SQL}) AND id > ? ORDER BY id LIMIT ?",
+            (after_id, BACKFILL_BATCH_SIZE)
+        )
+        rows = cursor.fetchall()
+    if not rows:
+        return [], None
+    return rows, rows[-1]['id']
+
+
+def run_features_backfill() -> None:
+    """为缺少特征的图片补算（按 id 顺序，每张图片只尝试一次，失败的记入 features_failed）"""
+    images_path = Path(settings.images_path)
+    max_workers = min(4, os.cpu_count() or 1)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) as total FROM images WHERE {MISSING_FEATURES_SQL}")
+        backfill_status["remaining"] = cursor.fetchone()['total']
+
+    after_id = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            rows, after_id = _backfill_batch(after_id)
+            if not rows:
+                break
+            features = list(executor.map(lambda row: features_from_file(images_path / row['filename']), rows))
+            # 失败的图片同样写回（features_failed = 1），之后的回填不再重复解码
+            with get_connection() as conn:
+                store_features(conn, [row['id'] for row in rows], features)
+            failed = sum(1 for item in features if item["features_failed"])
+            backfill_status["processed"] += len(rows) - failed
+            backfill_status["failed"] += failed
+            backfill_status["remaining"] = max(0, backfill_status["remaining"] - len(rows))
+
+
+def start_features_backfill() -> bool:
+    """在后台线程启动回填任务，已在运行时返回 False"""
+    with _backfill_lock:
+        if backfill_status["running"]:
+            return False
+        backfill_status.update(running=True, processed=0, failed=0, remaining=None)
+
+    def worker():
+        try:
+            run_features_backfill()
+        except Exception as e:
+            print(f"[Image Features] Backfill failed: {e}")
+        finally:
+            backfill_status["running"] = False
+            print(f"[Image Features] Backfill finished: {backfill_status['processed']} computed, {backfill_status['failed']} failed")
+
+    threading.Thread(target=worker, daemon=True, name="ImageFeaturesBackfill").start()
+    return True
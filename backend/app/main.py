@@ -17,7 +17,9 @@ from PIL import Image
 import io
 
 from .config import settings
-from .database import init_database, get_connection, rebuild_tags_dict
+from .database import init_database, get_connection, rebuild_tags_dict, notify_images_changed
+from .image_features import compute_features, empty_features, feature_values, start_features_backfill
+from .perceptual_hash import find_near_duplicates, from_db
 
 # 创建应用
 app = FastAPI(
@@ -228,12 +230,13 @@ def scan_and_import_folder():
                 else:
                     file_path.rename(standard_path)
 
-            # 获取图片尺寸
+            # 获取图片尺寸与入库特征（感知哈希、视觉特征、动图信息）
             try:
                 with Image.open(standard_path) as img:
                     w, h = img.size
+                    features = compute_features(img)
             except Exception:
-                w, h = 0, 0
+                w, h, features = 0, 0, empty_features()
 
             file_size = len(file_data)
             file_mtime = standard_path.stat().st_mtime
@@ -245,7 +248,8 @@ def scan_and_import_folder():
                 'width': w,
                 'height': h,
                 'size': file_size,
-                'mtime': file_mtime
+                'mtime': file_mtime,
+                'features': features
             })
 
         except Exception as e:
@@ -299,12 +303,13 @@ def scan_and_import_folder():
             with get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.executemany(
-                    "INSERT INTO images (md5, filename, created_at, width, height, file_size, tags) VALUES (?, ?, datetime(?, 'unixepoch'), ?, ?, ?, '')",
-                    [(item['md5'], item['filename'], item['mtime'], item['width'], item['height'], item['size'])
+                    "INSERT INTO images (md5, filename, created_at, width, height, file_size, tags, phash, visual_signature, frame_count, duration_ms, features_failed) VALUES (?, ?, datetime(?, 'unixepoch'), ?, ?, ?, '', ?, ?, ?, ?, ?)",
+                    [(item['md5'], item['filename'], item['mtime'], item['width'], item['height'], item['size'], *feature_values(item['features']))
                      for item in batch_insert_data]
                 )
                 conn.commit()
             imported_count = len(batch_insert_data)
+            notify_images_changed()
         except Exception as e:
             print(f"[Folder Scan] Database insert error: {e}")
             counters['error'] += len(batch_insert_data)
@@ -370,6 +375,9 @@ async def startup():
     # 启动定时更新任务
     start_tags_dict_updater(settings.tags_dict_update_interval)
 
+    # 后台为历史图片补算感知哈希与视觉特征
+    start_features_backfill()
+
 
 @app.get("/")
 async def root():
@@ -403,15 +411,23 @@ async def upload_file(file: UploadFile = File(...)):
             # 重复图片：更新上传时间
             cursor.execute("UPDATE images SET created_at = CURRENT_TIMESTAMP WHERE md5 = ?", (md5,))
             conn.commit()
+            notify_images_changed([existing['id']])
             return {"success": False, "msg": "Duplicate image (timestamp refreshed)"}
 
-        # 获取图片尺寸
+        # 获取图片尺寸与入库特征（感知哈希、视觉特征、动图信息）
+        features = empty_features()
         try:
             img = Image.open(io.BytesIO(content))
             width, height = img.size
+            features = compute_features(img)
         except Exception:
             width, height = 0, 0
 
+        # 近似重复提示（重新编码、缩放过的同一张图）
+        near_duplicates = []
+        if features["phash"] is not None:
+            near_duplicates = find_near_duplicates(cursor, from_db(features["phash"]), limit=5)
+
         # 生成文件名（使用 MD5 避免重名）
         filename = f"{md5}{ext}"
         file_path = images_path / filename
@@ -424,10 +440,11 @@ async def upload_file(file: UploadFile = File(...)):
 
         # 保存到数据库
         cursor.execute(
-            """INSERT INTO images (filename, md5, tags, file_size, width, height)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (filename, md5, "", len(content), width, height)
+            """INSERT INTO images (filename, md5, tags, file_size, width, height, phash, visual_signature, frame_count, duration_ms, features_failed)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (filename, md5, "", len(content), width, height, *feature_values(features))
         )
         conn.commit()
+        notify_images_changed([cursor.lastrowid])
 
-        return {"success": True, "msg": md5}
+        return {"success": True, "msg": md5, "near_duplicates": near_duplicates}
@@ -36,6 +36,9 @@ class ImageResponse(BaseModel):
     file_size: int = 0
     width: int = 0
     height: int = 0
+    frame_count: int = 0
+    duration_ms: int = 0
+    is_animated: bool = False
 
     class Config:
         from_attributes = True
@@ -50,10 +53,25 @@ class SearchRequest(BaseModel):
     # 新增参数 - 与旧项目一致
     min_tags: int = Field(default=0, ge=0, description="最小标签数量")
     max_tags: int = Field(default=-1, ge=-1, description="最大标签数量(-1 表示无限制)")
-    sort_by: str = Field(default="time_desc", description="排序方式: time_desc, time_asc, tags_desc, tags_asc, size_desc, size_asc, resolution_desc, resolution_asc")
+    sort_by: str = Field(default="time_desc", description="排序方式: time_desc, time_asc, tags_desc, tags_asc, size_desc, size_asc, resolution_desc, resolution_asc, frames_desc, frames_asc, duration_desc, duration_asc, random")
     extensions: list[str] = Field(default_factory=list, description="文件扩展名过滤")
     exclude_extensions: list[str] = Field(default_factory=list, description="排除的文件扩展名")
+    animated: bool | None = Field(default=None, description="动图筛选: true 仅动图, false 仅静态图")
+    min_frames: int | None = Field(default=None, ge=0, description="最小帧数")
+    max_frames: int | None = Field(default=None, ge=0, description="最大帧数")
+    min_duration_ms: int | None = Field(default=None, ge=0, description="最短动图时长（毫秒）")
+    max_duration_ms: int | None = Field(default=None, ge=0, description="最长动图时长（毫秒）")
+    aspect: list[str] = Field(default_factory=list, description="宽高比分类过滤: wide, tall, square（多个为 OR）")
+    min_width: int | None = Field(default=None, ge=0, description="最小宽度（像素）")
+    min_height: int | None = Field(default=None, ge=0, description="最小高度（像素）")
+    min_megapixels: float | None = Field(default=None, ge=0, description="最小像素数（百万像素）")
+    max_megapixels: float | None = Field(default=None, ge=0, description="最大像素数（百万像素）")
     expand: bool = Field(default=True, description="是否启用关键词膨胀")
+    match_mode: str = Field(default="substring", description="关键词匹配方式: substring(子串，旧版 LIKE 语义), token(整词，FTS5), prefix(前缀，FTS5)")
+    cursor: str | None = Field(default=None, description="键集分页游标（上一页返回的 next_cursor），提供时忽略 page")
+    count_mode: str = Field(default="exact", description="总数计算方式: exact(精确), none(不计数), estimate(上限截断), cached(复用同条件已算总数)")
+    fuzzy: bool = Field(default=False, description="容错模式：包含标签扩展为词表中拼写相近（编辑距离阈值内）的标签")
+    seed: int | None = Field(default=None, description="随机排序（sort_by=random）的种子，未提供时由服务端生成并在响应中返回")
 
 
 class SearchResultItem(BaseModel):
@@ -69,5 +87,9 @@ class SearchResultItem(BaseModel):
 
 class SearchResponse(BaseModel):
     """搜索响应（旧项目格式）"""
-    total: int
+    total: int | None
+    total_capped: bool = False
+    did_you_mean: dict[str, list[str]] | None = None
+    seed: int | None = None
     results: list[SearchResultItem]
+    next_cursor: str | None = None
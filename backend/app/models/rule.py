@@ -117,3 +117,29 @@ class KeywordToggle(BaseModel):
     enabled: bool
     client_id: str
     base_version: int
+
+
+class RuleOperation(BaseModel):
+    """
+    规则事务中的单个操作。
+
+    op: create_group / update_group / delete_group / add_keyword / remove_keyword /
+        toggle_keyword / add_hierarchy / remove_hierarchy / move_group
+    组 ID 字段可填字符串，引用本事务中前面 create_group 的 ref
+    """
+    op: str
+    ref: str | None = None  # create_group：新组的引用名
+    group_id: int | str | None = None
+    parent_id: int | str | None = None
+    child_id: int | str | None = None
+    keyword_id: int | None = None
+    keyword: str | None = None
+    name: str | None = None
+    enabled: bool | None = None
+
+
+class RulesTransactionRequest(BaseModel):
+    """规则事务请求（按顺序执行，全部成功才提交）"""
+    operations: list[RuleOperation]
+    client_id: str
+    base_version: int
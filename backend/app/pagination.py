@@ -0,0 +1,54 @@
+"""
+键集（游标）分页
+"""
+import base64
+import json
+
+# 排序方式 -> (排序字段, 是否降序)；同时兼容简化搜索(time_*)与高级搜索(date_*)的命名
+SORT_MODES = {
+    "date_desc": ("date", True),
+    "date_asc": ("date", False),
+    "time_desc": ("date", True),
+    "time_asc": ("date", False),
+    "size_desc": ("size", True),
+    "size_asc": ("size", False),
+    "resolution_desc": ("resolution", True),
+    "resolution_asc": ("resolution", False),
+    "tags_desc": ("tags", True),
+    "tags_asc": ("tags", False),
+    "frames_desc": ("frames", True),
+    "frames_asc": ("frames", False),
+    "duration_desc": ("duration", True),
+    "duration_asc": ("duration", False),
+}
+
+
+def resolve_sort(sort_by: str) -> tuple[str, bool]:
+    """解析排序方式，未知值按时间倒序"""
+    return SORT_MODES.get(sort_by, ("date", True))
+
+
+def encode_cursor(field: str, descending: bool, keys: list, last_id: int) -> str:
+    """将上一页最后一行的排序键编码为不透明游标"""
+    payload = json.dumps({"f": field, "d": descending, "k": keys, "id": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, field: str, descending: bool) -> tuple[list, int]:
+    """
+    解码游标，返回 (排序键列表, 最后一行 id)。
+
+    Raises:
+        ValueError: 游标格式无效或与当前排序方式不一致
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        keys, last_id = payload["k"], payload["id"]
+    except Exception:
+        raise ValueError("无效的游标")
+    if payload.get("f") != field or payload.get("d") != descending:
+        raise ValueError("游标与排序方式不一致")
+    if not isinstance(keys, list) or not isinstance(last_id, int):
+        raise ValueError("无效的游标")
+    return keys, last_id
@@ -0,0 +1,212 @@
+"""
+感知哈希近似去重
+
+- 入库时计算 64 位 dHash（灰度缩放到 9x8，比较相邻像素明暗），存入 images.phash
+- 内存多索引哈希表按哈希分段建立倒排，查询只检查至少一段足够接近的候选，
+  不必与每张图片逐一比较
+- 入库计算与历史图片回填见 image_features
+"""
+import threading
+
+from PIL import Image
+
+from .config import settings
+from .database import get_connection, add_images_listener
+
+# dHash 边长（HASH_SIZE x HASH_SIZE 位）
+HASH_SIZE = 8
+
+# 多索引哈希：64 位切为 CHUNK_COUNT 段，每段 CHUNK_BITS 位
+CHUNK_COUNT = 4
+CHUNK_BITS = HASH_SIZE * HASH_SIZE // CHUNK_COUNT
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# 每段邻近取值最多翻转的位数（超过时退化为逐个比较）
+MAX_CHUNK_FLIPS = 2
+
+
+def dhash(img: Image.Image) -> int:
+    """计算 64 位 dHash（无符号整数）"""
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def to_db(value: int) -> int:
+    """无符号 64 位 -> SQLite INTEGER（有符号）"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def from_db(value: int) -> int:
+    """SQLite INTEGER -> 无符号 64 位"""
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def chunk_variants(chunk: int, flips: int) -> list[int]:
+    """与 chunk 相差不超过 flips 位的所有 CHUNK_BITS 位取值"""
+    variants = [chunk]
+    frontier = [(chunk, -1)]
+    for _ in range(flips):
+        next_frontier = []
+        for value, last_bit in frontier:
+            for bit in range(last_bit + 1, CHUNK_BITS):
+                flipped = value ^ (1 << bit)
+                variants.append(flipped)
+                next_frontier.append((flipped, bit))
+        frontier = next_frontier
+    return variants
+
+
+class NearDuplicateIndex:
+    """
+    图片感知哈希的内存多索引哈希表（multi-index hashing）
+
+    64 位哈希切为 CHUNK_COUNT 段，每段建立 "段值 -> 哈希值集合" 的倒排。
+    两个哈希距离不超过 r 时，按抽屉原理至少有一段相差不超过 r // CHUNK_COUNT 位，
+    因此只需查找各段邻近取值的桶，再对候选精确计算汉明距离。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self.ids_by_hash: dict[int, set[int]] = {}
+        self.hash_by_id: dict[int, int] = {}
+        # 每段一个倒排：段值 -> 哈希值集合
+        self.buckets: list[dict[int, set[int]]] = [{} for _ in range(CHUNK_COUNT)]
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._reset()
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, phash FROM images WHERE phash IS NOT NULL")
+                for row in cursor.fetchall():
+                    self._add(row['id'], from_db(row['phash']))
+            self._loaded = True
+
+    @staticmethod
+    def _chunks(value: int) -> list[int]:
+        return [(value >> (index * CHUNK_BITS)) & CHUNK_MASK for index in range(CHUNK_COUNT)]
+
+    def _add(self, image_id: int, value: int):
+        self.hash_by_id[image_id] = value
+        ids = self.ids_by_hash.get(value)
+        if ids is not None:
+            ids.add(image_id)
+            return
+        self.ids_by_hash[value] = {image_id}
+        for bucket, chunk in zip(self.buckets, self._chunks(value)):
+            bucket.setdefault(chunk, set()).add(value)
+
+    def _remove(self, image_id: int):
+        value = self.hash_by_id.pop(image_id, None)
+        if value is None:
+            return
+        ids = self.ids_by_hash[value]
+        ids.discard(image_id)
+        if ids:
+            return
+        del self.ids_by_hash[value]
+        for bucket, chunk in zip(self.buckets, self._chunks(value)):
+            values = bucket[chunk]
+            values.discard(value)
+            if not values:
+                del bucket[chunk]
+
+    def refresh_images(self, image_ids: list[int] | None):
+        """图片变更回调：按 ID 增量更新；None 表示批量变更，整体失效"""
+        with self._lock:
+            if not self._loaded:
+                return
+            if image_ids is None:
+                self._loaded = False
+                self._reset()
+                return
+
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                placeholders = ",".join(["?"] * len(image_ids))
+                cursor.execute(
+                    f"SELECT id, phash FROM images WHERE id IN ({placeholders})",
+                    list(image_ids)
+                )
+                fresh = {row['id']: row['phash'] for row in cursor.fetchall()}
+
+            for image_id in image_ids:
+                self._remove(image_id)
+                if fresh.get(image_id) is not None:
+                    self._add(image_id, from_db(fresh[image_id]))
+
+    def _candidates(self, value: int, max_distance: int):
+        flips = max_distance // CHUNK_COUNT
+        if flips > MAX_CHUNK_FLIPS:
+            # 阈值过大时邻近取值过多，退化为逐个比较
+            return self.ids_by_hash.keys()
+        candidates: set[int] = set()
+        for bucket, chunk in zip(self.buckets, self._chunks(value)):
+            for variant in chunk_variants(chunk, flips):
+                values = bucket.get(variant)
+                if values:
+                    candidates.update(values)
+        return candidates
+
+    def find(self, value: int, max_distance: int, exclude_id: int | None = None) -> list[tuple[int, int]]:
+        """返回 [(距离, 图片 ID)]，按距离升序"""
+        self.ensure_loaded()
+        with self._lock:
+            matches = []
+            for candidate in self._candidates(value, max_distance):
+                distance = hamming(value, candidate)
+                if distance > max_distance:
+                    continue
+                for image_id in self.ids_by_hash[candidate]:
+                    if image_id != exclude_id:
+                        matches.append((distance, image_id))
+            matches.sort()
+            return matches
+
+
+near_duplicate_index = NearDuplicateIndex()
+add_images_listener(near_duplicate_index.refresh_images)
+
+
+def find_near_duplicates(cursor, value: int, limit: int, max_distance: int | None = None, exclude_id: int | None = None) -> list[dict]:
+    """按哈希查找近似图片并回表读取基本信息，按距离升序"""
+    if max_distance is None:
+        max_distance = settings.near_duplicate_max_distance
+    matches = near_duplicate_index.find(value, max_distance, exclude_id)[:limit]
+    if not matches:
+        return []
+    placeholders = ",".join(["?"] * len(matches))
+    cursor.execute(
+        f"SELECT id, md5, filename, width, height, file_size FROM images WHERE id IN ({placeholders})",
+        [image_id for _, image_id in matches]
+    )
+    rows = {row['id']: row for row in cursor.fetchall()}
+    return [
+        {
+            "md5": rows[image_id]['md5'],
+            "filename": rows[image_id]['filename'],
+            "width": rows[image_id]['width'],
+            "height": rows[image_id]['height'],
+            "file_size": rows[image_id]['file_size'],
+            "distance": distance,
+        }
+        for distance, image_id in matches
+        if image_id in rows
+    ]
+
@@ -4,14 +4,28 @@
 import base64
 import hashlib
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Response
 from pydantic import BaseModel
 from PIL import Image
 import io
 
 from ..config import settings
-from ..database import get_connection, get_rules_version, increment_rules_version
+from ..database import get_connection, get_rules_version, increment_rules_version, notify_images_changed
 from ..models.image import ImageCreate, ImageResponse, ImageUpdate
+from ..pagination import encode_cursor, decode_cursor
+from ..image_features import (
+    backfill_status,
+    compute_features,
+    empty_features,
+    feature_values,
+    features_counts,
+    features_from_file,
+    reset_failed_features,
+    start_features_backfill,
+    store_features,
+)
+from ..perceptual_hash import find_near_duplicates, from_db
+from ..visual_search import signature_from_blob, signature_matrix
 
 router = APIRouter()
 
@@ -36,16 +50,37 @@ def save_thumbnail(image_bytes: bytes, md5: str) -> None:
 
 
 @router.get("", response_model=list[ImageResponse])
-async def list_images(page: int = 1, page_size: int = 20):
-    """获取图片列表"""
+async def list_images(response: Response, page: int = 1, page_size: int = 20, cursor: str | None = None):
+    """
+    获取图片列表
+
+    提供 cursor（上一页响应头 X-Next-Cursor 的值）时按 (created_at, id) 键集翻页，忽略 page。
+    """
     offset = (page - 1) * page_size
     with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM images ORDER BY created_at DESC LIMIT ? OFFSET ?",
-            (page_size, offset)
-        )
-        rows = cursor.fetchall()
+        db_cursor = conn.cursor()
+        if cursor:
+            try:
+                keys, last_id = decode_cursor(cursor, "date", True)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if len(keys) != 1:
+                raise HTTPException(status_code=400, detail="无效的游标")
+            db_cursor.execute(
+                """SELECT * FROM images WHERE (created_at, id) < (?, ?)
+                   ORDER BY created_at DESC, id DESC LIMIT ?""",
+                (keys[0], last_id, page_size)
+            )
+        else:
+            db_cursor.execute(
+                "SELECT * FROM images ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                (page_size, offset)
+            )
+        rows = db_cursor.fetchall()
+
+        if rows and len(rows) == page_size:
+            last = rows[-1]
+            response.headers["X-Next-Cursor"] = encode_cursor("date", True, [last['created_at']], last['id'])
         return [dict(row) for row in rows]
 
 
@@ -54,7 +89,7 @@ async def check_md5_exists(md5: str, refresh_time: bool = False):
     """检查 MD5 是否已存在"""
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT filename FROM images WHERE md5 = ?", (md5,))
+        cursor.execute("SELECT id, filename FROM images WHERE md5 = ?", (md5,))
         row = cursor.fetchone()
 
         if row:
@@ -66,6 +101,7 @@ async def check_md5_exists(md5: str, refresh_time: bool = False):
                     (md5,)
                 )
                 conn.commit()
+                notify_images_changed([row['id']])
                 time_refreshed = True
 
             return {
@@ -83,6 +119,93 @@ async def check_md5_compat(data: CheckMD5Request):
     return await check_md5_exists(data.md5, data.refresh_time)
 
 
+def ensure_features(conn, row) -> tuple[int, bytes]:
+    """返回图片的 (phash, visual_signature)；尚未回填时现场计算并写回"""
+    signature = row['visual_signature']
+    if row['phash'] is not None and signature is not None and signature_from_blob(signature) is not None:
+        return row['phash'], row['visual_signature']
+    features = features_from_file(Path(settings.images_path) / row['filename'])
+    if features["phash"] is None:
+        raise HTTPException(status_code=422, detail="无法读取图片计算特征")
+    store_features(conn, [row['id']], [features])
+    return features["phash"], features["visual_signature"]
+
+
+@router.get("/similar")
+async def find_similar_images(
+    md5: str,
+    max_distance: int | None = Query(default=None, ge=0, le=64),
+    limit: int = Query(default=20, ge=1, le=200),
+):
+    """
+    近似图片查询：按感知哈希（dHash）汉明距离查找重新编码/缩放过的同一张图。
+    max_distance 默认取配置 near_duplicate_max_distance。
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, filename, phash, visual_signature FROM images WHERE md5 = ?", (md5,))
+        row = cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="图片不存在")
+
+        phash, _ = ensure_features(conn, row)
+        results = find_near_duplicates(cursor, from_db(phash), limit, max_distance, exclude_id=row['id'])
+        return {"md5": md5, "results": results}
+
+
+@router.get("/visually-similar")
+async def find_visually_similar_images(md5: str, limit: int = Query(default=20, ge=1, le=200)):
+    """
+    视觉相似图片：按颜色直方图 + 梯度方向直方图特征的余弦相似度取 Top-K
+    （内存矩阵暴力检索，不依赖标签）。
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, filename, phash, visual_signature FROM images WHERE md5 = ?", (md5,))
+        row = cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="图片不存在")
+
+        _, signature = ensure_features(conn, row)
+        matches = signature_matrix.nearest(signature_from_blob(signature), limit, exclude_id=row['id'])
+        if not matches:
+            return {"md5": md5, "results": []}
+
+        placeholders = ",".join(["?"] * len(matches))
+        cursor.execute(
+            f"SELECT id, md5, filename, width, height, file_size FROM images WHERE id IN ({placeholders})",
+            [image_id for image_id, _ in matches]
+        )
+        rows = {r['id']: r for r in cursor.fetchall()}
+        results = [
+            {
+                "md5": rows[image_id]['md5'],
+                "filename": rows[image_id]['filename'],
+                "width": rows[image_id]['width'],
+                "height": rows[image_id]['height'],
+                "file_size": rows[image_id]['file_size'],
+                "score": round(score, 4),
+            }
+            for image_id, score in matches
+            if image_id in rows
+        ]
+        return {"md5": md5, "results": results}
+
+
+@router.get("/features/status")
+async def get_features_backfill_status():
+    """图片特征（感知哈希、视觉特征）回填任务状态，以及当前待回填（missing）与解码失败（decode_failed）的图片数"""
+    return {**backfill_status, **features_counts()}
+
+
+@router.post("/features/backfill")
+async def trigger_features_backfill(retry_failed: bool = False):
+    """手动启动图片特征回填（为缺少感知哈希或视觉特征的图片补算）；retry_failed 时先清除解码失败标记"""
+    if retry_failed and not backfill_status["running"]:
+        reset_failed_features()
+    return {"started": start_features_backfill(), **backfill_status}
+
+
 @router.get("/{image_id}", response_model=ImageResponse)
 async def get_image(image_id: int):
     """获取单张图片"""
@@ -116,10 +239,12 @@ async def create_image(data: ImageCreate):
         if calculated_md5 != data.md5:
             raise HTTPException(status_code=400, detail="MD5 校验失败")
 
-        # 获取图片尺寸
+        # 获取图片尺寸与入库特征（感知哈希、视觉特征、动图信息）
+        features = empty_features()
         try:
             img = Image.open(io.BytesIO(image_data))
             width, height = img.size
+            features = compute_features(img)
         except Exception:
             width, height = 0, 0
 
@@ -131,13 +256,14 @@ async def create_image(data: ImageCreate):
         # 保存到数据库
         tags_str = " ".join(data.tags)
         cursor.execute(
-            """INSERT INTO images (filename, md5, tags, file_size, width, height)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (data.filename, data.md5, tags_str, len(image_data), width, height)
+            """INSERT INTO images (filename, md5, tags, file_size, width, height, phash, visual_signature, frame_count, duration_ms, features_failed)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (data.filename, data.md5, tags_str, len(image_data), width, height, *feature_values(features))
         )
         conn.commit()
 
         image_id = cursor.lastrowid
+        notify_images_changed([image_id])
         cursor.execute("SELECT * FROM images WHERE id = ?", (image_id,))
         return dict(cursor.fetchone())
 
@@ -157,23 +283,31 @@ async def upload_image(file: UploadFile = File(...)):
     # 检查是否存在
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM images WHERE md5 = ?", (md5,))
-        if cursor.fetchone():
+        cursor.execute("SELECT id FROM images WHERE md5 = ?", (md5,))
+        existing = cursor.fetchone()
+        if existing:
             cursor.execute(
                 "UPDATE images SET created_at = CURRENT_TIMESTAMP WHERE md5 = ?",
                 (md5,)
             )
             conn.commit()
+            notify_images_changed([existing['id']])
             return {"success": False, "msg": "Duplicate image (timestamp refreshed)"}
 
-        # 读取尺寸
-        width, height = 0, 0
+        # 读取尺寸与入库特征（感知哈希、视觉特征、动图信息）
+        width, height, features = 0, 0, empty_features()
         try:
             img = Image.open(io.BytesIO(image_bytes))
             width, height = img.size
+            features = compute_features(img)
         except Exception:
             pass
 
+        # 近似重复提示（重新编码、缩放过的同一张图）
+        near_duplicates = []
+        if features["phash"] is not None:
+            near_duplicates = find_near_duplicates(cursor, from_db(features["phash"]), limit=5)
+
         # 保存原图
         images_path = Path(settings.images_path)
         images_path.mkdir(parents=True, exist_ok=True)
@@ -189,13 +323,14 @@ async def upload_image(file: UploadFile = File(...)):
 
         # 写入数据库
         cursor.execute(
-            """INSERT INTO images (filename, md5, tags, file_size, width, height)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (filename, md5, "", len(image_bytes), width, height)
+            """INSERT INTO images (filename, md5, tags, file_size, width, height, phash, visual_signature, frame_count, duration_ms, features_failed)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (filename, md5, "", len(image_bytes), width, height, *feature_values(features))
         )
         conn.commit()
+        notify_images_changed([cursor.lastrowid])
 
-    return {"success": True, "msg": md5}
+    return {"success": True, "msg": md5, "near_duplicates": near_duplicates}
 
 
 @router.put("/{image_id}/tags")
@@ -224,12 +359,14 @@ async def update_image_tags(image_id: int, data: ImageUpdate):
             (tags_str, image_id)
         )
 
-        # 递增版本号
+        # 递增版本号（CAS 依赖版本号变化检测并发修改；标签修改不涉及规则，结构化变更为空）
         new_version = increment_rules_version(
             conn, data.client_id, "update_tags",
-            f"image_id={image_id}"
+            f"image_id={image_id}",
+            []
         )
         conn.commit()
+        notify_images_changed([image_id])
 
         return {"success": True, "new_version": new_version}
 
@@ -254,5 +391,6 @@ async def delete_image(image_id: int):
         # 删除数据库记录
         cursor.execute("DELETE FROM images WHERE id = ?", (image_id,))
         conn.commit()
+        notify_images_changed([image_id])
 
         return {"success": True, "message": "图片已删除"}
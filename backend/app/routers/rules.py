@@ -1,7 +1,7 @@
 """
 规则树路由
 """
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, Header, HTTPException, Query, Response
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from ..database import (
@@ -10,14 +10,37 @@ from ..database import (
     increment_rules_version,
     get_conflict_info,
     ensure_hierarchy_edges,
+    notify_rules_changed,
+    read_rules_state,
     rebuild_hierarchy_from_edges
 )
+from ..hierarchy_closure import (
+    add_group_closure,
+    delete_child_edges,
+    delete_hierarchy_edges,
+    insert_hierarchy_edge,
+    move_groups,
+    remove_groups_closure,
+    verify_hierarchy_closure
+)
+from ..rules_changes import (
+    edge_deletes,
+    edge_upserts,
+    group_delete,
+    group_upsert,
+    keyword_delete,
+    keyword_upsert,
+    load_changes
+)
+from ..rules_graph import RulesGraph, rules_graph
+from ..rules_payload import etag_matches, parse_accept_encoding, rules_payload
+from ..rules_transaction import RuleOperationError, RulesTransaction
 from ..models.rule import (
     GroupCreate, GroupResponse, KeywordCreate,
     KeywordResponse, CASRequest,
     GroupUpdate, GroupToggle, GroupBatchRequest,
     HierarchyAddRequest, HierarchyRemoveRequest, HierarchyBatchMoveRequest,
-    KeywordToggle
+    KeywordToggle, RulesTransactionRequest
 )
 
 router = APIRouter()
@@ -73,28 +96,8 @@ class LegacyGroupBatchRequest(BaseModel):
 
 
 def build_legacy_rules_data() -> dict:
-    """构建旧项目扁平化规则结构"""
-    with get_connection() as conn:
-        ensure_hierarchy_edges(conn)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id as group_id, name as group_name, COALESCE(enabled, 1) as is_enabled FROM search_groups")
-        groups = [dict(row) for row in cursor.fetchall()]
-
-        cursor.execute("SELECT keyword, group_id, COALESCE(enabled, 1) as is_enabled FROM search_keywords")
-        keywords = [dict(row) for row in cursor.fetchall()]
-
-        cursor.execute("""
-            SELECT parent_id, child_id
-            FROM search_hierarchy_edges
-        """)
-        hierarchy = [dict(row) for row in cursor.fetchall()]
-
-    return {
-        "version_id": get_rules_version(),
-        "groups": groups,
-        "keywords": keywords,
-        "hierarchy": hierarchy
-    }
+    """构建旧项目扁平化规则结构（取自规则数据响应缓存）"""
+    return rules_payload.current().data
 
 
 def create_conflict_response(base_version: int, current_version: int):
@@ -118,73 +121,46 @@ def create_conflict_response(base_version: int, current_version: int):
 
 
 def build_rules_tree() -> list[GroupResponse]:
-    """构建规则树结构"""
-    with get_connection() as conn:
-        ensure_hierarchy_edges(conn)
-        cursor = conn.cursor()
-
-        # 获取所有组（包含 enabled 字段）
-        cursor.execute("SELECT id, name, parent_id, enabled FROM search_groups ORDER BY id")
-        groups = {row['id']: {
-            'id': row['id'],
-            'name': row['name'],
-            'parent_id': row['parent_id'],
-            'enabled': bool(row['enabled']) if row['enabled'] is not None else True,
-            'keywords': [],
-            'children': []
-        } for row in cursor.fetchall()}
-
-        # 获取所有关键词（包含 enabled 字段）
-        cursor.execute("SELECT id, keyword, group_id, enabled FROM search_keywords")
-        for row in cursor.fetchall():
-            if row['group_id'] in groups:
-                groups[row['group_id']]['keywords'].append(
-                    KeywordResponse(
-                        id=row['id'],
-                        keyword=row['keyword'],
-                        group_id=row['group_id'],
-                        enabled=bool(row['enabled']) if row['enabled'] is not None else True
-                    )
+    """构建规则树结构（取自规则图快照）"""
+    graph = rules_graph.current()
+    groups = {row['id']: {
+        'id': row['id'],
+        'name': row['name'],
+        'parent_id': row['parent_id'],
+        'enabled': bool(row['enabled']) if row['enabled'] is not None else True,
+        'keywords': [],
+        'children': []
+    } for row in graph.groups}
+
+    for row in graph.keywords:
+        if row['group_id'] in groups:
+            groups[row['group_id']]['keywords'].append(
+                KeywordResponse(
+                    id=row['id'],
+                    keyword=row['keyword'],
+                    group_id=row['group_id'],
+                    enabled=bool(row['enabled']) if row['enabled'] is not None else True
                 )
-
-        # 构建树结构
-        root_groups = []
-        for group in groups.values():
-            if group['parent_id'] is None:
-                root_groups.append(group)
-            elif group['parent_id'] in groups:
-                groups[group['parent_id']]['children'].append(group)
-
-        def to_response(g: dict) -> GroupResponse:
-            return GroupResponse(
-                id=g['id'],
-                name=g['name'],
-                enabled=g['enabled'],
-                keywords=g['keywords'],
-                children=[to_response(c) for c in g['children']]
             )
 
-        return [to_response(g) for g in root_groups]
-
-
-def collect_descendants(cursor, root_id: int) -> list[int]:
-    """基于边表收集所有后代（包含自身）"""
-    to_visit = [root_id]
-    visited: set[int] = set()
-
-    while to_visit:
-        current = to_visit.pop()
-        if current in visited:
-            continue
-        visited.add(current)
-        cursor.execute(
-            "SELECT child_id FROM search_hierarchy_edges WHERE parent_id = ?",
-            (current,)
+    # 构建树结构
+    root_groups = []
+    for group in groups.values():
+        if group['parent_id'] is None:
+            root_groups.append(group)
+        elif group['parent_id'] in groups:
+            groups[group['parent_id']]['children'].append(group)
+
+    def to_response(g: dict) -> GroupResponse:
+        return GroupResponse(
+            id=g['id'],
+            name=g['name'],
+            enabled=g['enabled'],
+            keywords=g['keywords'],
+            children=[to_response(c) for c in g['children']]
         )
-        children = [row['child_id'] for row in cursor.fetchall()]
-        to_visit.extend(children)
 
-    return list(visited)
+    return [to_response(g) for g in root_groups]
 
 
 def remove_edges_for_groups(cursor, group_ids: list[int]) -> None:
@@ -212,19 +188,45 @@ def sync_parent_id_for_child(cursor, child_id: int) -> None:
 
 
 @router.get("")
-async def get_rules_tree(response: Response, if_none_match: str | None = None):
-    """获取规则树（旧项目扁平结构，支持 ETag 缓存）"""
-    current_version = get_rules_version()
+async def get_rules_tree(
+    if_none_match: str | None = None,
+    if_none_match_header: str | None = Header(default=None, alias="If-None-Match"),
+    accept_encoding: str | None = Header(default=None),
+):
+    """
+    获取规则树（旧项目扁平结构）。
+    响应体按规则版本预先编码并缓存（含 gzip / brotli 版本），带 ETag；
+    支持 If-None-Match 请求头与旧版 if_none_match 查询参数，未变化时返回 304。
+    """
+    payload = rules_payload.current()
+    headers = {"ETag": payload.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
 
-    # ETag 检查
-    if if_none_match and if_none_match == str(current_version):
-        response.status_code = 304
-        return Response(status_code=304)
+    if etag_matches(if_none_match_header, payload.etag) or etag_matches(if_none_match, payload.etag):
+        return Response(status_code=304, headers=headers)
 
-    legacy_data = build_legacy_rules_data()
-    response.headers["ETag"] = str(current_version)
+    encoding = parse_accept_encoding(accept_encoding)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload.encoded(encoding), media_type="application/json", headers=headers)
 
-    return legacy_data
+
+@router.get("/payload/stats")
+async def get_rules_payload_stats():
+    """规则数据响应缓存的命中统计与各编码大小"""
+    return rules_payload.stats()
+
+
+@router.get("/changes")
+async def get_rules_changes(since: int = Query(ge=0)):
+    """
+    增量同步：since 版本之后的规则变更，按版本排列的结构化操作可依次回放到旧数据上。
+    日志已压缩或导入后无法覆盖该区间时，返回全量快照（mode=snapshot）。
+    """
+    current_version, entries = load_changes(since)
+    if entries is None:
+        payload = rules_payload.current()
+        return {"mode": "snapshot", "since": since, "version_id": payload.version, "snapshot": payload.data}
+    return {"mode": "delta", "since": since, "version_id": current_version, "changes": entries}
 
 
 @router.post("/groups")
@@ -253,20 +255,19 @@ async def create_group(data: GroupCreate):
             (data.name, parent_id)
         )
         group_id = cursor.lastrowid
+        add_group_closure(cursor, group_id)
+        changes = [group_upsert(cursor, group_id)]
 
-        # 维护边表（允许多父关系）
+        # 维护边表（允许多父关系）与闭包
         if data.parent_id not in (None, 0):
-            cursor.execute(
-                "INSERT OR IGNORE INTO search_hierarchy_edges (parent_id, child_id) VALUES (?, ?)",
-                (data.parent_id, group_id)
-            )
-
-        rebuild_hierarchy_from_edges(conn)
+            if insert_hierarchy_edge(cursor, data.parent_id, group_id):
+                changes += edge_upserts([(data.parent_id, group_id)])
 
         # 递增版本号
         new_version = increment_rules_version(
             conn, data.client_id, "create_group",
-            f"name={data.name}, parent_id={data.parent_id}"
+            f"name={data.name}, parent_id={data.parent_id}",
+            changes
         )
         conn.commit()
 
@@ -304,7 +305,8 @@ async def add_keyword(group_id: int, data: KeywordCreate):
         # 递增版本号
         new_version = increment_rules_version(
             conn, data.client_id, "add_keyword",
-            f"keyword={data.keyword}, group_id={group_id}"
+            f"keyword={data.keyword}, group_id={group_id}",
+            [keyword_upsert(group_id, data.keyword)]
         )
         conn.commit()
 
@@ -331,8 +333,8 @@ async def delete_group(group_id: int, data: CASRequest):
 
         group_name = row['name']
 
-        # 递归收集所有后代（含自身）
-        all_group_ids = collect_descendants(cursor, group_id)
+        # 收集所有后代（含自身）
+        all_group_ids = rules_graph.current().descendants(group_id)
 
         if all_group_ids:
             placeholders = ",".join(["?"] * len(all_group_ids))
@@ -348,12 +350,13 @@ async def delete_group(group_id: int, data: CASRequest):
                 f"DELETE FROM search_groups WHERE id IN ({placeholders})",
                 all_group_ids
             )
-            rebuild_hierarchy_from_edges(conn)
+            remove_groups_closure(cursor, all_group_ids)
 
         # 递增版本号
         new_version = increment_rules_version(
             conn, data.client_id, "delete_group",
-            f"group_id={group_id}, name={group_name}"
+            f"group_id={group_id}, name={group_name}",
+            [group_delete(gid) for gid in all_group_ids]
         )
         conn.commit()
 
@@ -372,7 +375,7 @@ async def delete_keyword(keyword_id: int, data: CASRequest):
         cursor = conn.cursor()
 
         # 检查关键词是否存在
-        cursor.execute("SELECT keyword FROM search_keywords WHERE id = ?", (keyword_id,))
+        cursor.execute("SELECT keyword, group_id FROM search_keywords WHERE id = ?", (keyword_id,))
         row = cursor.fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="关键词不存在")
@@ -383,7 +386,8 @@ async def delete_keyword(keyword_id: int, data: CASRequest):
         # 递增版本号
         new_version = increment_rules_version(
             conn, data.client_id, "delete_keyword",
-            f"keyword_id={keyword_id}, keyword={row['keyword']}"
+            f"keyword_id={keyword_id}, keyword={row['keyword']}",
+            [keyword_delete(row['group_id'], row['keyword'])]
         )
         conn.commit()
 
@@ -402,7 +406,7 @@ async def toggle_keyword(keyword_id: int, data: KeywordToggle):
         cursor = conn.cursor()
 
         # 检查关键词是否存在
-        cursor.execute("SELECT keyword FROM search_keywords WHERE id = ?", (keyword_id,))
+        cursor.execute("SELECT keyword, group_id FROM search_keywords WHERE id = ?", (keyword_id,))
         row = cursor.fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="关键词不存在")
@@ -416,7 +420,8 @@ async def toggle_keyword(keyword_id: int, data: KeywordToggle):
         # 递增版本号
         new_version = increment_rules_version(
             conn, data.client_id, "toggle_keyword",
-            f"keyword_id={keyword_id}, enabled={data.enabled}"
+            f"keyword_id={keyword_id}, enabled={data.enabled}",
+            [keyword_upsert(row['group_id'], row['keyword'], data.enabled)]
         )
         conn.commit()
 
@@ -460,7 +465,7 @@ async def update_group(group_id: int, data: GroupUpdate):
                 cursor.execute("SELECT id FROM search_groups WHERE id = ?", (data.parent_id,))
                 if not cursor.fetchone():
                     raise HTTPException(status_code=404, detail="父组不存在")
-                if has_hierarchy_cycle(cursor, data.parent_id, group_id):
+                if rules_graph.current().creates_cycle(data.parent_id, group_id):
                     raise HTTPException(status_code=400, detail="不能创建循环引用关系")
             updates.append("parent_id = ?")
             params.append(data.parent_id if data.parent_id != 0 else None)
@@ -472,19 +477,20 @@ async def update_group(group_id: int, data: GroupUpdate):
         params.append(group_id)
         cursor.execute(f"UPDATE search_groups SET {', '.join(updates)} WHERE id = ?", params)
 
-        # 如果移动了父节点，更新边表并重建闭包表
+        changes = []
+        if data.name is not None or data.enabled is not None:
+            changes.append(group_upsert(cursor, group_id))
+
+        # 如果移动了父节点，更新边表并增量维护闭包表
         if data.parent_id is not None:
-            cursor.execute("DELETE FROM search_hierarchy_edges WHERE child_id = ?", (group_id,))
-            if data.parent_id != 0:
-                cursor.execute(
-                    "INSERT OR IGNORE INTO search_hierarchy_edges (parent_id, child_id) VALUES (?, ?)",
-                    (data.parent_id, group_id)
-                )
-            rebuild_hierarchy_from_edges(conn)
+            changes += edge_deletes(delete_child_edges(cursor, group_id))
+            if data.parent_id != 0 and insert_hierarchy_edge(cursor, data.parent_id, group_id):
+                changes += edge_upserts([(data.parent_id, group_id)])
 
         new_version = increment_rules_version(
             conn, data.client_id, "update_group",
-            f"group_id={group_id}, {', '.join(details)}"
+            f"group_id={group_id}, {', '.join(details)}",
+            changes
         )
         conn.commit()
 
@@ -514,7 +520,8 @@ async def toggle_group(group_id: int, data: GroupToggle):
 
         new_version = increment_rules_version(
             conn, data.client_id, "toggle_group",
-            f"group_id={group_id}, enabled={data.enabled}"
+            f"group_id={group_id}, enabled={data.enabled}",
+            [group_upsert(cursor, group_id)]
         )
         conn.commit()
 
@@ -533,11 +540,13 @@ async def batch_groups(data: GroupBatchRequest):
         cursor = conn.cursor()
 
         affected = 0
+        changes = []
 
         if data.action == "delete":
+            graph = rules_graph.current()
             all_group_ids: list[int] = []
             for gid in data.group_ids:
-                all_group_ids.extend(collect_descendants(cursor, gid))
+                all_group_ids.extend(graph.descendants(gid))
             all_group_ids = list(set(all_group_ids))
 
             if all_group_ids:
@@ -551,18 +560,17 @@ async def batch_groups(data: GroupBatchRequest):
                     f"DELETE FROM search_groups WHERE id IN ({placeholders})",
                     all_group_ids
                 )
-                rebuild_hierarchy_from_edges(conn)
+                remove_groups_closure(cursor, all_group_ids)
                 affected = len(all_group_ids)
+                changes = [group_delete(gid) for gid in all_group_ids]
 
-        elif data.action == "enable":
-            for gid in data.group_ids:
-                cursor.execute("UPDATE search_groups SET enabled = 1 WHERE id = ?", (gid,))
-                affected += cursor.rowcount
-
-        elif data.action == "disable":
+        elif data.action in ("enable", "disable"):
+            enabled_value = 1 if data.action == "enable" else 0
             for gid in data.group_ids:
-                cursor.execute("UPDATE search_groups SET enabled = 0 WHERE id = ?", (gid,))
-                affected += cursor.rowcount
+                cursor.execute("UPDATE search_groups SET enabled = ? WHERE id = ?", (enabled_value, gid))
+                if cursor.rowcount > 0:
+                    affected += cursor.rowcount
+                    changes.append(group_upsert(cursor, gid))
 
         elif data.action == "move":
             target_parent_id = data.target_parent_id if data.target_parent_id not in (None, 0) else None
@@ -571,73 +579,37 @@ async def batch_groups(data: GroupBatchRequest):
                 if not cursor.fetchone():
                     raise HTTPException(status_code=404, detail="目标父节点不存在")
 
+            # 工作副本随每次移动更新，后续环路检测可见本批前面的移动
+            graph = rules_graph.current().copy()
+            moved: list[int] = []
             for gid in data.group_ids:
                 if target_parent_id is not None and target_parent_id == gid:
                     continue
-                if target_parent_id is not None and has_hierarchy_cycle(cursor, target_parent_id, gid):
+                if target_parent_id is not None and graph.creates_cycle(target_parent_id, gid):
                     continue
-                cursor.execute("DELETE FROM search_hierarchy_edges WHERE child_id = ?", (gid,))
-                if target_parent_id is not None:
-                    cursor.execute(
-                        "INSERT OR IGNORE INTO search_hierarchy_edges (parent_id, child_id) VALUES (?, ?)",
-                        (target_parent_id, gid)
-                    )
+                graph.set_parents(gid, [target_parent_id] if target_parent_id is not None else [])
                 cursor.execute(
                     "UPDATE search_groups SET parent_id = ? WHERE id = ?",
                     (target_parent_id, gid)
                 )
-                affected += 1
-            rebuild_hierarchy_from_edges(conn)
+                moved.append(gid)
+            removed_edges, added_edges = move_groups(cursor, moved, target_parent_id)
+            affected = len(moved)
+            changes = edge_deletes(removed_edges) + edge_upserts(added_edges)
 
         else:
             raise HTTPException(status_code=400, detail=f"未知操作: {data.action}")
 
         new_version = increment_rules_version(
             conn, data.client_id, "batch_groups",
-            f"action={data.action}, group_ids={data.group_ids}, affected={affected}"
+            f"action={data.action}, group_ids={data.group_ids}, affected={affected}",
+            changes
         )
         conn.commit()
 
         return {"success": True, "new_version": new_version, "version_id": new_version, "affected": affected}
 
 
-def has_hierarchy_cycle(cursor, parent_id: int, child_id: int) -> bool:
-    """
-    检测添加 parent_id -> child_id 关系是否会形成环路。
-
-    算法：从 parent_id 开始，沿着 parent 方向 DFS，如果能走到 child_id，
-    说明 child_id 是 parent_id 的祖先，添加此关系会形成环。
-
-    Args:
-        cursor: 数据库游标
-        parent_id: 待添加的父节点ID
-        child_id: 待添加的子节点ID
-
-    Returns:
-        bool: True 表示会形成环，False 表示安全
-    """
-    if parent_id == child_id:
-        return True  # 自引用必然成环
-
-    visited = set()
-    stack = [child_id]
-
-    while stack:
-        current = stack.pop()
-        if current == parent_id:
-            return True
-        if current in visited:
-            continue
-        visited.add(current)
-        cursor.execute(
-            "SELECT child_id FROM search_hierarchy_edges WHERE parent_id = ?",
-            (current,)
-        )
-        stack.extend([row['child_id'] for row in cursor.fetchall()])
-
-    return False
-
-
 @router.post("/hierarchy/add")
 async def add_hierarchy(data: HierarchyAddRequest):
     """添加层级关系（将子节点移动到父节点下）"""
@@ -665,13 +637,10 @@ async def add_hierarchy(data: HierarchyAddRequest):
                 raise HTTPException(status_code=404, detail="父节点不存在")
 
         # 检查是否会形成环路
-        if data.parent_id != 0 and has_hierarchy_cycle(cursor, data.parent_id, data.child_id):
+        if data.parent_id != 0 and rules_graph.current().creates_cycle(data.parent_id, data.child_id):
             raise HTTPException(status_code=400, detail="不能创建循环引用关系")
 
-        cursor.execute(
-            "INSERT OR IGNORE INTO search_hierarchy_edges (parent_id, child_id) VALUES (?, ?)",
-            (data.parent_id, data.child_id)
-        )
+        inserted = insert_hierarchy_edge(cursor, data.parent_id, data.child_id)
 
         # 更新单一 parent_id（仅作兼容展示）
         if data.parent_id != 0:
@@ -686,11 +655,10 @@ async def add_hierarchy(data: HierarchyAddRequest):
                     (data.parent_id, data.child_id)
                 )
 
-        rebuild_hierarchy_from_edges(conn)
-
         new_version = increment_rules_version(
             conn, data.client_id, "add_hierarchy",
-            f"child_id={data.child_id}, parent_id={data.parent_id}"
+            f"child_id={data.child_id}, parent_id={data.parent_id}",
+            edge_upserts([(data.parent_id, data.child_id)] if inserted else [])
         )
         conn.commit()
 
@@ -715,22 +683,17 @@ async def remove_hierarchy(data: HierarchyRemoveRequest):
         if not row:
             raise HTTPException(status_code=404, detail="子节点不存在")
 
-        # 删除父子关系
-        cursor.execute(
-            "DELETE FROM search_hierarchy_edges WHERE parent_id = ? AND child_id = ?",
-            (data.parent_id, data.child_id)
-        )
+        # 删除父子关系（只重算受影响的闭包行）
+        removed_edges = delete_hierarchy_edges(cursor, [(data.parent_id, data.child_id)])
 
         # 同步展示用 parent_id
         if data.parent_id == row['parent_id'] or data.parent_id == 0:
             sync_parent_id_for_child(cursor, data.child_id)
 
-        # 重建闭包表
-        rebuild_hierarchy_from_edges(conn)
-
         new_version = increment_rules_version(
             conn, data.client_id, "remove_hierarchy",
-            f"child_id={data.child_id}, old_parent_id={data.parent_id}"
+            f"child_id={data.child_id}, old_parent_id={data.parent_id}",
+            edge_deletes(removed_edges)
         )
         conn.commit()
 
@@ -762,35 +725,32 @@ async def batch_move_hierarchy(data: HierarchyBatchMoveRequest):
             if not cursor.fetchone():
                 raise HTTPException(status_code=404, detail="目标父节点不存在")
 
-        moved_count = 0
+        moved: list[int] = []
         errors: list[dict] = []
+        # 工作副本随每次移动更新，后续环路检测可见本批前面的移动
+        graph = rules_graph.current().copy()
         for gid in group_ids:
             if target_parent_id == gid:
                 errors.append({"child_id": gid, "error": "Cannot link group to itself"})
                 continue
-            if target_parent_id != 0 and has_hierarchy_cycle(cursor, target_parent_id, gid):
+            if target_parent_id != 0 and graph.creates_cycle(target_parent_id, gid):
                 errors.append({"child_id": gid, "error": "Would create cycle"})
                 continue
 
-            cursor.execute("DELETE FROM search_hierarchy_edges WHERE child_id = ?", (gid,))
-            if target_parent_id != 0:
-                cursor.execute(
-                    "INSERT OR IGNORE INTO search_hierarchy_edges (parent_id, child_id) VALUES (?, ?)",
-                    (target_parent_id, gid)
-                )
-                cursor.execute(
-                    "UPDATE search_groups SET parent_id = ? WHERE id = ?",
-                    (target_parent_id, gid)
-                )
-            else:
-                cursor.execute("UPDATE search_groups SET parent_id = NULL WHERE id = ?", (gid,))
-            moved_count += 1
-
-        rebuild_hierarchy_from_edges(conn)
+            graph.set_parents(gid, [target_parent_id] if target_parent_id != 0 else [])
+            cursor.execute(
+                "UPDATE search_groups SET parent_id = ? WHERE id = ?",
+                (target_parent_id or None, gid)
+            )
+            moved.append(gid)
+        # 闭包按整批的边变更一次性维护
+        removed_edges, added_edges = move_groups(cursor, moved, target_parent_id)
+        moved_count = len(moved)
 
         new_version = increment_rules_version(
             conn, data.client_id, "batch_move_hierarchy",
-            f"group_ids={group_ids}, new_parent_id={target_parent_id}, moved={moved_count}"
+            f"group_ids={group_ids}, new_parent_id={target_parent_id}, moved={moved_count}",
+            edge_deletes(removed_edges) + edge_upserts(added_edges)
         )
         conn.commit()
 
@@ -802,6 +762,85 @@ async def batch_move_hierarchy(data: HierarchyBatchMoveRequest):
         }
 
 
+@router.post("/transaction")
+async def rules_transaction(data: RulesTransactionRequest):
+    """
+    规则事务：按顺序执行多个操作，在同一个 SQLite 事务中提交，只递增一次版本号。
+    版本检查在写锁内进行；任一操作失败则整体回滚，返回失败操作的序号与此前各操作的结果。
+    """
+    if not data.operations:
+        raise HTTPException(status_code=400, detail="operations must be a non-empty array")
+
+    graph = rules_graph.current()
+    with get_connection() as conn:
+        ensure_hierarchy_edges(conn)
+        cursor = conn.cursor()
+        # 立即取得写锁，版本检查与全部操作之间不会插入其他写操作
+        cursor.execute("BEGIN IMMEDIATE")
+        state = read_rules_state(cursor)
+        current_version = state[0]
+        if data.base_version != current_version:
+            conn.rollback()
+            return create_conflict_response(data.base_version, current_version)
+        if graph.state != state:
+            # 取快照之后、加锁之前规则被修改，按当前数据重新加载
+            graph = RulesGraph.load()
+
+        transaction = RulesTransaction(cursor, graph)
+        results: list[dict] = []
+        for index, operation in enumerate(data.operations):
+            try:
+                result = transaction.apply(operation)
+            except RuleOperationError as e:
+                conn.rollback()
+                return JSONResponse(
+                    status_code=e.status_code,
+                    content={
+                        "success": False,
+                        "error": e.detail,
+                        "failed_index": index,
+                        "results": results + [{"index": index, "op": operation.op, "success": False, "error": e.detail}]
+                    }
+                )
+            results.append({"index": index, "op": operation.op, "success": True, **result})
+
+        # 边表与闭包按整个事务的净变更一次性维护
+        transaction.finish()
+
+        new_version = increment_rules_version(
+            conn, data.client_id, "transaction",
+            f"operations={[operation.op for operation in data.operations]}",
+            transaction.changes
+        )
+        conn.commit()
+
+        return {
+            "success": True,
+            "version_id": new_version,
+            "new_version": new_version,
+            "refs": transaction.refs,
+            "results": results
+        }
+
+
+@router.get("/hierarchy/verify")
+async def verify_hierarchy():
+    """校验闭包表：与按边表全量推导的结果比较，返回缺失 / 多余 / 深度不符的行"""
+    with get_connection() as conn:
+        ensure_hierarchy_edges(conn)
+        return verify_hierarchy_closure(conn.cursor())
+
+
+@router.post("/hierarchy/rebuild")
+async def rebuild_hierarchy():
+    """按边表全量重建闭包表（修复增量维护之外产生的不一致），返回重建后的校验结果"""
+    with get_connection() as conn:
+        rebuild_hierarchy_from_edges(conn)
+        report = verify_hierarchy_closure(conn.cursor())
+    notify_rules_changed()
+    return report
+
+
 def rebuild_hierarchy_for_group(cursor, group_id: int, new_parent_id: int | None):
     """重建单个组的层级关系"""
     # 删除该组作为后代的所有关系（除了自己到自己）
@@ -857,11 +896,12 @@ async def legacy_add_group(data: LegacyGroupAddRequest):
             (name, None, 1 if data.is_enabled else 0)
         )
         group_id = cursor.lastrowid
-        rebuild_hierarchy_from_edges(conn)
+        add_group_closure(cursor, group_id)
 
         new_version = increment_rules_version(
             conn, data.client_id, "create_group",
-            f"name={name}, parent_id=None"
+            f"name={name}, parent_id=None",
+            [group_upsert(cursor, group_id)]
         )
         conn.commit()
 
@@ -892,7 +932,8 @@ async def legacy_update_group(data: LegacyGroupUpdateRequest):
 
         new_version = increment_rules_version(
             conn, data.client_id, "update_group",
-            f"group_id={data.group_id}, name={name}, enabled={data.is_enabled}"
+            f"group_id={data.group_id}, name={name}, enabled={data.is_enabled}",
+            [group_upsert(cursor, data.group_id)]
         )
         conn.commit()
 
@@ -919,7 +960,8 @@ async def legacy_toggle_group(data: LegacyGroupToggleRequest):
 
         new_version = increment_rules_version(
             conn, data.client_id, "toggle_group",
-            f"group_id={data.group_id}, enabled={data.is_enabled}"
+            f"group_id={data.group_id}, enabled={data.is_enabled}",
+            [group_upsert(cursor, data.group_id)]
         )
         conn.commit()
 
@@ -941,7 +983,7 @@ async def legacy_delete_group(data: LegacyGroupDeleteRequest):
         if not row:
             raise HTTPException(status_code=404, detail="规则组不存在")
 
-        all_group_ids = collect_descendants(cursor, data.group_id)
+        all_group_ids = rules_graph.current().descendants(data.group_id)
         deleted_count = len(all_group_ids)
 
         if all_group_ids:
@@ -955,11 +997,12 @@ async def legacy_delete_group(data: LegacyGroupDeleteRequest):
                 f"DELETE FROM search_groups WHERE id IN ({placeholders})",
                 all_group_ids
             )
-            rebuild_hierarchy_from_edges(conn)
+            remove_groups_closure(cursor, all_group_ids)
 
         new_version = increment_rules_version(
             conn, data.client_id, "delete_group",
-            f"group_id={data.group_id}, name={row['name']}"
+            f"group_id={data.group_id}, name={row['name']}",
+            [group_delete(gid) for gid in all_group_ids]
         )
         conn.commit()
 
@@ -983,6 +1026,7 @@ async def legacy_batch_group(data: LegacyGroupBatchRequest):
         ensure_hierarchy_edges(conn)
         cursor = conn.cursor()
         affected = 0
+        changes = []
 
         if data.action in {"enable", "disable"}:
             enabled_value = 1 if data.action == "enable" else 0
@@ -993,10 +1037,12 @@ async def legacy_batch_group(data: LegacyGroupBatchRequest):
                 )
                 if cursor.rowcount > 0:
                     affected += 1
+                    changes.append(group_upsert(cursor, gid))
         else:
+            graph = rules_graph.current()
             all_group_ids: list[int] = []
             for gid in data.group_ids:
-                all_group_ids.extend(collect_descendants(cursor, gid))
+                all_group_ids.extend(graph.descendants(gid))
             all_group_ids = list(set(all_group_ids))
 
             if all_group_ids:
@@ -1010,12 +1056,14 @@ async def legacy_batch_group(data: LegacyGroupBatchRequest):
                     f"DELETE FROM search_groups WHERE id IN ({placeholders})",
                     all_group_ids
                 )
-                rebuild_hierarchy_from_edges(conn)
+                remove_groups_closure(cursor, all_group_ids)
                 affected = len(all_group_ids)
+                changes = [group_delete(gid) for gid in all_group_ids]
 
         new_version = increment_rules_version(
             conn, data.client_id, "batch_group",
-            f"action={data.action}, group_ids={data.group_ids}, affected={affected}"
+            f"action={data.action}, group_ids={data.group_ids}, affected={affected}",
+            changes
         )
         conn.commit()
 
@@ -1046,7 +1094,8 @@ async def legacy_add_keyword(data: LegacyKeywordAddRequest):
 
         new_version = increment_rules_version(
             conn, data.client_id, "add_keyword",
-            f"keyword={data.keyword}, group_id={data.group_id}"
+            f"keyword={data.keyword}, group_id={data.group_id}",
+            [keyword_upsert(data.group_id, data.keyword)]
         )
         conn.commit()
 
@@ -1066,10 +1115,12 @@ async def legacy_remove_keyword(data: LegacyKeywordRemoveRequest):
             "DELETE FROM search_keywords WHERE group_id = ? AND keyword = ?",
             (data.group_id, data.keyword)
         )
+        removed = cursor.rowcount > 0
 
         new_version = increment_rules_version(
             conn, data.client_id, "remove_keyword",
-            f"keyword={data.keyword}, group_id={data.group_id}"
+            f"keyword={data.keyword}, group_id={data.group_id}",
+            [keyword_delete(data.group_id, data.keyword)] if removed else []
         )
         conn.commit()
 
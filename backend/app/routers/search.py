@@ -1,13 +1,61 @@
 """
 搜索路由 - 完整迁移旧项目搜索逻辑
 """
-from fastapi import APIRouter, Request
-from pydantic import BaseModel
-from ..database import get_connection
+import json
+from collections import Counter
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError
+from ..config import settings
+from ..database import get_connection, has_trigram_index
 from ..models.image import SearchRequest, SearchResponse
+from ..pagination import resolve_sort, encode_cursor, decode_cursor
+from ..rule_expansion import expansion_map
+from ..search_cache import SearchResultCache, current_generation, make_cache_key
+from ..search_engine import (
+    engine as bitmap_engine,
+    ascii_lower,
+    RESOLUTION_BUCKET_EDGES,
+    RESOLUTION_BUCKET_LABELS,
+)
+from ..shuffle import RANDOM_SORT, SeededPermutation, new_seed
+from ..search_trace import start_trace, trace_phase, traced
+from ..tag_index import tag_index
 
 router = APIRouter()
 
+# 搜索结果缓存（写操作提交后按数据代号整体失效）
+result_cache = SearchResultCache(settings.search_cache_size)
+
+# 总数缓存：键为去掉分页/排序字段后的筛选条件，翻页时复用（count_mode=cached）
+count_cache = SearchResultCache(settings.search_cache_size)
+
+# 与总数无关的请求字段
+PAGING_FIELDS = ("page", "page_size", "offset", "limit", "cursor", "sort_by", "count_mode", "seed")
+
+# 标签文本表达式（空串视为 NULL，与旧项目 LIKE 语义保持一致）
+TAGS_EXPR = "NULLIF(i.tags, '')"
+
+# 由 FTS5 MATCH 驱动的匹配方式（substring 保留旧版子串语义）
+FTS_MATCH_MODES = {"token", "prefix"}
+
+# 排序字段 -> 排序列（分页时追加 i.id 作为决胜列）
+SORT_COLUMNS = {
+    "date": ["i.created_at"],
+    "size": ["i.file_size"],
+    "resolution": ["i.height", "i.width"],
+    "tags": ["i.tag_count", "i.created_at"],
+    "frames": ["i.frame_count", "i.created_at"],
+    "duration": ["i.duration_ms", "i.created_at"],
+}
+
+# 随机排序单批探测的 id 数上限
+RANDOM_PROBE_BATCH_MAX = 4096
+
+# 随机排序：预计探测次数超过结果集的 1/RANDOM_PROBE_RATIO 时改为取出全部候选 ID
+# （逐个探测时每批都要重新求值筛选条件，代价高于按索引顺序读取）
+RANDOM_PROBE_RATIO = 4
+
 
 class AdvancedSearchRequest(BaseModel):
     """高级搜索请求（兼容旧项目二维数组格式）"""
@@ -25,218 +73,853 @@ class AdvancedSearchRequest(BaseModel):
     # 分页
     offset: int = 0
     limit: int = 50
-    # 排序：date_desc/asc, size_desc/asc, resolution_desc/asc
+    # 排序：date_desc/asc, size_desc/asc, resolution_desc/asc, tags_desc/asc, frames_desc/asc, duration_desc/asc, random
     sort_by: str = "date_desc"
+    # 键集分页游标（上一页返回的 next_cursor），提供时忽略 offset
+    cursor: str | None = None
     # 标签数量筛选
     min_tags: int = 0
     max_tags: int = -1  # -1 表示无限制
+    # 动图筛选：animated 为 True 仅动图、False 仅静态图；帧数与时长（毫秒）上下限
+    animated: bool | None = None
+    min_frames: int | None = None
+    max_frames: int | None = None
+    min_duration_ms: int | None = None
+    max_duration_ms: int | None = None
+    # 尺寸筛选：宽高比分类（wide / tall / square，多个为 OR）、最小宽高、像素数（百万像素）上下限
+    aspect: list[str] = []
+    min_width: int | None = None
+    min_height: int | None = None
+    min_megapixels: float | None = None
+    max_megapixels: float | None = None
+    # 关键词匹配方式：substring（子串，旧版 LIKE 语义）/ token（整词）/ prefix（前缀），后两者走 FTS5 MATCH
+    match_mode: str = "substring"
+    # 总数计算方式：exact（精确）/ none（不计数）/ estimate（计数上限截断）/ cached（复用同条件的已算总数）
+    count_mode: str = "exact"
+    # 随机排序（sort_by=random）的种子，未提供时由服务端生成并在响应中返回
+    seed: int | None = None
+
+
+class FacetRequest(AdvancedSearchRequest):
+    """分面统计请求：与高级搜索相同的筛选条件，分页/排序字段被忽略"""
+    top_n: int = Field(default=20, ge=1, le=200)
+
+
+class BatchSearchRequest(BaseModel):
+    """批量搜索请求：每项为一个 /api/search 请求体（简化或高级格式）"""
+    queries: list[dict] = Field(max_length=settings.search_batch_max_queries)
 
 
 def expand_tags_with_rules(tags: list[str]) -> list[str]:
-    """根据规则树膨胀标签（包含所有子节点关键词）"""
-    if not tags:
-        return []
+    """根据规则树膨胀标签（包含所有子节点关键词），查预计算的膨胀映射"""
+    return expansion_map.expand(tags)
 
-    expanded = set(tags)
 
-    with get_connection() as conn:
-        cursor = conn.cursor()
+def build_keyword_group_clause(keywords: list[str], params: list, correlated: bool = False) -> str | None:
+    """
+    将一组关键词（组内 OR）编译为走索引的子串匹配条件，语义与旧版 tags LIKE '%kw%' 一致：
+    - 3 字及以上：images_fts_trigram 三元组索引（可跨标签匹配，与整串 LIKE 相同）
+    - 1~2 字：tag_grams 短词索引找出包含该子串的标签，再经 image_tags 取图片
+    - 3 字及以上且无 trigram 索引：在标签词表 tags 上 LIKE，再经 image_tags 取图片
+    - 含 LIKE 通配符（% _）或空格、空关键词：退回整串 tags LIKE（通配符可匹配标签间的空格，
+      逐个标签匹配会漏掉这些结果）
+    correlated=True 时词表部分生成按 image_id 探测的 EXISTS 形式，用于排除条件，
+    避免把大标签的整个图片集合物化出来。
+    """
+    if not keywords:
+        return None
 
-        for tag in tags:
-            # 查找包含该关键词的组
-            cursor.execute("""
-                SELECT DISTINCT sg.id
-                FROM search_groups sg
-                JOIN search_keywords sk ON sg.id = sk.group_id
-                WHERE sk.keyword = ? AND sg.enabled = 1
-            """, (tag,))
+    trigram = has_trigram_index()
+    trigram_terms = []
+    gram_params = []
+    vocab_params = []
+    fallback_params = []
+    for kw in keywords:
+        if "%" in kw or "_" in kw or not kw:
+            # 通配符可跨标签（匹配分隔的空格），只能退回整串 LIKE
+            fallback_params.append(f"%{kw}%")
+        elif len(kw) >= 3 and trigram:
+            trigram_terms.append(fts_term(kw, prefix=False))
+        elif " " in kw:
+            # 含空格的短关键词可能跨标签命中，只能退回整串 LIKE
+            fallback_params.append(f"%{kw}%")
+        elif len(kw) <= 2:
+            gram_params.append(kw)
+        else:
+            vocab_params.append(f"%{kw}%")
 
-            group_ids = [row['id'] for row in cursor.fetchall()]
+    conditions = []
 
-            for group_id in group_ids:
-                # 获取所有子孙节点的关键词
-                cursor.execute("""
-                    SELECT DISTINCT sk.keyword
-                    FROM search_keywords sk
-                    JOIN search_hierarchy sh ON sk.group_id = sh.descendant_id
-                    JOIN search_groups sg ON sk.group_id = sg.id
-                    WHERE sh.ancestor_id = ? AND sg.enabled = 1
-                """, (group_id,))
+    tag_sources = []
+    if gram_params:
+        tag_sources.append(
+            f"SELECT g.tag_id FROM tag_grams g WHERE g.gram IN ({','.join(['lower(?)'] * len(gram_params))})"
+        )
+        params.extend(gram_params)
+    if vocab_params:
+        tag_sources.append(f"SELECT t.id FROM tags t WHERE {' OR '.join(['t.name LIKE ?'] * len(vocab_params))}")
+        params.extend(vocab_params)
+    if tag_sources:
+        tag_ids_sql = " UNION ".join(tag_sources)
+        if correlated:
+            # +it.tag_id 禁止按 tag_id 列表逐个探测，改为遍历该图片自身的少量标签
+            conditions.append(f"""EXISTS (
+                SELECT 1 FROM image_tags it
+                WHERE it.image_id = i.id AND +it.tag_id IN ({tag_ids_sql})
+            )""")
+        else:
+            conditions.append(f"""i.id IN (
+                SELECT it.image_id FROM image_tags it WHERE it.tag_id IN ({tag_ids_sql})
+            )""")
 
-                for row in cursor.fetchall():
-                    expanded.add(row['keyword'])
+    if trigram_terms:
+        conditions.append("i.id IN (SELECT rowid FROM images_fts_trigram WHERE images_fts_trigram MATCH ?)")
+        params.append(" OR ".join(trigram_terms))
 
-                # 也包含当前组的关键词
-                cursor.execute("""
-                    SELECT keyword FROM search_keywords WHERE group_id = ?
-                """, (group_id,))
+    for pattern in fallback_params:
+        conditions.append(f"{TAGS_EXPR} LIKE ?")
+        params.append(pattern)
 
-                for row in cursor.fetchall():
-                    expanded.add(row['keyword'])
+    return f"({' OR '.join(conditions)})"
 
-    return list(expanded)
 
+def fts_term(keyword: str, prefix: bool) -> str:
+    """将关键词转为 FTS5 短语（双引号转义），prefix=True 时追加前缀通配"""
+    phrase = '"' + keyword.replace('"', '""') + '"'
+    return f"{phrase}*" if prefix else phrase
+
+
+def fts_group(keywords: list[str], prefix: bool) -> str | None:
+    """一组关键词（组内 OR）-> FTS5 子表达式"""
+    terms = [fts_term(kw, prefix) for kw in keywords if kw.strip()]
+    if not terms:
+        return None
+    return f"({' OR '.join(terms)})"
+
+
+def compile_fts_query(
+    include_groups: list[list[str]],
+    exclude_groups: list[list[str]],
+    exclude_capsules: list[list[list[str]]],
+    match_mode: str,
+) -> tuple[str | None, str | None]:
+    """
+    将包含/排除/交集排除编译为 FTS5 MATCH 表达式。
+
+    Returns:
+        (positive, negative)：positive 为候选集表达式（已用 NOT 扣除排除项）；
+        没有包含条件时 FTS5 无法表达单独的 NOT，此时 positive 为 None，
+        排除项合并为 negative，由调用方以 NOT IN 方式使用。
+    """
+    prefix = match_mode == "prefix"
+
+    positives = [g for g in (fts_group(group, prefix) for group in include_groups) if g]
+
+    negatives = [g for g in (fts_group(group, prefix) for group in exclude_groups) if g]
+    for capsule in exclude_capsules:
+        parts = [g for g in (fts_group(group, prefix) for group in capsule) if g]
+        if parts:
+            negatives.append(f"({' AND '.join(parts)})")
+
+    if positives:
+        expr = f"({' AND '.join(positives)})"
+        for neg in negatives:
+            expr += f" NOT {neg}"
+        return expr, None
+
+    return None, (" OR ".join(negatives) if negatives else None)
+
+
+def build_fts_clauses(
+    include_groups: list[list[str]],
+    exclude_groups: list[list[str]],
+    exclude_capsules: list[list[list[str]]],
+    match_mode: str,
+    params: list,
+) -> list[str]:
+    """生成由 FTS5 索引驱动候选集的 WHERE 条件"""
+    positive, negative = compile_fts_query(include_groups, exclude_groups, exclude_capsules, match_mode)
+    clauses = []
+    if positive:
+        clauses.append("i.id IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+        params.append(positive)
+    elif negative:
+        clauses.append("i.id NOT IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+        params.append(negative)
+    return clauses
+
+
+def row_to_result(row) -> dict:
+    """将图片行转换为旧项目搜索结果格式"""
+    tags_text = row['tags'] if row['tags'] else ""
+    tags = tags_text.split(' ') if tags_text else []
+    return {
+        "md5": row['md5'],
+        "filename": row['filename'],
+        "tags": tags,
+        "w": row['width'],
+        "h": row['height'],
+        "size": row['file_size'],
+        "is_trash": 'trash_bin' in tags
+    }
+
+
+def build_tag_count_clauses(min_tags: int | None, max_tags: int | None, where_clauses: list, params: list) -> None:
+    """
+    标签数量筛选（走 idx_images_tag_count）。
+    上下限相同时（如 max_tags=0 的未打标视图）编译为等值条件，可直接按索引中的 created_at 顺序输出。
+    """
+    min_tags = min_tags if min_tags is not None and min_tags > 0 else 0
+    has_max = max_tags is not None and max_tags >= 0
+    if has_max and min_tags == max_tags:
+        where_clauses.append("i.tag_count = ?")
+        params.append(max_tags)
+        return
+
+    if min_tags > 0:
+        where_clauses.append("i.tag_count >= ?")
+        params.append(min_tags)
+    if has_max:
+        where_clauses.append("i.tag_count <= ?")
+        params.append(max_tags)
+
+
+def build_animation_clauses(request: SearchRequest | AdvancedSearchRequest, where_clauses: list, params: list) -> None:
+    """动图筛选（is_animated / frame_count / duration_ms 均有 (列, created_at) 索引）"""
+    if request.animated is not None:
+        where_clauses.append("i.is_animated = ?")
+        params.append(1 if request.animated else 0)
+    for column, op, value in (
+        ("i.frame_count", ">=", request.min_frames),
+        ("i.frame_count", "<=", request.max_frames),
+        ("i.duration_ms", ">=", request.min_duration_ms),
+        ("i.duration_ms", "<=", request.max_duration_ms),
+    ):
+        if value is not None:
+            where_clauses.append(f"{column} {op} ?")
+            params.append(value)
+
+
+def build_dimension_clauses(request: SearchRequest | AdvancedSearchRequest, where_clauses: list, params: list) -> None:
+    """尺寸筛选：宽高比分类走 idx_images_aspect，像素数走 idx_images_megapixels"""
+    if request.aspect:
+        aspects = sorted(set(request.aspect))
+        where_clauses.append(f"i.aspect IN ({','.join(['?'] * len(aspects))})")
+        params.extend(aspects)
+    for column, op, value in (
+        ("i.width", ">=", request.min_width),
+        ("i.height", ">=", request.min_height),
+        ("i.megapixels", ">=", request.min_megapixels),
+        ("i.megapixels", "<=", request.max_megapixels),
+    ):
+        if value is not None:
+            where_clauses.append(f"{column} {op} ?")
+            params.append(value)
+
+
+def build_extension_clause(extensions: list[str], params: list) -> str:
+    """
+    扩展名匹配条件（任一命中）。
+    普通扩展名编译为 i.ext IN (...) 走 idx_images_ext；含点、通配符或为空的
+    仍按旧版 filename LIKE '%.ext' 整串匹配（LIKE 本身 ASCII 大小写不敏感）。
+    """
+    plain = [ascii_lower(ext) for ext in extensions if ext and not any(ch in ext for ch in ".%_")]
+    patterns = [f"%.{ext}" for ext in extensions if not ext or any(ch in ext for ch in ".%_")]
+
+    conditions = []
+    if plain:
+        conditions.append(f"i.ext IN ({','.join(['?'] * len(plain))})")
+        params.extend(plain)
+    for pattern in patterns:
+        conditions.append("i.filename LIKE ?")
+        params.append(pattern)
+    return f"({' OR '.join(conditions)})"
+
+
+def count_cache_key(kind: str, payload: dict) -> str:
+    """总数缓存键：只保留影响结果集的筛选字段"""
+    return make_cache_key(kind, {k: v for k, v in payload.items() if k not in PAGING_FIELDS})
+
+
+def count_matches(cursor, where_sql: str, params: list, count_mode: str, cache_key: str) -> tuple[int | None, bool]:
+    """
+    按 count_mode 计算总数，返回 (总数, 是否为截断值)。
+    - none: 不计数，总数为 None
+    - estimate: 最多数到上限，超出时返回上限并标记截断
+    - cached: 复用同一筛选条件已算出的总数，未命中时精确计数
+    - exact: 精确计数（结果同样写入总数缓存，供后续翻页复用）
+    """
+    if count_mode == "none":
+        return None, False
+
+    if count_mode == "estimate":
+        cap = settings.search_count_estimate_cap
+        cursor.execute(
+            f"SELECT COUNT(*) as total FROM (SELECT 1 FROM images i WHERE {where_sql} LIMIT ?)",
+            params + [cap + 1]
+        )
+        total = cursor.fetchone()['total']
+        return (cap, True) if total > cap else (total, False)
+
+    if count_mode == "cached":
+        cached = count_cache.get(cache_key)
+        if cached is not None:
+            return cached["total"], False
+
+    generation = current_generation()
+    cursor.execute(f"SELECT COUNT(*) as total FROM images i WHERE {where_sql}", params)
+    total = cursor.fetchone()['total']
+    count_cache.put(cache_key, generation, {"total": total})
+    return total, False
+
+
+def row_sort_keys(row, field: str) -> list:
+    """从图片行取出排序字段的值（与 SORT_COLUMNS 对应）"""
+    if field == "size":
+        return [row['file_size']]
+    if field == "resolution":
+        return [row['height'], row['width']]
+    if field == "tags":
+        return [row['tag_count'], row['created_at']]
+    if field == "frames":
+        return [row['frame_count'], row['created_at']]
+    if field == "duration":
+        return [row['duration_ms'], row['created_at']]
+    return [row['created_at']]
+
+
+def parse_cursor(cursor_token: str, field: str, descending: bool) -> tuple[list, int]:
+    """解码请求中的游标，无效时返回 400"""
+    try:
+        return decode_cursor(cursor_token, field, descending)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def fetch_page(
+    cursor,
+    where_sql: str,
+    params: list,
+    sort_by: str,
+    limit: int,
+    offset: int,
+    cursor_token: str | None = None,
+) -> tuple[list[dict], str | None]:
+    """
+    按排序方式读取一页结果，返回 (结果列表, 下一页游标)。
+
+    提供游标时按 (排序列..., id) 做键集定位，深翻页与首页代价相同；
+    否则退回 LIMIT/OFFSET。
+    """
+    field, descending = resolve_sort(sort_by)
+    columns = SORT_COLUMNS[field] + ["i.id"]
+    direction = "DESC" if descending else "ASC"
+    order_sql = ", ".join(f"{col} {direction}" for col in columns)
+
+    page_params = list(params)
+    if cursor_token:
+        keys, last_id = parse_cursor(cursor_token, field, descending)
+        if len(keys) != len(columns) - 1:
+            raise HTTPException(status_code=400, detail="无效的游标")
+        op = "<" if descending else ">"
+        where_sql = f"{where_sql} AND ({', '.join(columns)}) {op} ({', '.join(['?'] * len(columns))})"
+        page_params.extend(keys + [last_id])
+        offset = 0
+
+    query = f"""
+        SELECT i.*
+        FROM images i
+        WHERE {where_sql}
+        ORDER BY {order_sql}
+        LIMIT ? OFFSET ?
+    """
+    with trace_phase("page"):
+        cursor.execute(query, page_params + [limit, offset])
+        rows = cursor.fetchall()
+
+    next_cursor = None
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        next_cursor = encode_cursor(field, descending, row_sort_keys(last, field), last['id'])
+
+    with trace_phase("serialize"):
+        return [row_to_result(row) for row in rows], next_cursor
+
+
+def hydrate_page(cursor, image_ids: list[int], sort_by: str, limit: int) -> tuple[list[dict], str | None]:
+    """按给定 ID 顺序回表读取一页结果，返回 (结果列表, 下一页游标)"""
+    if not image_ids:
+        return [], None
+    placeholders = ",".join(["?"] * len(image_ids))
+    with trace_phase("page"):
+        cursor.execute(f"SELECT * FROM images WHERE id IN ({placeholders})", image_ids)
+        rows = {row['id']: row for row in cursor.fetchall()}
+
+    ordered = [rows[image_id] for image_id in image_ids if image_id in rows]
+    next_cursor = None
+    if ordered and len(image_ids) == limit:
+        field, descending = resolve_sort(sort_by)
+        last = ordered[-1]
+        next_cursor = encode_cursor(field, descending, row_sort_keys(last, field), last['id'])
+    with trace_phase("serialize"):
+        return [row_to_result(row) for row in ordered], next_cursor
+
+
+def fetch_random_page(
+    cursor,
+    where_sql: str,
+    params: list,
+    seed: int,
+    total: int | None,
+    limit: int,
+    offset: int,
+    cursor_token: str | None = None,
+) -> tuple[list[dict], str | None, int]:
+    """
+    随机排序读取一页，返回 (结果列表, 下一页游标, 种子)。
+
+    图片按种子置换的 rank 排序；游标记录 (种子, 上一页最后的 rank)，
+    提供游标时从该 rank 之后继续探测，代价约为一页。
+    """
+    start_rank = 0
+    if cursor_token:
+        keys, last_rank = parse_cursor(cursor_token, RANDOM_SORT, False)
+        if len(keys) != 1 or not isinstance(keys[0], int):
+            raise HTTPException(status_code=400, detail="无效的游标")
+        seed, start_rank, offset = keys[0], last_rank + 1, 0
+
+    cursor.execute("SELECT MAX(id) as max_id FROM images")
+    max_id = cursor.fetchone()['max_id']
+    if not max_id or total == 0:
+        return [], None, seed
+    permutation = SeededPermutation(seed, max_id.bit_length())
+    need = offset + limit
+
+    ranked: list[tuple[int, int]] = []
+    # 预计探测次数 need * max_id / total 相对结果集过多时，直接取出全部 ID 按 rank 排序
+    if total is not None and need * max_id * RANDOM_PROBE_RATIO > total * total:
+        with trace_phase("page"):
+            cursor.execute(f"SELECT i.id FROM images i WHERE {where_sql}", params)
+            ranks = (permutation.inverse(row['id']) for row in cursor.fetchall())
+            ranked = sorted((rank, permutation.forward(rank)) for rank in ranks if rank >= start_rank)[:need]
+    else:
+        # 按结果集密度估计首批探测量，之后每批翻倍
+        batch = need * 2 if total is None else need * max_id // total + limit
+        rank = start_rank
+        with trace_phase("page"):
+            while rank < permutation.size and len(ranked) < need:
+                end = min(rank + min(batch, RANDOM_PROBE_BATCH_MAX), permutation.size)
+                probes = [permutation.forward(r) for r in range(rank, end)]
+                # CROSS JOIN 固定以探测列表为外层，逐个按主键回表
+                cursor.execute(f"""
+                    SELECT p.key as position
+                    FROM json_each(?) p CROSS JOIN images i ON i.id = p.value
+                    WHERE {where_sql}
+                """, [json.dumps(probes)] + params)
+                matched = sorted(row['position'] for row in cursor.fetchall())
+                ranked.extend((rank + position, probes[position]) for position in matched)
+                rank = end
+                batch *= 2
+        ranked = ranked[:need]
+
+    page = ranked[offset:need]
+    results, _ = hydrate_page(cursor, [image_id for _, image_id in page], RANDOM_SORT, limit)
+    next_cursor = None
+    if len(page) == limit:
+        next_cursor = encode_cursor(RANDOM_SORT, False, [seed], page[-1][0])
+    return results, next_cursor, seed
+
+
+def build_simple_where(request: SearchRequest, expanded_include: list[str]) -> tuple[str, list]:
+    """构建简化搜索的 WHERE 子句"""
+    where_clauses = ["1=1"]
+    params = []
+
+    # 排除标签（与旧版 NULL NOT LIKE 语义一致：存在排除条件时无标签图片不返回）
+    if request.exclude_tags:
+        where_clauses.append(f"{TAGS_EXPR} IS NOT NULL")
+
+    if request.match_mode in FTS_MATCH_MODES:
+        where_clauses.extend(build_fts_clauses(
+            [expanded_include], [[tag] for tag in request.exclude_tags], [], request.match_mode, params
+        ))
+    else:
+        # 包含标签（OR 关系）
+        include_clause = build_keyword_group_clause(expanded_include, params)
+        if include_clause:
+            where_clauses.append(include_clause)
+
+        for exclude_tag in request.exclude_tags:
+            where_clauses.append(f"NOT {build_keyword_group_clause([exclude_tag], params, correlated=True)}")
+
+    # 标签数量过滤
+    build_tag_count_clauses(request.min_tags, request.max_tags, where_clauses, params)
+
+    # 动图筛选
+    build_animation_clauses(request, where_clauses, params)
+
+    # 尺寸筛选
+    build_dimension_clauses(request, where_clauses, params)
+
+    # 扩展名过滤
+    if request.extensions:
+        where_clauses.append(build_extension_clause(request.extensions, params))
+
+    # 排除扩展名
+    if request.exclude_extensions:
+        where_clauses.append(f"NOT {build_extension_clause(request.exclude_extensions, params)}")
+
+    return " AND ".join(where_clauses), params
+
+
+def search_window(request: SearchRequest | AdvancedSearchRequest) -> tuple[int, int]:
+    """请求的分页窗口 (limit, offset)"""
+    if isinstance(request, SearchRequest):
+        return request.page_size, (request.page - 1) * request.page_size
+    return request.limit, request.offset
+
+
+def run_search(cursor, request: SearchRequest | AdvancedSearchRequest, where_sql: str, params: list, count_key: str) -> dict:
+    """在给定连接上按 WHERE 子句计数并读取一页"""
+    limit, offset = search_window(request)
+
+    # 获取总数
+    with trace_phase("count"):
+        total, total_capped = count_matches(cursor, where_sql, params, request.count_mode, count_key)
+
+    if request.sort_by == RANDOM_SORT:
+        results, next_cursor, seed = fetch_random_page(
+            cursor, where_sql, params, request.seed, None if total_capped else total, limit, offset, request.cursor
+        )
+        return {"total": total, "total_capped": total_capped, "results": results, "next_cursor": next_cursor, "seed": seed}
+
+    # 分页查询
+    results, next_cursor = fetch_page(
+        cursor, where_sql, params, request.sort_by, limit, offset, request.cursor
+    )
+
+    return {"total": total, "total_capped": total_capped, "results": results, "next_cursor": next_cursor}
+
+
+def prepare_simple_search(request: SearchRequest, expand=expand_tags_with_rules) -> tuple[str, list, str]:
+    """简化搜索：膨胀标签并构建 (WHERE 子句, 参数, 总数缓存键)"""
+    include_tags = request.include_tags
+    # 容错模式：先把每个标签扩展为词表中拼写相近的标签
+    if request.fuzzy:
+        include_tags = tag_index.fuzzy_expand(include_tags)
 
-async def search_images_simple(request: SearchRequest) -> SearchResponse:
-    """搜索图片（简化版，兼容新前端）"""
     # 根据 expand 参数决定是否膨胀标签
     if request.expand:
-        expanded_include = expand_tags_with_rules(request.include_tags)
+        expanded_include = expand(include_tags)
     else:
-        expanded_include = request.include_tags
+        expanded_include = include_tags
+
+    where_sql, params = build_simple_where(request, expanded_include)
+    return where_sql, params, count_cache_key("simple", normalize_simple_request(request))
+
+
+async def search_images_simple(request: SearchRequest) -> SearchResponse:
+    """搜索图片（简化版，兼容新前端）"""
+    with trace_phase("expansion"):
+        where_sql, params, count_key = prepare_simple_search(request)
 
     with get_connection() as conn:
-        cursor = conn.cursor()
+        result = run_search(traced(conn.cursor()), request, where_sql, params, count_key)
+    return attach_did_you_mean(request, result)
 
-        # 构建查询
-        where_clauses = ["1=1"]
-        params = []
-        tags_expr = "NULLIF(f.tags, '')"
 
-        # 包含标签（OR 关系）
-        if expanded_include:
-            or_conditions = []
-            for tag in expanded_include:
-                or_conditions.append(f"{tags_expr} LIKE ?")
-                params.append(f"%{tag}%")
-            where_clauses.append(f"({' OR '.join(or_conditions)})")
-
-        # 排除标签
-        for exclude_tag in request.exclude_tags:
-            where_clauses.append(f"{tags_expr} NOT LIKE ?")
-            params.append(f"%{exclude_tag}%")
-
-        # 标签数量过滤
-        tag_count_expr = """
-            CASE
-                WHEN {tags_expr} IS NULL OR {tags_expr} = '' THEN 0
-                ELSE LENGTH({tags_expr}) - LENGTH(REPLACE({tags_expr}, ' ', '')) + 1
-            END
-        """.format(tags_expr=tags_expr)
-
-        if request.min_tags is not None and request.min_tags > 0:
-            where_clauses.append(f"({tag_count_expr}) >= ?")
-            params.append(request.min_tags)
-
-        if request.max_tags is not None and request.max_tags >= 0:
-            where_clauses.append(f"({tag_count_expr}) <= ?")
-            params.append(request.max_tags)
-
-        # 扩展名过滤
-        if request.extensions:
-            ext_conditions = []
-            for ext in request.extensions:
-                ext_conditions.append("LOWER(i.filename) LIKE ?")
-                params.append(f"%.{ext.lower()}")
-            where_clauses.append(f"({' OR '.join(ext_conditions)})")
-
-        # 排除扩展名
-        if request.exclude_extensions:
-            for ext in request.exclude_extensions:
-                where_clauses.append("LOWER(i.filename) NOT LIKE ?")
-                params.append(f"%.{ext.lower()}")
-
-        where_sql = " AND ".join(where_clauses)
-
-        # 获取总数
-        count_query = f"""
-            SELECT COUNT(*) as total
-            FROM images i
-            LEFT JOIN images_fts f ON i.id = f.rowid
-            WHERE {where_sql}
-        """
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
+def attach_did_you_mean(request: SearchRequest, result: dict) -> dict:
+    """首页无结果时，为词表中不存在的包含标签附上拼写相近的建议"""
+    if result["results"] or request.cursor or request.page > 1:
+        return result
+    suggestions = {}
+    for tag in request.include_tags:
+        if tag in tag_index.counts:
+            continue
+        names = [match["name"] for match in tag_index.fuzzy(tag, limit=5)]
+        if names:
+            suggestions[tag] = names
+    if suggestions:
+        result["did_you_mean"] = suggestions
+    return result
 
-        # 排序
-        sort_map = {
-            "time_desc": "i.created_at DESC",
-            "time_asc": "i.created_at ASC",
-            "tags_desc": f"({tag_count_expr}) DESC",
-            "tags_asc": f"({tag_count_expr}) ASC",
-            "size_desc": "i.file_size DESC",
-            "size_asc": "i.file_size ASC",
-            "resolution_desc": "i.height DESC, i.width DESC",
-            "resolution_asc": "i.height ASC, i.width ASC",
-        }
-        order_by = sort_map.get(request.sort_by, "i.created_at DESC")
-
-        # 分页查询
-        offset = (request.page - 1) * request.page_size
-        paginated_query = f"""
-            SELECT i.*, f.tags as tags_text
-            FROM images i
-            LEFT JOIN images_fts f ON i.id = f.rowid
-            WHERE {where_sql}
-            ORDER BY {order_by}
-            LIMIT ? OFFSET ?
-        """
-        params.extend([request.page_size, offset])
-
-        cursor.execute(paginated_query, params)
-        rows = cursor.fetchall()
 
-        results = []
-        for row in rows:
-            tags_text = row['tags_text'] if row['tags_text'] else row['tags']
-            tags = tags_text.split(' ') if tags_text else []
-            results.append({
-                "md5": row['md5'],
-                "filename": row['filename'],
-                "tags": tags,
-                "w": row['width'],
-                "h": row['height'],
-                "size": row['file_size'],
-                "is_trash": 'trash_bin' in tags
-            })
+def sorted_groups(groups: list[list[str]]) -> list[list[str]]:
+    """关键词组规范化：组内去重排序（OR），组间排序（AND）"""
+    return sorted(sorted(set(group)) for group in groups)
+
+
+def normalize_simple_request(request: SearchRequest) -> dict:
+    """简化搜索请求规范化（顺序无关的字段排序去重），作为缓存键"""
+    payload = request.model_dump()
+    for field in ("include_tags", "exclude_tags", "extensions", "exclude_extensions", "aspect"):
+        payload[field] = sorted(set(payload[field]))
+    return payload
+
+
+def normalize_advanced_request(request: AdvancedSearchRequest) -> dict:
+    """高级搜索请求规范化（顺序无关的字段排序去重），作为缓存键"""
+    payload = request.model_dump()
+    payload["keywords"] = sorted_groups(request.keywords)
+    payload["excludes"] = sorted_groups(request.excludes)
+    payload["excludes_and"] = sorted(sorted_groups(capsule) for capsule in request.excludes_and)
+    for field in ("extensions", "exclude_extensions", "aspect"):
+        payload[field] = sorted(set(payload[field]))
+    return payload
+
+
+def parse_search_payload(data, loc: tuple = ("body",)) -> tuple[SearchRequest | AdvancedSearchRequest, str | None]:
+    """
+    按字段判断请求格式（旧项目高级搜索/新项目简化搜索），返回 (请求对象, 结果缓存键)。
+    随机种子由服务端生成时缓存键为 None：该结果不会再被命中，不写入缓存以免挤掉有用的条目。
+    校验失败时抛出 RequestValidationError（422），错误位置以 loc 为前缀（批量搜索带上请求序号）。
+    """
+    if not isinstance(data, dict):
+        raise RequestValidationError([
+            {"type": "dict_type", "loc": loc, "msg": "Input should be a valid dictionary", "input": data}
+        ])
+    advanced = "keywords" in data or "excludes" in data or "excludes_and" in data
+    try:
+        search_request = AdvancedSearchRequest(**data) if advanced else SearchRequest(**data)
+    except ValidationError as e:
+        raise RequestValidationError([
+            {**error, "loc": loc + tuple(error["loc"])} for error in e.errors(include_url=False)
+        ])
+    if assign_random_seed(search_request):
+        return search_request, None
+    if advanced:
+        return search_request, make_cache_key("advanced", normalize_advanced_request(search_request))
+    return search_request, make_cache_key("simple", normalize_simple_request(search_request))
+
 
-        return {"total": total, "results": results}
+def assign_random_seed(request: SearchRequest | AdvancedSearchRequest) -> bool:
+    """随机排序未提供种子时生成一个（在计算缓存键之前，避免命中其他请求的随机结果），返回是否生成了种子"""
+    if request.sort_by == RANDOM_SORT and request.seed is None and not request.cursor:
+        request.seed = new_seed()
+        return True
+    return False
 
 
 @router.post("/search")
-async def search_images(request: Request):
-    """搜索图片（兼容旧项目高级搜索/新项目简化搜索）"""
-    data = await request.json()
-    if isinstance(data, dict) and (
-        "keywords" in data or "excludes" in data or "excludes_and" in data
-    ):
-        return await advanced_search(AdvancedSearchRequest(**data))
+async def search_images(
+    request: Request,
+    debug: bool = False,
+    x_search_debug: str | None = Header(default=None),
+):
+    """
+    搜索图片（兼容旧项目高级搜索/新项目简化搜索）
 
-    return await search_images_simple(SearchRequest(**data))
+    调试模式（?debug=true 或请求头 X-Search-Debug: 1）：绕过结果缓存，
+    响应附带 debug 字段，包含执行的 SQL、绑定参数、EXPLAIN QUERY PLAN
+    与各阶段耗时（expansion / count / page / serialize，位图引擎为 bitmap）。
+    """
+    search_request, cache_key = parse_search_payload(await request.json())
 
+    if debug or x_search_debug not in (None, "", "0", "false"):
+        with start_trace() as trace:
+            if isinstance(search_request, AdvancedSearchRequest):
+                result = await advanced_search(search_request)
+            else:
+                result = await search_images_simple(search_request)
+        with get_connection() as conn:
+            return {**result, "debug": trace.report(conn.cursor())}
 
-async def advanced_search(request: AdvancedSearchRequest):
+    if cache_key is not None:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    generation = current_generation()
+    if isinstance(search_request, AdvancedSearchRequest):
+        result = await advanced_search(search_request)
+    else:
+        result = await search_images_simple(search_request)
+    if cache_key is not None:
+        result_cache.put(cache_key, generation, result)
+    return result
+
+
+@router.post("/search/batch")
+async def batch_search(data: BatchSearchRequest):
     """
-    高级搜索（完全兼容旧项目搜索逻辑）
-    - keywords: 二维数组，每个子数组是一个标签膨胀后的关键词列表（子数组内OR，子数组间AND）
-    - excludes: 二维数组，每个子数组是一个排除标签膨胀后的关键词列表（子数组内OR，子数组间AND排除）
-    - excludes_and: 三维数组，交集排除
+    批量搜索：多个简化/高级搜索请求在同一连接上执行，按请求顺序返回。
+    - 规范化后相同的请求只执行一次
+    - 同一批次内规则膨胀共用一次结果
+    - 筛选条件相同（仅分页/排序/计数方式不同）的请求共用一张临时候选表
     """
-    where_clauses = ["1=1"]
-    params = []
-    tags_expr = "NULLIF(f.tags, '')"
+    parsed = [
+        parse_search_payload(payload, ("body", "queries", index))
+        for index, payload in enumerate(data.queries)
+    ]
+    responses: list[dict | None] = [None] * len(parsed)
+    generation = current_generation()
+
+    # 规范化后相同的请求只保留第一个，其余复用其结果（owner 为结果所在的请求序号）；
+    # 服务端生成随机种子的请求没有缓存键，各自执行
+    owner = list(range(len(parsed)))
+    first_index: dict[str, int] = {}
+    pending: list[int] = []
+    for index, (search_request, cache_key) in enumerate(parsed):
+        if cache_key is not None:
+            if cache_key in first_index:
+                owner[index] = first_index[cache_key]
+                continue
+            first_index[cache_key] = index
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                responses[index] = cached
+                continue
+        pending.append(index)
+
+    expansions: dict[tuple[str, ...], list[str]] = {}
+
+    def expand_once(tags: list[str]) -> list[str]:
+        key = tuple(tags)
+        if key not in expansions:
+            expansions[key] = expand_tags_with_rules(tags)
+        return expansions[key]
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        plans: dict[int, tuple[str, list, str]] = {}
+        for index in pending:
+            search_request = parsed[index][0]
+            if isinstance(search_request, AdvancedSearchRequest):
+                result = search_bitmap(cursor, search_request)
+                if result is not None:
+                    responses[index] = result
+                    continue
+                plans[index] = prepare_advanced_search(search_request)
+            else:
+                plans[index] = prepare_simple_search(search_request, expand=expand_once)
+
+        # 多个请求共用的筛选条件先物化为临时候选表
+        usage = Counter((where_sql, tuple(params)) for where_sql, params, _ in plans.values())
+        shared: dict[tuple, str] = {}
+        for index, (where_sql, params, count_key) in plans.items():
+            condition = (where_sql, tuple(params))
+            if usage[condition] > 1:
+                if condition not in shared:
+                    table = f"batch_candidates_{len(shared)}"
+                    cursor.execute(f"CREATE TEMP TABLE {table} AS SELECT i.id FROM images i WHERE {where_sql}", params)
+                    shared[condition] = f"i.id IN (SELECT id FROM temp.{table})"
+                where_sql, params = shared[condition], []
+            responses[index] = run_search(cursor, parsed[index][0], where_sql, params, count_key)
+            if isinstance(parsed[index][0], SearchRequest):
+                responses[index] = attach_did_you_mean(parsed[index][0], responses[index])
+
+    for index in pending:
+        if parsed[index][1] is not None:
+            result_cache.put(parsed[index][1], generation, responses[index])
+
+    return {"responses": [responses[owner[index]] for index in range(len(parsed))]}
+
 
+def resolution_bucket_sql() -> str:
+    """分辨率桶下标表达式（按长边，与位图引擎的 resolution_bucket 一致）"""
+    long_edge = "MAX(COALESCE(i.width, 0), COALESCE(i.height, 0))"
+    cases = " ".join(f"WHEN {long_edge} < {edge} THEN {index}" for index, edge in enumerate(RESOLUTION_BUCKET_EDGES))
+    return f"CASE {cases} ELSE {len(RESOLUTION_BUCKET_EDGES)} END"
+
+
+def format_facets(total: int, tags: list[dict], extensions: dict[str, int], resolutions: dict[int, int]) -> dict:
+    """统一分面响应格式：扩展名按数量降序，分辨率桶按从小到大（含 0 计数的桶）"""
+    return {
+        "total": total,
+        "tags": tags,
+        "extensions": [
+            {"ext": ext, "count": count}
+            for ext, count in sorted(extensions.items(), key=lambda item: (-item[1], item[0]))
+            if count
+        ],
+        "resolutions": [
+            {"bucket": label, "count": resolutions.get(index, 0)}
+            for index, label in enumerate(RESOLUTION_BUCKET_LABELS)
+        ],
+    }
+
+
+def compute_facets(cursor, where_sql: str, params: list, top_n: int) -> dict:
+    """在 SQL 上计算分面：标签经 image_tags 分组计数，扩展名与分辨率桶一次扫描完成"""
+    # 先求结果集 ID，再按 image_id 索引取标签分组计数（比逐行 JOIN 后分组快）
+    cursor.execute(f"""
+        SELECT t.name AS tag, x.count AS count
+        FROM (
+            SELECT it.tag_id, COUNT(*) AS count
+            FROM image_tags it
+            WHERE it.image_id IN (SELECT i.id FROM images i WHERE {where_sql})
+            GROUP BY it.tag_id
+        ) x
+        JOIN tags t ON t.id = x.tag_id
+        ORDER BY x.count DESC, t.name
+        LIMIT ?
+    """, params + [top_n])
+    tags = [{"tag": row['tag'], "count": row['count']} for row in cursor.fetchall()]
+
+    cursor.execute(f"""
+        SELECT i.ext AS ext, {resolution_bucket_sql()} AS bucket, COUNT(*) AS count
+        FROM images i
+        WHERE {where_sql}
+        GROUP BY 1, 2
+    """, params)
+    total = 0
+    extensions: dict[str, int] = {}
+    resolutions: dict[int, int] = {}
+    for row in cursor.fetchall():
+        total += row['count']
+        extensions[row['ext']] = extensions.get(row['ext'], 0) + row['count']
+        resolutions[row['bucket']] = resolutions.get(row['bucket'], 0) + row['count']
+
+    return format_facets(total, tags, extensions, resolutions)
+
+
+@router.post("/search/facets")
+async def search_facets(request: FacetRequest):
+    """
+    分面统计：对整个匹配结果集统计共现标签 Top-N、扩展名与分辨率桶分布。
+    开启位图引擎时在位图交集上计算，否则在 SQL 上聚合，均不读取结果行。
+    """
+    cache_key = make_cache_key("facets", {**normalize_advanced_request(request), "top_n": request.top_n})
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    generation = current_generation()
+    facets = None
+    if settings.bitmap_search_enabled:
+        facets = bitmap_engine.facets(request, request.top_n)
+        if facets is not None:
+            facets = format_facets(facets["total"], facets["tags"], facets["extensions"], facets["resolutions"])
+
+    if facets is None:
+        where_sql, params = build_advanced_where(request)
+        with get_connection() as conn:
+            facets = compute_facets(conn.cursor(), where_sql, params, request.top_n)
+
+    result_cache.put(cache_key, generation, facets)
+    return facets
+
+
+@router.get("/search/cache/stats")
+async def get_search_cache_stats():
+    """搜索结果缓存与总数缓存的命中统计"""
+    return {**result_cache.stats(), "count_cache": count_cache.stats()}
+
+
+def build_substring_clauses(request: AdvancedSearchRequest, where_clauses: list[str], params: list) -> None:
+    """子串模式（旧版 LIKE 语义）的关键词条件"""
     # 处理包含关键词组（AND 关系，每组内部是 OR 关系）
     for kw_group in request.keywords:
-        if not kw_group:
-            continue
-        or_conditions = []
-        for kw in kw_group:
-            or_conditions.append(f"{tags_expr} LIKE ?")
-            params.append(f"%{kw}%")
-        if or_conditions:
-            where_clauses.append(f"({' OR '.join(or_conditions)})")
+        group_clause = build_keyword_group_clause(kw_group, params)
+        if group_clause:
+            where_clauses.append(group_clause)
 
     # 处理排除关键词组（AND 排除，每组内部是 OR 关系 -> 任一命中即排除）
     for ex_group in request.excludes:
-        if not ex_group:
-            continue
-        or_conditions = []
-        for ex in ex_group:
-            or_conditions.append(f"{tags_expr} LIKE ?")
-            params.append(f"%{ex}%")
-        if or_conditions:
-            where_clauses.append(f"NOT ({' OR '.join(or_conditions)})")
+        group_clause = build_keyword_group_clause(ex_group, params, correlated=True)
+        if group_clause:
+            where_clauses.append(f"NOT {group_clause}")
 
     # 处理交集排除关键词组（每个胶囊内的多个关键词组需要同时匹配才排除）
     for capsule in request.excludes_and:
@@ -244,106 +927,93 @@ async def advanced_search(request: AdvancedSearchRequest):
             continue
         and_conditions = []
         for kw_group in capsule:
-            if not kw_group:
-                continue
-            or_conditions = []
-            for kw in kw_group:
-                or_conditions.append(f"{tags_expr} LIKE ?")
-                params.append(f"%{kw}%")
-            if or_conditions:
-                and_conditions.append(f"({' OR '.join(or_conditions)})")
+            group_clause = build_keyword_group_clause(kw_group, params, correlated=True)
+            if group_clause:
+                and_conditions.append(group_clause)
         if and_conditions:
             where_clauses.append(f"NOT ({' AND '.join(and_conditions)})")
 
+
+def build_advanced_where(request: AdvancedSearchRequest) -> tuple[str, list]:
+    """构建高级搜索的 WHERE 子句"""
+    where_clauses = ["1=1"]
+    params = []
+
+    # 与旧版 NULL 语义一致：存在排除条件时无标签图片不返回
+    if any(request.excludes) or any(any(capsule) for capsule in request.excludes_and):
+        where_clauses.append(f"{TAGS_EXPR} IS NOT NULL")
+
+    if request.match_mode in FTS_MATCH_MODES:
+        where_clauses.extend(build_fts_clauses(
+            request.keywords, request.excludes, request.excludes_and, request.match_mode, params
+        ))
+    else:
+        build_substring_clauses(request, where_clauses, params)
+
     # 处理包含扩展名
     if request.extensions:
-        ext_conditions = []
-        for ext in request.extensions:
-            clean_ext = ext.lstrip('.')
-            ext_conditions.append("i.filename LIKE ?")
-            params.append(f"%.{clean_ext}")
-        if ext_conditions:
-            where_clauses.append(f"({' OR '.join(ext_conditions)})")
+        where_clauses.append(build_extension_clause([ext.lstrip('.') for ext in request.extensions], params))
 
     # 处理排除扩展名
     if request.exclude_extensions:
-        ext_conditions = []
-        for ext in request.exclude_extensions:
-            clean_ext = ext.lstrip('.')
-            ext_conditions.append("i.filename LIKE ?")
-            params.append(f"%.{clean_ext}")
-        if ext_conditions:
-            where_clauses.append(f"NOT ({' OR '.join(ext_conditions)})")
+        exclude = [ext.lstrip('.') for ext in request.exclude_extensions]
+        where_clauses.append(f"NOT {build_extension_clause(exclude, params)}")
 
     # 标签数量筛选
-    tag_count_expr = """
-        CASE
-            WHEN {tags_expr} IS NULL OR {tags_expr} = '' THEN 0
-            ELSE LENGTH({tags_expr}) - LENGTH(REPLACE({tags_expr}, ' ', '')) + 1
-        END
-    """.format(tags_expr=tags_expr)
-
-    if request.min_tags > 0:
-        where_clauses.append(f"({tag_count_expr}) >= ?")
-        params.append(request.min_tags)
-
-    if request.max_tags >= 0:
-        where_clauses.append(f"({tag_count_expr}) <= ?")
-        params.append(request.max_tags)
-
-    where_sql = " AND ".join(where_clauses)
-
-    # 排序
-    sort_map = {
-        "date_desc": "i.created_at DESC",
-        "date_asc": "i.created_at ASC",
-        "size_desc": "i.file_size DESC",
-        "size_asc": "i.file_size ASC",
-        "resolution_desc": "i.height DESC, i.width DESC",
-        "resolution_asc": "i.height ASC, i.width ASC",
-    }
-    order_sql = sort_map.get(request.sort_by, "i.created_at DESC")
+    build_tag_count_clauses(request.min_tags, request.max_tags, where_clauses, params)
 
-    with get_connection() as conn:
-        cursor = conn.cursor()
+    # 动图筛选
+    build_animation_clauses(request, where_clauses, params)
 
-        # 获取总数
-        count_query = f"""
-            SELECT COUNT(*) as total
-            FROM images i
-            LEFT JOIN images_fts f ON i.id = f.rowid
-            WHERE {where_sql}
-        """
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
+    # 尺寸筛选
+    build_dimension_clauses(request, where_clauses, params)
+
+    return " AND ".join(where_clauses), params
+
+
+def prepare_advanced_search(request: AdvancedSearchRequest) -> tuple[str, list, str]:
+    """高级搜索：构建 (WHERE 子句, 参数, 总数缓存键)"""
+    where_sql, params = build_advanced_where(request)
+    return where_sql, params, count_cache_key("advanced", normalize_advanced_request(request))
+
+
+def search_bitmap(cursor, request: AdvancedSearchRequest) -> dict | None:
+    """位图引擎求值（已开启且请求可由位图表达时），只回表读取当前页"""
+    if not settings.bitmap_search_enabled or request.sort_by == RANDOM_SORT:
+        return None
+
+    field, descending = resolve_sort(request.sort_by)
+    after = None
+    if request.cursor:
+        keys, last_id = parse_cursor(request.cursor, field, descending)
+        after = tuple(keys) + (last_id,)
+    with trace_phase("bitmap"):
+        engine_result = bitmap_engine.search(request, after)
+    if engine_result is None:
+        return None
+
+    total, page_ids = engine_result
+    results, next_cursor = hydrate_page(cursor, page_ids, request.sort_by, request.limit)
+    return {"total": total, "total_capped": False, "results": results, "next_cursor": next_cursor}
 
-        # 分页查询
-        query = f"""
-            SELECT i.*, f.tags as tags_text
-            FROM images i
-            LEFT JOIN images_fts f ON i.id = f.rowid
-            WHERE {where_sql}
-            ORDER BY {order_sql}
-            LIMIT ? OFFSET ?
-        """
-        cursor.execute(query, params + [request.limit, request.offset])
-        rows = cursor.fetchall()
 
-        results = []
-        for r in rows:
-            tags_text = r['tags_text'] if r['tags_text'] else ""
-            tags = tags_text.split(' ') if tags_text else []
-            results.append({
-                "md5": r['md5'],
-                "filename": r['filename'],
-                "tags": tags,
-                "w": r['width'],
-                "h": r['height'],
-                "size": r['file_size'],
-                "is_trash": 'trash_bin' in tags
-            })
+async def advanced_search(request: AdvancedSearchRequest):
+    """
+    高级搜索（完全兼容旧项目搜索逻辑）
+    - keywords: 二维数组，每个子数组是一个标签膨胀后的关键词列表（子数组内OR，子数组间AND）
+    - excludes: 二维数组，每个子数组是一个排除标签膨胀后的关键词列表（子数组内OR，子数组间AND排除）
+    - excludes_and: 三维数组，交集排除
+    """
+    with get_connection() as conn:
+        cursor = traced(conn.cursor())
+
+        result = search_bitmap(cursor, request)
+        if result is not None:
+            return result
 
-        return {"total": total, "results": results}
+        with trace_phase("expansion"):
+            where_sql, params, count_key = prepare_advanced_search(request)
+        return run_search(cursor, request, where_sql, params, count_key)
 
 
 @router.get("/tags")
@@ -369,6 +1039,18 @@ async def get_all_tags():
         return {"tags": sorted(all_tags)}
 
 
+@router.get("/tags/suggest")
+async def suggest_tags(q: str = "", limit: int = Query(default=10, ge=1, le=100)):
+    """标签联想：前缀（含拼音）与子串匹配，按使用次数取 Top-K"""
+    return {"query": q, "tags": tag_index.suggest(q, limit)}
+
+
+@router.get("/tags/fuzzy")
+async def fuzzy_tags(q: str, limit: int = Query(default=10, ge=1, le=100)):
+    """拼写容错查询（did you mean）：返回编辑距离阈值内的词表标签"""
+    return {"query": q, "tags": tag_index.fuzzy(q, limit)}
+
+
 @router.get("/meta/tags")
 async def get_meta_tags():
     """获取标签建议（按使用次数排序，兼容旧项目 API）"""
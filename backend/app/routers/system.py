@@ -8,7 +8,15 @@ from fastapi import APIRouter, HTTPException, Body
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Union
-from ..database import get_connection, get_rules_version, ensure_hierarchy_edges, rebuild_hierarchy_from_edges
+from ..database import (
+    get_connection,
+    get_rules_version,
+    ensure_hierarchy_edges,
+    rebuild_hierarchy_from_edges,
+    reset_rules_changes,
+    notify_images_changed,
+    notify_rules_changed
+)
 
 router = APIRouter()
 
@@ -47,6 +55,7 @@ async def check_md5_compat(data: CheckMD5Request):
                     (row['id'],)
                 )
                 conn.commit()
+                notify_images_changed([row['id']])
                 time_refreshed = True
 
             return {
@@ -73,6 +82,7 @@ async def update_tags_compat(data: UpdateTagsRequest):
 
         cursor.execute("UPDATE images SET tags = ? WHERE md5 = ?", (tags_str, data.md5))
         conn.commit()
+        notify_images_changed([row['id']])
 
         return {"success": True}
 
@@ -326,8 +336,13 @@ async def import_data(data: dict = Body(...)):
 
             rebuild_hierarchy_from_edges(conn)
 
+        # 规则表已整体改写，此前的变更日志不再参与增量同步
+        reset_rules_changes(conn)
         conn.commit()
 
+    notify_images_changed()
+    notify_rules_changed()
+
     return {
         "success": True,
         "imported_images": imported_counts["images"],
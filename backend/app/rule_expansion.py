@@ -0,0 +1,83 @@
+"""
+规则膨胀映射缓存
+
+将 search_keywords、search_groups.enabled 与 search_hierarchy 闭包预先计算为
+"关键词 -> 膨胀关键词集合" 的字典，规则代号变化（含导入重置版本号）时整体重建，
+简化搜索的膨胀因此只是一次字典查找。
+"""
+import threading
+
+from .database import get_connection, get_rules_generation
+
+
+class RuleExpansionMap:
+    """关键词膨胀映射（与旧版逐条查询的语义一致）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation: int | None = None
+        self._expansions: dict[str, frozenset[str]] = {}
+
+    def _build(self) -> dict[str, frozenset[str]]:
+        """
+        对每个关键词：取包含它的已启用组，合并
+        - 该组闭包内（含自身）所有已启用组的关键词
+        - 该组自身的全部关键词
+        关键词自身的 enabled 标记不参与膨胀（与旧版一致）。
+        """
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM search_groups WHERE enabled = 1")
+            enabled_groups = {row['id'] for row in cursor.fetchall()}
+
+            cursor.execute("SELECT keyword, group_id FROM search_keywords")
+            keywords_by_group: dict[int, set[str]] = {}
+            for row in cursor.fetchall():
+                keywords_by_group.setdefault(row['group_id'], set()).add(row['keyword'])
+
+            cursor.execute("SELECT ancestor_id, descendant_id FROM search_hierarchy")
+            descendants: dict[int, list[int]] = {}
+            for row in cursor.fetchall():
+                descendants.setdefault(row['ancestor_id'], []).append(row['descendant_id'])
+
+        group_expansion: dict[int, frozenset[str]] = {}
+        for group_id in enabled_groups:
+            words = set(keywords_by_group.get(group_id, ()))
+            for descendant_id in descendants.get(group_id, ()):
+                if descendant_id in enabled_groups:
+                    words.update(keywords_by_group.get(descendant_id, ()))
+            group_expansion[group_id] = frozenset(words)
+
+        expansions: dict[str, set[str]] = {}
+        for group_id, words in keywords_by_group.items():
+            if group_id not in enabled_groups:
+                continue
+            for keyword in words:
+                expansions.setdefault(keyword, set()).update(group_expansion[group_id])
+        return {keyword: frozenset(words) for keyword, words in expansions.items()}
+
+    def _current(self) -> dict[str, frozenset[str]]:
+        generation = get_rules_generation()
+        with self._lock:
+            if self._generation != generation:
+                # 代号须在读库之前取得：构建期间规则被修改时，下次查询会再次重建
+                self._expansions = self._build()
+                self._generation = generation
+            return self._expansions
+
+    def expand(self, tags: list[str]) -> list[str]:
+        """膨胀标签列表（包含所有子节点关键词）"""
+        if not tags:
+            return []
+        expansions = self._current()
+        expanded = set(tags)
+        for tag in tags:
+            expanded.update(expansions.get(tag, ()))
+        return sorted(expanded)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation = None
+
+
+expansion_map = RuleExpansionMap()
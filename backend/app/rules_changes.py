@@ -0,0 +1,116 @@
+"""
+规则增量同步
+
+每次规则写操作在 search_version_log.changes 中记录一组结构化操作（JSON 列表），
+按版本顺序回放即可由旧版本的扁平规则数据（groups / keywords / hierarchy）得到新版本：
+
+- {"op": "group_upsert", "group_id", "group_name", "is_enabled"}
+- {"op": "group_delete", "group_id"}：同时移除该组的关键词与所有涉及它的层级边
+- {"op": "keyword_upsert", "group_id", "keyword", "is_enabled"}：(group_id, keyword) 唯一
+- {"op": "keyword_delete", "group_id", "keyword"}
+- {"op": "edge_upsert", "parent_id", "child_id"}
+- {"op": "edge_delete", "parent_id", "child_id"}
+
+所需版本区间的日志不完整（已压缩、导入后重置、早于本功能的旧日志）时退回全量快照。
+不修改规则表的操作（图片标签修改等）同样占用版本号，回放时为空操作，
+即使其日志行没有结构化变更（早于本功能或已压缩）也不会导致退回快照。
+"""
+import json
+
+from .database import get_connection
+
+# 占用规则版本号但不修改规则表的日志操作
+NON_RULE_OPERATIONS = frozenset({"update_tags"})
+
+
+def group_upsert(cursor, group_id: int) -> dict | None:
+    """按组的当前行生成 group_upsert（组不存在时返回 None）"""
+    cursor.execute("SELECT name, enabled FROM search_groups WHERE id = ?", (group_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {
+        "op": "group_upsert",
+        "group_id": group_id,
+        "group_name": row['name'],
+        "is_enabled": row['enabled'] if row['enabled'] is not None else 1
+    }
+
+
+def group_delete(group_id: int) -> dict:
+    return {"op": "group_delete", "group_id": group_id}
+
+
+def keyword_upsert(group_id: int, keyword: str, enabled: int | bool | None = 1) -> dict:
+    return {
+        "op": "keyword_upsert",
+        "group_id": group_id,
+        "keyword": keyword,
+        "is_enabled": (1 if enabled else 0) if enabled is not None else 1
+    }
+
+
+def keyword_delete(group_id: int, keyword: str) -> dict:
+    return {"op": "keyword_delete", "group_id": group_id, "keyword": keyword}
+
+
+def edge_upserts(edges: list[tuple[int, int]]) -> list[dict]:
+    return [{"op": "edge_upsert", "parent_id": parent_id, "child_id": child_id} for parent_id, child_id in edges]
+
+
+def edge_deletes(edges: list[tuple[int, int]]) -> list[dict]:
+    return [{"op": "edge_delete", "parent_id": parent_id, "child_id": child_id} for parent_id, child_id in edges]
+
+
+def load_changes(since: int) -> tuple[int, list[dict] | None]:
+    """
+    读取 since 之后到当前版本的变更。
+
+    Returns:
+        (当前版本号, 按版本排列的变更条目)；区间内日志不可完整回放时条目为 None
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # 读事务内取数，版本号与日志来自同一时刻
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT value FROM system_meta WHERE key = 'rules_version'")
+        row = cursor.fetchone()
+        current_version = int(row['value']) if row else 0
+        cursor.execute("SELECT value FROM system_meta WHERE key = 'rules_changes_floor'")
+        row = cursor.fetchone()
+        floor_id = int(row['value']) if row else 0
+
+        if since > current_version:
+            conn.commit()
+            return current_version, None
+
+        cursor.execute("""
+            SELECT version_id, client_id, operation, changes, created_at
+            FROM search_version_log
+            WHERE id > ? AND version_id > ? AND version_id <= ?
+            ORDER BY version_id, id
+        """, (floor_id, since, current_version))
+        rows = cursor.fetchall()
+        conn.commit()
+
+    # 每个版本恰好一条带结构化变更的日志，才能完整回放
+    if len(rows) != current_version - since:
+        return current_version, None
+    entries = []
+    for expected_version, row in enumerate(rows, start=since + 1):
+        if row['version_id'] != expected_version:
+            return current_version, None
+        if row['changes'] is not None:
+            ops = json.loads(row['changes'])
+        elif row['operation'] in NON_RULE_OPERATIONS:
+            ops = []
+        else:
+            return current_version, None
+        entries.append({
+            "version_id": row['version_id'],
+            "client_id": row['client_id'],
+            "operation": row['operation'],
+            "created_at": row['created_at'],
+            "ops": ops
+        })
+    return current_version, entries
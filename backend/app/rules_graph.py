@@ -0,0 +1,178 @@
+"""
+规则图内存快照
+
+一次读出 search_groups、search_keywords 与 search_hierarchy_edges，建立父子邻接表，
+按数据库中的规则状态 (rules_version, rules_epoch) 缓存：每次访问先读取该状态
+（规则写操作递增版本号，导入递增纪元），与快照加载时在同一读事务内读到的状态不同时
+整体重新加载并原子替换。状态取自数据库而非进程内代号，多个 worker 进程或其他进程写库时同样能感知。
+后代收集、环路检测等图遍历直接在快照上进行，不再逐节点查询边表。
+
+写操作在同一请求内连续修改层级时（批量移动等），对快照调用 copy() 得到工作副本，
+随边表修改同步更新副本，后续检查即可看到本请求前面的修改。
+"""
+import threading
+
+from .database import ensure_hierarchy_edges, get_connection, get_rules_state, read_rules_state
+
+
+class RulesGraph:
+    """规则组 / 关键词 / 层级边的只读快照（工作副本可修改层级）"""
+
+    def __init__(
+        self,
+        version: int,
+        groups: list[dict],
+        keywords: list[dict],
+        edges: list[tuple[int, int]],
+        epoch: int = 0
+    ):
+        self.version = version
+        self.epoch = epoch
+        # 按 id 顺序的组行：{id, name, parent_id, enabled}
+        self.groups = groups
+        # 按 id 顺序的关键词行：{id, keyword, group_id, enabled}
+        self.keywords = keywords
+        # 边表原始顺序的 (parent_id, child_id)
+        self.edges = edges
+        children: dict[int, list[int]] = {}
+        parents: dict[int, list[int]] = {}
+        for parent_id, child_id in edges:
+            children.setdefault(parent_id, []).append(child_id)
+            parents.setdefault(child_id, []).append(parent_id)
+        # 邻接表的值为元组：工作副本修改某节点时整体替换，不影响快照
+        self.children: dict[int, tuple[int, ...]] = {node: tuple(ids) for node, ids in children.items()}
+        self.parents: dict[int, tuple[int, ...]] = {node: tuple(ids) for node, ids in parents.items()}
+
+    @classmethod
+    def load(cls) -> "RulesGraph":
+        with get_connection() as conn:
+            ensure_hierarchy_edges(conn)
+            cursor = conn.cursor()
+            # 读事务内取数，各表与版本号 / 纪元来自同一时刻
+            cursor.execute("BEGIN")
+            version, epoch = read_rules_state(cursor)
+
+            cursor.execute("SELECT id, name, parent_id, enabled FROM search_groups ORDER BY id")
+            groups = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute("SELECT id, keyword, group_id, enabled FROM search_keywords ORDER BY id")
+            keywords = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute("SELECT parent_id, child_id FROM search_hierarchy_edges")
+            edges = [(row['parent_id'], row['child_id']) for row in cursor.fetchall()]
+            conn.commit()
+        return cls(version, groups, keywords, edges, epoch)
+
+    @property
+    def state(self) -> tuple[int, int]:
+        """快照对应的规则状态 (rules_version, rules_epoch)"""
+        return self.version, self.epoch
+
+    def copy(self) -> "RulesGraph":
+        """层级可修改的工作副本（组与关键词行共享，邻接表浅拷贝后按节点替换）"""
+        graph = object.__new__(RulesGraph)
+        graph.version = self.version
+        graph.epoch = self.epoch
+        graph.groups = self.groups
+        graph.keywords = self.keywords
+        graph.edges = self.edges
+        graph.children = dict(self.children)
+        graph.parents = dict(self.parents)
+        return graph
+
+    def descendants(self, root_id: int) -> list[int]:
+        """所有后代（包含自身）"""
+        to_visit = [root_id]
+        visited: set[int] = set()
+        while to_visit:
+            current = to_visit.pop()
+            if current in visited:
+                continue
+            visited.add(current)
+            to_visit.extend(self.children.get(current, ()))
+        return list(visited)
+
+    def creates_cycle(self, parent_id: int, child_id: int) -> bool:
+        """添加 parent_id -> child_id 是否成环（child_id 能否沿子边走到 parent_id）"""
+        if parent_id == child_id:
+            return True
+        to_visit = [child_id]
+        visited: set[int] = set()
+        while to_visit:
+            current = to_visit.pop()
+            if current == parent_id:
+                return True
+            if current in visited:
+                continue
+            visited.add(current)
+            to_visit.extend(self.children.get(current, ()))
+        return False
+
+    def set_parents(self, child_id: int, parent_ids: list[int]) -> None:
+        """工作副本：将 child_id 的父节点替换为 parent_ids"""
+        for parent_id in self.parents.get(child_id, ()):
+            siblings = tuple(c for c in self.children.get(parent_id, ()) if c != child_id)
+            if siblings:
+                self.children[parent_id] = siblings
+            else:
+                self.children.pop(parent_id, None)
+        if parent_ids:
+            self.parents[child_id] = tuple(parent_ids)
+            for parent_id in parent_ids:
+                self.children[parent_id] = self.children.get(parent_id, ()) + (child_id,)
+        else:
+            self.parents.pop(child_id, None)
+
+    def add_edge(self, parent_id: int, child_id: int) -> bool:
+        """工作副本：追加一条父子边，边已存在时返回 False"""
+        if parent_id in self.parents.get(child_id, ()):
+            return False
+        self.parents[child_id] = self.parents.get(child_id, ()) + (parent_id,)
+        self.children[parent_id] = self.children.get(parent_id, ()) + (child_id,)
+        return True
+
+    def remove_edge(self, parent_id: int, child_id: int) -> bool:
+        """工作副本：删除一条父子边，边不存在时返回 False"""
+        if parent_id not in self.parents.get(child_id, ()):
+            return False
+        self.set_parents(child_id, [p for p in self.parents[child_id] if p != parent_id])
+        return True
+
+    def remove_nodes(self, node_ids: list[int]) -> None:
+        """工作副本：删除节点及其全部出入边"""
+        for node_id in node_ids:
+            for child_id in self.children.get(node_id, ()):
+                self.set_parents(child_id, [p for p in self.parents.get(child_id, ()) if p != node_id])
+            self.set_parents(node_id, [])
+
+    def edge_set(self) -> set[tuple[int, int]]:
+        """当前全部父子边"""
+        return {(parent_id, child_id) for child_id, parent_ids in self.parents.items() for parent_id in parent_ids}
+
+
+class RulesGraphCache:
+    """进程内规则图快照，数据库中的规则状态变化后下次访问时重新加载"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._graph: RulesGraph | None = None
+
+    def current(self) -> RulesGraph:
+        state = get_rules_state()
+        graph = self._graph
+        if graph is not None and graph.state == state:
+            return graph
+        with self._lock:
+            graph = self._graph
+            if graph is None or graph.state != state:
+                # 快照自带加载时读到的状态：加载期间规则被修改时，下次访问会再次加载
+                graph = RulesGraph.load()
+                self._graph = graph
+            return graph
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._graph = None
+
+
+rules_graph = RulesGraphCache()
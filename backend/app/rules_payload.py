@@ -0,0 +1,185 @@
+"""
+规则数据响应缓存
+
+GET /api/rules 返回的旧项目扁平结构按数据库中的规则状态 (rules_version, rules_epoch)
+缓存为编码好的 JSON 字节，gzip / brotli 压缩版本在首次被请求时生成并随同一条目缓存。
+规则未变化时，重复请求只需读取一次规则状态、按 If-None-Match 返回 304 或直接写出缓存的字节。
+"""
+import gzip
+import json
+import threading
+
+from .database import get_rules_state
+from .rules_graph import RulesGraph, rules_graph
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只提供 gzip
+    brotli = None
+
+# 压缩结果按版本缓存，只压缩一次，取较高压缩级别
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# 协商时的优先顺序（靠前者优先）
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def legacy_rules_data(graph: RulesGraph) -> dict:
+    """由规则图快照构建旧项目扁平化规则结构"""
+    return {
+        "version_id": graph.version,
+        "groups": [
+            {
+                "group_id": group['id'],
+                "group_name": group['name'],
+                "is_enabled": group['enabled'] if group['enabled'] is not None else 1
+            }
+            for group in graph.groups
+        ],
+        "keywords": [
+            {
+                "keyword": keyword['keyword'],
+                "group_id": keyword['group_id'],
+                "is_enabled": keyword['enabled'] if keyword['enabled'] is not None else 1
+            }
+            for keyword in graph.keywords
+        ],
+        "hierarchy": [{"parent_id": parent_id, "child_id": child_id} for parent_id, child_id in graph.edges]
+    }
+
+
+def encode_json(data) -> bytes:
+    """与 FastAPI JSONResponse 相同的紧凑 JSON 编码"""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def parse_accept_encoding(header: str | None) -> str | None:
+    """按 Accept-Encoding 选择可用的压缩格式（q=0 表示拒绝），都不可用时返回 None"""
+    if not header:
+        return None
+    accepted: dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+
+    wildcard = accepted.get("*", 0.0)
+    best = None
+    best_quality = 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match 是否命中（弱比较；兼容旧版不带引号的版本号）"""
+    if not if_none_match:
+        return False
+    opaque = etag.strip('"')
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.strip('"') == opaque:
+            return True
+    return False
+
+
+class RulesPayload:
+    """某一版本规则数据的编码结果"""
+
+    def __init__(self, state: tuple[int, int], data: dict):
+        self.state = state
+        self.version, epoch = state
+        self.data = data
+        # 导入后版本号可能重复，纪元不为 0 时一并编入 ETag
+        self.etag = f'"{self.version}"' if epoch == 0 else f'"{epoch}-{self.version}"'
+        self.body = encode_json(data)
+        self._lock = threading.Lock()
+        self._compressed: dict[str, bytes] = {}
+
+    def encoded(self, encoding: str | None) -> bytes:
+        """按压缩格式取响应体（None 为未压缩），压缩结果只生成一次"""
+        if encoding is None:
+            return self.body
+        body = self._compressed.get(encoding)
+        if body is not None:
+            return body
+        with self._lock:
+            body = self._compressed.get(encoding)
+            if body is None:
+                if encoding == "gzip":
+                    # mtime 固定，同一版本的压缩结果逐字节一致
+                    body = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+                elif encoding == "br" and brotli is not None:
+                    body = brotli.compress(self.body, quality=BROTLI_QUALITY)
+                else:
+                    raise ValueError(f"unsupported encoding: {encoding}")
+                self._compressed[encoding] = body
+            return body
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "bytes": len(self.body),
+            "compressed_bytes": {encoding: len(body) for encoding, body in self._compressed.items()},
+        }
+
+
+class RulesPayloadCache:
+    """进程内规则数据响应缓存，数据库中的规则状态变化后下次访问时重新构建"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._payload: RulesPayload | None = None
+        self.hits = 0
+        self.builds = 0
+
+    def current(self) -> RulesPayload:
+        state = get_rules_state()
+        payload = self._payload
+        if payload is not None and payload.state == state:
+            self.hits += 1
+            return payload
+        with self._lock:
+            payload = self._payload
+            if payload is None or payload.state != state:
+                # 以快照自带的状态为键：构建期间规则被修改时，下次访问会再次构建
+                graph = rules_graph.current()
+                payload = RulesPayload(graph.state, legacy_rules_data(graph))
+                self._payload = payload
+                self.builds += 1
+            else:
+                self.hits += 1
+            return payload
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._payload = None
+
+    def stats(self) -> dict:
+        payload = self._payload
+        return {
+            "hits": self.hits,
+            "builds": self.builds,
+            "encodings": list(SUPPORTED_ENCODINGS),
+            "payload": payload.stats() if payload is not None else None,
+        }
+
+
+rules_payload = RulesPayloadCache()
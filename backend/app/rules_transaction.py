@@ -0,0 +1,248 @@
+"""
+规则事务
+
+在同一个 SQLite 事务中按顺序执行一组规则操作（新建组、添加关键词、挂到另一个父节点等），
+只做一次版本号递增。层级操作先在规则图工作副本上校验与修改（后续操作的环路检测可见前面的修改），
+边表与闭包表在全部操作完成后按净变更一次性维护：先删除消失的边并重算受影响的闭包行，
+再删除被删组的闭包行，最后插入新增的边。
+"""
+from .hierarchy_closure import add_group_closure, delete_hierarchy_edges, insert_hierarchy_edge, remove_groups_closure
+from .models.rule import RuleOperation
+from .rules_changes import edge_deletes, edge_upserts, group_delete, group_upsert, keyword_delete, keyword_upsert
+from .rules_graph import RulesGraph
+
+
+class RuleOperationError(Exception):
+    """单个操作失败（整个事务回滚）"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class RulesTransaction:
+    """在调用方的游标与事务内执行规则操作，记录结果与结构化变更"""
+
+    def __init__(self, cursor, graph: RulesGraph):
+        self.cursor = cursor
+        self.base_graph = graph
+        self.graph = graph.copy()
+        # create_group 的 ref -> 新组 ID
+        self.refs: dict[str, int] = {}
+        # 本事务删除的组
+        self.deleted: set[int] = set()
+        # 工作副本中新增过的边（按出现顺序），提交前与最终边集比较得出净新增
+        self.added_edges: list[tuple[int, int]] = []
+        # 供 /api/rules/changes 回放的结构化操作
+        self.changes: list[dict] = []
+
+    def apply(self, operation: RuleOperation) -> dict:
+        handler = getattr(self, f"_op_{operation.op}", None)
+        if handler is None:
+            raise RuleOperationError(400, f"未知操作: {operation.op}")
+        return handler(operation)
+
+    def finish(self) -> None:
+        """按净变更一次性更新边表与闭包表"""
+        initial = set(self.base_graph.edges)
+        final = self.graph.edge_set()
+        removed = [edge for edge in self.base_graph.edges if edge not in final]
+        added = [edge for edge in dict.fromkeys(self.added_edges) if edge in final and edge not in initial]
+
+        delete_hierarchy_edges(self.cursor, removed)
+        remove_groups_closure(self.cursor, list(self.deleted))
+        for parent_id, child_id in added:
+            insert_hierarchy_edge(self.cursor, parent_id, child_id)
+
+    # ===== 参数解析 =====
+
+    def _resolve(self, value: int | str | None, field: str) -> int:
+        if value is None:
+            raise RuleOperationError(400, f"缺少 {field}")
+        if isinstance(value, str):
+            if value not in self.refs:
+                raise RuleOperationError(400, f"{field} 引用了未定义的 ref: {value}")
+            return self.refs[value]
+        return value
+
+    def _resolve_parent(self, value: int | str | None) -> int:
+        """父节点字段：None / 0 表示根级"""
+        if value is None or value == 0:
+            return 0
+        parent_id = self._resolve(value, "parent_id")
+        self._require_group(parent_id, "父节点不存在")
+        return parent_id
+
+    def _require_group(self, group_id: int, detail: str = "规则组不存在") -> None:
+        self.cursor.execute("SELECT id FROM search_groups WHERE id = ?", (group_id,))
+        if not self.cursor.fetchone():
+            raise RuleOperationError(404, detail)
+
+    def _find_keyword(self, operation: RuleOperation):
+        """按 keyword_id 或 (group_id, keyword) 定位关键词行"""
+        if operation.keyword_id is not None:
+            self.cursor.execute(
+                "SELECT id, keyword, group_id FROM search_keywords WHERE id = ?",
+                (operation.keyword_id,)
+            )
+        else:
+            group_id = self._resolve(operation.group_id, "group_id")
+            self.cursor.execute(
+                "SELECT id, keyword, group_id FROM search_keywords WHERE group_id = ? AND keyword = ?",
+                (group_id, operation.keyword or "")
+            )
+        row = self.cursor.fetchone()
+        if not row:
+            raise RuleOperationError(404, "关键词不存在")
+        return row
+
+    def _sync_display_parent(self, group_id: int) -> None:
+        """search_groups.parent_id 同步为任意一个非 0 的父节点（仅用于兼容展示）"""
+        parent_ids = [p for p in self.graph.parents.get(group_id, ()) if p != 0]
+        self.cursor.execute(
+            "UPDATE search_groups SET parent_id = ? WHERE id = ?",
+            (min(parent_ids) if parent_ids else None, group_id)
+        )
+
+    def _add_edge(self, parent_id: int, child_id: int) -> bool:
+        if parent_id != 0 and self.graph.creates_cycle(parent_id, child_id):
+            raise RuleOperationError(400, "不能创建循环引用关系")
+        if not self.graph.add_edge(parent_id, child_id):
+            return False
+        self.added_edges.append((parent_id, child_id))
+        self.changes += edge_upserts([(parent_id, child_id)])
+        return True
+
+    # ===== 操作 =====
+
+    def _op_create_group(self, operation: RuleOperation) -> dict:
+        name = (operation.name or "").strip()
+        if not name:
+            raise RuleOperationError(400, "name cannot be empty")
+        if operation.ref is not None and operation.ref in self.refs:
+            raise RuleOperationError(400, f"ref 重复: {operation.ref}")
+        parent_id = self._resolve_parent(operation.parent_id)
+
+        self.cursor.execute(
+            "INSERT INTO search_groups (name, parent_id, enabled) VALUES (?, ?, ?)",
+            (name, parent_id or None, 0 if operation.enabled is False else 1)
+        )
+        group_id = self.cursor.lastrowid
+        add_group_closure(self.cursor, group_id)
+        self.changes.append(group_upsert(self.cursor, group_id))
+        if parent_id != 0:
+            self._add_edge(parent_id, group_id)
+        if operation.ref is not None:
+            self.refs[operation.ref] = group_id
+        return {"id": group_id}
+
+    def _op_update_group(self, operation: RuleOperation) -> dict:
+        group_id = self._resolve(operation.group_id, "group_id")
+        self._require_group(group_id)
+        updates = []
+        params = []
+        if operation.name is not None:
+            name = operation.name.strip()
+            if not name:
+                raise RuleOperationError(400, "name cannot be empty")
+            updates.append("name = ?")
+            params.append(name)
+        if operation.enabled is not None:
+            updates.append("enabled = ?")
+            params.append(1 if operation.enabled else 0)
+        if updates:
+            self.cursor.execute(f"UPDATE search_groups SET {', '.join(updates)} WHERE id = ?", params + [group_id])
+            self.changes.append(group_upsert(self.cursor, group_id))
+        return {"id": group_id, "updated": bool(updates)}
+
+    def _op_delete_group(self, operation: RuleOperation) -> dict:
+        group_id = self._resolve(operation.group_id, "group_id")
+        self._require_group(group_id)
+        all_group_ids = self.graph.descendants(group_id)
+        placeholders = ",".join(["?"] * len(all_group_ids))
+        self.cursor.execute(f"DELETE FROM search_keywords WHERE group_id IN ({placeholders})", all_group_ids)
+        self.cursor.execute(f"DELETE FROM search_groups WHERE id IN ({placeholders})", all_group_ids)
+        # 后代已一并删除，不会留下失去父边的组
+        self.graph.remove_nodes(all_group_ids)
+        self.deleted.update(all_group_ids)
+        self.changes += [group_delete(gid) for gid in all_group_ids]
+        return {"deleted_count": len(all_group_ids)}
+
+    def _op_add_keyword(self, operation: RuleOperation) -> dict:
+        group_id = self._resolve(operation.group_id, "group_id")
+        self._require_group(group_id)
+        keyword = (operation.keyword or "").strip()
+        if not keyword:
+            raise RuleOperationError(400, "keyword cannot be empty")
+        # 去重，兼容旧项目 OR REPLACE 语义
+        self.cursor.execute("DELETE FROM search_keywords WHERE group_id = ? AND keyword = ?", (group_id, keyword))
+        self.cursor.execute(
+            "INSERT INTO search_keywords (keyword, group_id, enabled) VALUES (?, ?, ?)",
+            (keyword, group_id, 0 if operation.enabled is False else 1)
+        )
+        self.changes.append(keyword_upsert(group_id, keyword, operation.enabled))
+        return {"id": self.cursor.lastrowid}
+
+    def _op_remove_keyword(self, operation: RuleOperation) -> dict:
+        row = self._find_keyword(operation)
+        self.cursor.execute("DELETE FROM search_keywords WHERE id = ?", (row['id'],))
+        self.changes.append(keyword_delete(row['group_id'], row['keyword']))
+        return {"id": row['id']}
+
+    def _op_toggle_keyword(self, operation: RuleOperation) -> dict:
+        if operation.enabled is None:
+            raise RuleOperationError(400, "缺少 enabled")
+        row = self._find_keyword(operation)
+        self.cursor.execute(
+            "UPDATE search_keywords SET enabled = ? WHERE id = ?",
+            (1 if operation.enabled else 0, row['id'])
+        )
+        self.changes.append(keyword_upsert(row['group_id'], row['keyword'], operation.enabled))
+        return {"id": row['id']}
+
+    def _op_add_hierarchy(self, operation: RuleOperation) -> dict:
+        child_id = self._resolve(operation.child_id, "child_id")
+        parent_id = self._resolve(operation.parent_id, "parent_id")
+        if parent_id == child_id:
+            raise RuleOperationError(400, "不能将节点设为自己的子节点")
+        self._require_group(child_id, "子节点不存在")
+        if parent_id != 0:
+            self._require_group(parent_id, "父节点不存在")
+
+        added = self._add_edge(parent_id, child_id)
+        # 更新单一 parent_id（仅作兼容展示）
+        if added and parent_id != 0:
+            self.cursor.execute(
+                "UPDATE search_groups SET parent_id = ? WHERE id = ? AND parent_id IS NULL",
+                (parent_id, child_id)
+            )
+        return {"added": added}
+
+    def _op_remove_hierarchy(self, operation: RuleOperation) -> dict:
+        child_id = self._resolve(operation.child_id, "child_id")
+        parent_id = self._resolve(operation.parent_id, "parent_id")
+        self._require_group(child_id, "子节点不存在")
+
+        removed = self.graph.remove_edge(parent_id, child_id)
+        if removed:
+            self.changes += edge_deletes([(parent_id, child_id)])
+            self._sync_display_parent(child_id)
+        return {"removed": removed}
+
+    def _op_move_group(self, operation: RuleOperation) -> dict:
+        group_id = self._resolve(operation.group_id, "group_id")
+        self._require_group(group_id)
+        parent_id = self._resolve_parent(operation.parent_id)
+        if parent_id == group_id:
+            raise RuleOperationError(400, "不能将节点设为自己的子节点")
+        if parent_id != 0 and self.graph.creates_cycle(parent_id, group_id):
+            raise RuleOperationError(400, "不能创建循环引用关系")
+
+        old_edges = [(p, group_id) for p in self.graph.parents.get(group_id, ())]
+        self.graph.set_parents(group_id, [])
+        self.changes += edge_deletes(old_edges)
+        if parent_id != 0:
+            self._add_edge(parent_id, group_id)
+        self.cursor.execute("UPDATE search_groups SET parent_id = ? WHERE id = ?", (parent_id or None, group_id))
+        return {"id": group_id, "parent_id": parent_id}
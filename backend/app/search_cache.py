@@ -0,0 +1,82 @@
+"""
+搜索结果缓存
+
+按规范化后的请求缓存整页响应（LRU，容量有限）。每个条目记录计算时的
+(图片代号, 规则代号)，任一写操作提交后代号递增，旧条目在下次命中时即视为过期。
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from .database import get_images_generation, get_rules_generation
+
+
+def current_generation() -> tuple[int, int]:
+    """当前数据代号 (图片代号, 规则代号)"""
+    return get_images_generation(), get_rules_generation()
+
+
+def make_cache_key(kind: str, payload: dict) -> str:
+    """由请求类型与规范化后的请求字段生成缓存键"""
+    return kind + ":" + json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+class SearchResultCache:
+    """带命中统计的 LRU 搜索结果缓存"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[tuple[int, int], dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get(self, key: str) -> dict | None:
+        """读取缓存；条目代号与当前不一致时丢弃并按未命中计"""
+        if self.max_entries <= 0:
+            return None
+        generation = current_generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: str, generation: tuple[int, int], value: dict) -> None:
+        """
+        写入缓存。generation 须在开始查询前取得：查询期间发生写操作时
+        代号已变化，该条目下次读取即被视为过期，不会返回旧数据。
+        """
+        if self.max_entries <= 0 or generation != current_generation():
+            return
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
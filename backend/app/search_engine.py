@@ -0,0 +1,486 @@
+"""
+内存位图搜索引擎
+
+为每个标签维护一个图片 ID 位图（稀疏标签用 array 存储、稠密标签用整数位图，
+与 roaring bitmap 的 array/bitmap 容器思路一致），高级搜索的
+"组内 OR、组间 AND、排除 NOT" 直接用位运算求值，只回表读取当前页的行。
+"""
+import heapq
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+from .database import get_connection, add_images_listener
+from .pagination import resolve_sort
+
+# 稀疏/稠密切换阈值：array('I') 每个元素 4 字节，位图每个 ID 1 bit
+DENSE_RATIO = 32
+
+# 结果集不超过该大小时直接取出全部 ID 排序，否则沿预排序列表逐个探测
+SMALL_RESULT = 4096
+
+# 位图引擎维护预排序列表的排序字段（其余排序方式走 SQL 路径）
+SORT_FIELDS = ("date", "size", "resolution", "tags")
+
+# 关键词 -> 位图 的缓存上限
+KEYWORD_CACHE_SIZE = 512
+
+# 分辨率分桶（按长边像素）：边界与对应标签
+RESOLUTION_BUCKET_EDGES = (256, 512, 1024, 2048)
+RESOLUTION_BUCKET_LABELS = ("<256", "256-511", "512-1023", "1024-2047", "2048+")
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+# 只由 SQL 路径处理的数值范围筛选字段（未设置时为 None）
+SQL_ONLY_FILTERS = (
+    "animated", "min_frames", "max_frames", "min_duration_ms", "max_duration_ms",
+    "min_width", "min_height", "min_megapixels", "max_megapixels",
+)
+
+
+def has_sql_only_filters(request) -> bool:
+    """请求是否包含位图引擎不处理的筛选条件"""
+    return any(getattr(request, field) is not None for field in SQL_ONLY_FILTERS)
+
+
+def ascii_lower(text: str) -> str:
+    """仅转换 ASCII 字母大小写（与 SQLite LOWER/LIKE 行为一致）"""
+    return text.translate(_ASCII_LOWER)
+
+
+def like_to_regex(pattern: str) -> re.Pattern:
+    """将 SQLite LIKE 模式（% 与 _ 通配，ASCII 大小写不敏感）转换为正则"""
+    parts = []
+    for ch in pattern:
+        if ch == "%":
+            parts.append(".*")
+        elif ch == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(ch))
+    return re.compile("".join(parts), re.ASCII | re.IGNORECASE | re.DOTALL)
+
+
+def resolution_bucket(width: int, height: int) -> int:
+    """长边所在的分辨率桶下标"""
+    return bisect_right(RESOLUTION_BUCKET_EDGES, max(width, height))
+
+
+def iter_bits_desc(bits: int):
+    """按 ID 从大到小遍历位图中的所有置位"""
+    s = bin(bits)
+    last = len(s) - 1
+    i = s.find("1", 2)
+    while i != -1:
+        yield last - i
+        i = s.find("1", i + 1)
+
+
+class BitmapSearchEngine:
+    """基于位图倒排的高级搜索求值器"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self.max_id = 0
+        self.universe = 0
+        self.tagged = 0
+        # 标签名 -> 倒排（array('I') 或 int 位图）
+        self.postings: dict[str, array | int] = {}
+        # 扩展名（小写）-> 位图
+        self.ext_bitmaps: dict[str, int] = {}
+        # 标签数量 -> 位图
+        self.count_bitmaps: dict[int, int] = {}
+        # 分辨率桶 -> 位图
+        self.resolution_bitmaps: dict[int, int] = {}
+        # 宽高比分类 -> 位图
+        self.aspect_bitmaps: dict[str, int] = {}
+        # 每张图片的列数据（按 ID 索引）
+        self.rows: dict[int, tuple] = {}
+        # 排序字段 -> 按 (键..., id) 升序排列的 ID 列表
+        self.orders: dict[str, array] = {}
+        self._keyword_cache: dict[str, int] = {}
+
+    # ----- 加载与增量维护 -----
+
+    def invalidate(self):
+        """标记为过期，下次查询时整体重新加载"""
+        with self._lock:
+            self._loaded = False
+            self._reset()
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._reset()
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, filename, tags, tag_count, ext, aspect, created_at, file_size, width, height FROM images")
+                rows = cursor.fetchall()
+
+            sparse: dict[str, array] = {}
+            for row in rows:
+                image_id = row['id']
+                self.rows[image_id] = self._row_tuple(row)
+                self.max_id = max(self.max_id, image_id)
+                for tag in self._split(row['tags']):
+                    sparse.setdefault(tag, array("I")).append(image_id)
+
+            self.universe = self._build_bitmap(self.rows.keys())
+            for tag, ids in sparse.items():
+                self.postings[tag] = self._compact(ids)
+
+            tagged_ids = []
+            by_ext: dict[str, list[int]] = {}
+            by_count: dict[int, list[int]] = {}
+            by_resolution: dict[int, list[int]] = {}
+            by_aspect: dict[str, list[int]] = {}
+            for image_id, r in self.rows.items():
+                if r[2]:
+                    tagged_ids.append(image_id)
+                by_ext.setdefault(r[7], []).append(image_id)
+                by_aspect.setdefault(r[8], []).append(image_id)
+                by_count.setdefault(r[6], []).append(image_id)
+                by_resolution.setdefault(resolution_bucket(r[5], r[4]), []).append(image_id)
+            self.tagged = self._build_bitmap(tagged_ids)
+            self.ext_bitmaps = {ext: self._build_bitmap(ids) for ext, ids in by_ext.items()}
+            self.count_bitmaps = {cnt: self._build_bitmap(ids) for cnt, ids in by_count.items()}
+            self.resolution_bitmaps = {bucket: self._build_bitmap(ids) for bucket, ids in by_resolution.items()}
+            self.aspect_bitmaps = {aspect: self._build_bitmap(ids) for aspect, ids in by_aspect.items()}
+
+            for field in SORT_FIELDS:
+                key = self._sort_key(field)
+                self.orders[field] = array("I", sorted(self.rows.keys(), key=key))
+
+            self._loaded = True
+            print(f"[Bitmap Search] Loaded {len(self.rows)} images, {len(self.postings)} tags.")
+
+    def refresh_images(self, image_ids: list[int] | None):
+        """图片变更回调：按 ID 增量更新；None 表示批量变更，整体失效"""
+        with self._lock:
+            if not self._loaded:
+                return
+            if image_ids is None:
+                self.invalidate()
+                return
+
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                placeholders = ",".join(["?"] * len(image_ids))
+                cursor.execute(
+                    f"SELECT id, filename, tags, tag_count, ext, aspect, created_at, file_size, width, height FROM images WHERE id IN ({placeholders})",
+                    list(image_ids)
+                )
+                fresh = {row['id']: self._row_tuple(row) for row in cursor.fetchall()}
+
+            for image_id in image_ids:
+                if image_id in self.rows:
+                    self._remove(image_id)
+                if image_id in fresh:
+                    self._add(image_id, fresh[image_id])
+            self._keyword_cache.clear()
+
+    def _add(self, image_id: int, r: tuple):
+        self.rows[image_id] = r
+        self.max_id = max(self.max_id, image_id)
+        bit = 1 << image_id
+        self.universe |= bit
+        if r[2]:
+            self.tagged |= bit
+        for tag in self._split(r[2]):
+            posting = self.postings.get(tag)
+            if posting is None:
+                self.postings[tag] = array("I", [image_id])
+            elif isinstance(posting, int):
+                self.postings[tag] = posting | bit
+            else:
+                posting.append(image_id)
+                self.postings[tag] = self._compact(posting)
+        self.ext_bitmaps[r[7]] = self.ext_bitmaps.get(r[7], 0) | bit
+        self.aspect_bitmaps[r[8]] = self.aspect_bitmaps.get(r[8], 0) | bit
+        self.count_bitmaps[r[6]] = self.count_bitmaps.get(r[6], 0) | bit
+        bucket = resolution_bucket(r[5], r[4])
+        self.resolution_bitmaps[bucket] = self.resolution_bitmaps.get(bucket, 0) | bit
+        for field, order in self.orders.items():
+            insort(order, image_id, key=self._sort_key(field))
+
+    def _remove(self, image_id: int):
+        r = self.rows[image_id]
+        for field, order in self.orders.items():
+            key = self._sort_key(field)
+            pos = bisect_left(order, key(image_id), key=key)
+            if pos < len(order) and order[pos] == image_id:
+                order.pop(pos)
+        mask = ~(1 << image_id)
+        self.universe &= mask
+        self.tagged &= mask
+        for tag in self._split(r[2]):
+            posting = self.postings.get(tag)
+            if isinstance(posting, int):
+                posting &= mask
+            elif posting is not None and image_id in posting:
+                posting.remove(image_id)
+            if not posting:
+                self.postings.pop(tag, None)
+            else:
+                self.postings[tag] = posting
+        self.ext_bitmaps[r[7]] = self.ext_bitmaps.get(r[7], 0) & mask
+        self.aspect_bitmaps[r[8]] = self.aspect_bitmaps.get(r[8], 0) & mask
+        self.count_bitmaps[r[6]] = self.count_bitmaps.get(r[6], 0) & mask
+        bucket = resolution_bucket(r[5], r[4])
+        self.resolution_bitmaps[bucket] = self.resolution_bitmaps.get(bucket, 0) & mask
+        del self.rows[image_id]
+
+    @staticmethod
+    def _row_tuple(row) -> tuple:
+        """(filename, created_at, tags, file_size, height, width, tag_count, ext, aspect)"""
+        filename = row['filename'] or ""
+        tags = row['tags'] or ""
+        return (
+            filename,
+            row['created_at'] or "",
+            tags,
+            row['file_size'] or 0,
+            row['height'] or 0,
+            row['width'] or 0,
+            row['tag_count'] or 0,
+            row['ext'] or "",
+            row['aspect'] or "",
+        )
+
+    @staticmethod
+    def _split(tags: str | None) -> set[str]:
+        return {t for t in tags.split(" ") if t} if tags else set()
+
+    def _sort_key(self, field: str):
+        """排序键 (键..., id)，与 SQL 路径的 ORDER BY 及游标键一致"""
+        rows = self.rows
+        if field == "date":
+            return lambda image_id: (rows[image_id][1], image_id)
+        if field == "size":
+            return lambda image_id: (rows[image_id][3], image_id)
+        if field == "tags":
+            return lambda image_id: (rows[image_id][6], rows[image_id][1], image_id)
+        return lambda image_id: (rows[image_id][4], rows[image_id][5], image_id)
+
+    def _compact(self, ids: array) -> array | int:
+        """稠密度超过阈值的倒排转为整数位图"""
+        if len(ids) * DENSE_RATIO > self.max_id + 1:
+            return self._build_bitmap(ids)
+        return ids
+
+    def _build_bitmap(self, ids) -> int:
+        buf = bytearray((self.max_id >> 3) + 1)
+        for image_id in ids:
+            buf[image_id >> 3] |= 1 << (image_id & 7)
+        return int.from_bytes(buf, "little")
+
+    # ----- 查询求值 -----
+
+    def _keyword_bitmap(self, keyword: str) -> int:
+        """关键词（子串语义）命中的图片位图"""
+        cached = self._keyword_cache.get(keyword)
+        if cached is not None:
+            return cached
+
+        regex = like_to_regex(keyword)
+        dense = 0
+        sparse = []
+        for tag, posting in self.postings.items():
+            if regex.search(tag):
+                if isinstance(posting, int):
+                    dense |= posting
+                else:
+                    sparse.append(posting)
+        bits = dense
+        if sparse:
+            bits |= self._build_bitmap(id_ for posting in sparse for id_ in posting)
+
+        if len(self._keyword_cache) >= KEYWORD_CACHE_SIZE:
+            self._keyword_cache.pop(next(iter(self._keyword_cache)))
+        self._keyword_cache[keyword] = bits
+        return bits
+
+    def _group_bitmap(self, keywords: list[str]) -> int:
+        bits = 0
+        for kw in keywords:
+            bits |= self._keyword_bitmap(kw)
+        return bits
+
+    def _ext_bitmap(self, extensions: list[str]) -> int:
+        bits = 0
+        for ext in extensions:
+            bits |= self.ext_bitmaps.get(ascii_lower(ext.lstrip(".")), 0)
+        return bits
+
+    @staticmethod
+    def supports(request) -> bool:
+        """
+        仅处理子串匹配模式；含空格或 LIKE 通配符（% _，可匹配标签间的空格）的关键词、
+        带点、通配符、为空的扩展名需要整串匹配，同样交给 SQL 路径；
+        动图、尺寸范围筛选与按帧数 / 时长排序也只由 SQL 路径处理
+        """
+        if request.match_mode != "substring":
+            return False
+        if resolve_sort(request.sort_by)[0] not in SORT_FIELDS or has_sql_only_filters(request):
+            return False
+        keywords = [kw for group in request.keywords for kw in group]
+        keywords += [kw for group in request.excludes for kw in group]
+        keywords += [kw for capsule in request.excludes_and for group in capsule for kw in group]
+        if any(ch in kw for kw in keywords for ch in " %_"):
+            return False
+        extensions = [ext.lstrip(".") for ext in request.extensions + request.exclude_extensions]
+        return all(ext and not any(ch in ext for ch in ".%_") for ext in extensions)
+
+    def evaluate(self, request) -> int:
+        """按 AdvancedSearchRequest 求出结果位图"""
+        result = self.universe
+
+        for group in request.keywords:
+            if group:
+                result &= self._group_bitmap(group)
+
+        # 与 SQL 路径一致：存在排除条件时无标签图片不返回
+        if any(request.excludes) or any(any(capsule) for capsule in request.excludes_and):
+            result &= self.tagged
+
+        for group in request.excludes:
+            if group:
+                result &= ~self._group_bitmap(group)
+
+        for capsule in request.excludes_and:
+            groups = [g for g in capsule if g]
+            if not groups:
+                continue
+            inter = self.universe
+            for group in groups:
+                inter &= self._group_bitmap(group)
+            result &= ~inter
+
+        if request.extensions:
+            result &= self._ext_bitmap(request.extensions)
+        if request.exclude_extensions:
+            result &= ~self._ext_bitmap(request.exclude_extensions)
+
+        if request.aspect:
+            bits = 0
+            for aspect in request.aspect:
+                bits |= self.aspect_bitmaps.get(aspect, 0)
+            result &= bits
+
+        if request.min_tags > 0 or request.max_tags >= 0:
+            bits = 0
+            for cnt, cnt_bits in self.count_bitmaps.items():
+                if cnt >= request.min_tags and (request.max_tags < 0 or cnt <= request.max_tags):
+                    bits |= cnt_bits
+            result &= bits
+
+        return result
+
+    def search(self, request, after: tuple | None = None) -> tuple[int, list[int]] | None:
+        """
+        求值高级搜索，返回 (总数, 当前页 ID 列表)。
+        after 为游标解码出的排序键 (键..., id)，提供时从该位置之后取一页并忽略 offset。
+        请求包含位图无法表达的条件时返回 None，由调用方走 SQL 路径。
+        """
+        if not self.supports(request):
+            return None
+
+        with self._lock:
+            self.ensure_loaded()
+            result = self.evaluate(request)
+            total = result.bit_count()
+
+            field, descending = resolve_sort(request.sort_by)
+            offset = 0 if after is not None else request.offset
+            need = offset + request.limit
+            if total == 0 or offset >= total:
+                return total, []
+
+            key = self._sort_key(field)
+            # 预计探测次数 need * N / total 大于结果集本身时，直接取出全部 ID 排序
+            universe_size = len(self.rows) or 1
+            if total <= SMALL_RESULT or need * universe_size > total * total:
+                ids = iter_bits_desc(result)
+                if after is not None:
+                    ids = (i for i in ids if (key(i) < after if descending else key(i) > after))
+                ids = sorted(ids, key=key, reverse=descending)
+                return total, ids[offset:need]
+
+            membership = result.to_bytes((result.bit_length() + 7) // 8, "little")
+            order = self.orders[field]
+            if after is None:
+                iterator = reversed(order) if descending else iter(order)
+            elif descending:
+                start = bisect_left(order, after, key=key)
+                iterator = (order[i] for i in range(start - 1, -1, -1))
+            else:
+                start = bisect_right(order, after, key=key)
+                iterator = (order[i] for i in range(start, len(order)))
+            page: list[int] = []
+            skipped = 0
+            for image_id in iterator:
+                byte_index = image_id >> 3
+                if byte_index < len(membership) and (membership[byte_index] >> (image_id & 7)) & 1:
+                    if skipped < offset:
+                        skipped += 1
+                        continue
+                    page.append(image_id)
+                    if len(page) >= request.limit:
+                        break
+            return total, page
+
+
+    def facets(self, request, top_n: int) -> dict | None:
+        """
+        结果集内的分面统计：标签 Top-N、扩展名与分辨率桶直方图。
+        请求包含位图无法表达的条件时返回 None，由调用方走 SQL 路径。
+        """
+        if not self.supports(request):
+            return None
+
+        with self._lock:
+            self.ensure_loaded()
+            result = self.evaluate(request)
+            total = result.bit_count()
+
+            tag_counts: dict[str, int] = {}
+            if total <= SMALL_RESULT:
+                # 结果集较小：直接遍历结果行的标签
+                for image_id in iter_bits_desc(result):
+                    for tag in self._split(self.rows[image_id][2]):
+                        tag_counts[tag] = tag_counts.get(tag, 0) + 1
+            else:
+                membership = result.to_bytes((result.bit_length() + 7) // 8, "little")
+                size = len(membership)
+                for tag, posting in self.postings.items():
+                    if isinstance(posting, int):
+                        count = (posting & result).bit_count()
+                    else:
+                        count = sum(
+                            1 for image_id in posting
+                            if (image_id >> 3) < size and (membership[image_id >> 3] >> (image_id & 7)) & 1
+                        )
+                    if count:
+                        tag_counts[tag] = count
+
+            top_tags = heapq.nsmallest(top_n, tag_counts.items(), key=lambda item: (-item[1], item[0]))
+            extensions = {ext: (bits & result).bit_count() for ext, bits in self.ext_bitmaps.items()}
+            resolutions = {bucket: (bits & result).bit_count() for bucket, bits in self.resolution_bitmaps.items()}
+
+        return {
+            "total": total,
+            "tags": [{"tag": tag, "count": count} for tag, count in top_tags],
+            "extensions": extensions,
+            "resolutions": resolutions,
+        }
+
+
+engine = BitmapSearchEngine()
+add_images_listener(engine.refresh_images)
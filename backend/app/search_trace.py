@@ -0,0 +1,116 @@
+"""
+搜索诊断（调试模式）
+
+调试模式下记录搜索执行的各阶段耗时与实际执行的 SQL 语句（含绑定参数），
+结束后对每条语句执行 EXPLAIN QUERY PLAN，用于定位全表扫描、调整索引。
+当前追踪对象保存在 ContextVar 中：未开启调试时各埋点均为空操作，
+不必在搜索函数之间传递额外参数。
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class SearchTrace:
+    """一次搜索的阶段耗时与 SQL 记录"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # 阶段名 -> 累计耗时（毫秒），按首次进入的顺序
+        self.phases: dict[str, float] = {}
+        # 已执行的语句：{phase, sql, params, elapsed_ms}
+        self.statements: list[dict] = []
+        self.current_phase: str | None = None
+
+    def record(self, sql: str, params, elapsed: float) -> None:
+        self.statements.append({
+            "phase": self.current_phase,
+            "sql": " ".join(sql.split()),
+            "params": list(params),
+            "elapsed_ms": round(elapsed * 1000, 3),
+        })
+
+    def report(self, cursor) -> dict:
+        """汇总为响应中的 debug 字段（在 cursor 所属连接上生成查询计划）"""
+        total = time.perf_counter() - self.started
+        statements = []
+        for statement in self.statements:
+            statements.append({**statement, "query_plan": explain_query_plan(cursor, statement["sql"], statement["params"])})
+        return {
+            "total_ms": round(total * 1000, 3),
+            "phases": {name: round(elapsed * 1000, 3) for name, elapsed in self.phases.items()},
+            "statements": statements,
+        }
+
+
+_current_trace: ContextVar[SearchTrace | None] = ContextVar("search_trace", default=None)
+
+
+class TracingCursor:
+    """记录 execute 语句与耗时的游标包装，其余属性透传"""
+
+    def __init__(self, cursor, trace: SearchTrace):
+        self._cursor = cursor
+        self._trace = trace
+
+    def execute(self, sql: str, params=()):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            self._trace.record(sql, params, time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def current_trace() -> SearchTrace | None:
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace():
+    """开启调试追踪，产出追踪对象"""
+    trace = SearchTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def trace_phase(name: str):
+    """计时一个阶段（可重入，同名阶段累加）；未开启调试时为空操作"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    previous = trace.current_phase
+    trace.current_phase = name
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.phases[name] = trace.phases.get(name, 0.0) + time.perf_counter() - started
+        trace.current_phase = previous
+
+
+def traced(cursor):
+    """调试模式下返回记录语句的游标包装，否则原样返回"""
+    trace = _current_trace.get()
+    return cursor if trace is None else TracingCursor(cursor, trace)
+
+
+def explain_query_plan(cursor, sql: str, params: list) -> list[str]:
+    """EXPLAIN QUERY PLAN 输出，按树结构缩进为文本行"""
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return []
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    depth: dict[int, int] = {0: -1}
+    lines = []
+    for row in cursor.fetchall():
+        node_id, parent_id, detail = row[0], row[1], row[3]
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
@@ -0,0 +1,58 @@
+"""
+随机排序（sort_by=random）
+
+以种子生成 id 空间 [0, 2^bits) 上的伪随机置换，图片按 rank = 置换⁻¹(id) 升序排列：
+- 顺序只由 (种子, 位宽) 决定，同一种子翻页稳定；位宽取 MAX(id) 的二进制位数，
+  新增图片只有在最大 id 跨过 2 的幂时才会改变整体顺序
+- 按 rank 递增批量探测 id（主键查询），读取一页的代价与结果集大小无关
+- 结果集相对 id 空间过于稀疏时，改为取出全部候选 id 按 rank 排序，二者顺序一致
+"""
+import random
+
+# 排序方式取值
+RANDOM_SORT = "random"
+
+# 置换轮数（每轮：奇数乘法 + 加法 + 右移异或，均为 2^bits 上的双射）
+PERMUTATION_ROUNDS = 3
+
+
+def new_seed() -> int:
+    """未指定种子时生成新种子"""
+    return random.SystemRandom().randrange(1 << 31)
+
+
+class SeededPermutation:
+    """[0, 2^bits) 上由种子确定的伪随机双射"""
+
+    def __init__(self, seed: int, bits: int):
+        self.bits = max(bits, 2)
+        self.mask = (1 << self.bits) - 1
+        # 右移不小于位宽一半，逆运算只需一次异或
+        self.shift = (self.bits + 1) // 2
+        rng = random.Random(seed)
+        self.keys = [
+            (rng.getrandbits(self.bits) | 1, rng.getrandbits(self.bits))
+            for _ in range(PERMUTATION_ROUNDS)
+        ]
+        modulus = 1 << self.bits
+        self.inverse_keys = [(pow(a, -1, modulus), b) for a, b in reversed(self.keys)]
+
+    @property
+    def size(self) -> int:
+        return self.mask + 1
+
+    def forward(self, rank: int) -> int:
+        """rank -> id"""
+        x = rank
+        for a, b in self.keys:
+            x = (x * a + b) & self.mask
+            x ^= x >> self.shift
+        return x
+
+    def inverse(self, image_id: int) -> int:
+        """id -> rank"""
+        x = image_id
+        for a_inv, b in self.inverse_keys:
+            x ^= x >> self.shift
+            x = ((x - b) * a_inv) & self.mask
+        return x
@@ -0,0 +1,246 @@
+"""
+标签词表内存索引（标签联想与拼写容错）
+
+基于 tags_dict 在内存中维护：
+- 按小写键排序的数组，前缀查找为二分定位区间，区间内按 use_count 取 Top-K
+- 字符 n-gram 倒排（1-gram / 2-gram），用于中文等任意位置的子串查找
+- 可选的拼音键（安装 pypinyin 时生效），全拼与首字母均可作为前缀
+- 带首尾标记的 2-gram 倒排，用于拼写容错（编辑距离）的候选生成
+
+tags_dict 每次重建后按差量更新，不必整体重载。
+"""
+import heapq
+import threading
+from bisect import bisect_left, insort
+
+from .database import get_connection, add_tags_dict_listener
+from .search_engine import ascii_lower
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:  # 可选依赖：未安装时不提供拼音联想
+    lazy_pinyin = None
+
+# 前缀区间的上界哨兵
+PREFIX_END = "\U0010ffff"
+
+# 差量超过词表该比例时直接整体重建
+REBUILD_RATIO = 0.2
+
+# 容错匹配首尾标记（使首尾字符也参与 2-gram）
+FUZZY_PAD = "\x00"
+
+
+def ngrams(text: str) -> set[str]:
+    """文本的所有 1-gram 与 2-gram"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def query_grams(query: str) -> set[str]:
+    """子串查询所需的 gram（2 字及以上用 2-gram，否则用单字）"""
+    if len(query) < 2:
+        return {query}
+    return {query[i:i + 2] for i in range(len(query) - 1)}
+
+
+def fuzzy_grams(text: str) -> set[str]:
+    """加首尾标记后的 2-gram"""
+    padded = FUZZY_PAD + text + FUZZY_PAD
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def max_edit_distance(query: str) -> int:
+    """容错阈值：4 字以内允许 1 处编辑，更长允许 2 处"""
+    return 1 if len(query) <= 4 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein 距离，超过 limit 时提前返回 limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ch_a in enumerate(a, 1):
+        current = [i]
+        for j, ch_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ch_a != ch_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def pinyin_keys(name: str) -> list[str]:
+    """标签的拼音键：全拼与首字母（仅当含非 ASCII 字符且安装了 pypinyin）"""
+    if lazy_pinyin is None or name.isascii():
+        return []
+    syllables = [s for s in lazy_pinyin(name) if s]
+    full = ascii_lower("".join(syllables))
+    initials = ascii_lower("".join(s[0] for s in syllables))
+    return [key for key in dict.fromkeys((full, initials)) if key and key != ascii_lower(name)]
+
+
+class TagVocabularyIndex:
+    """tags_dict 的内存前缀 / 子串 / 容错索引"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        # 标签名 -> 使用次数
+        self.counts: dict[str, int] = {}
+        # (小写键, 标签名) 升序数组；拼音键同样放入，指向原标签
+        self.keys: list[tuple[str, str]] = []
+        # gram -> 标签名集合
+        self.grams: dict[str, set[str]] = {}
+        # 带首尾标记的 2-gram -> 标签名集合（容错匹配）
+        self.fuzzy_grams: dict[str, set[str]] = {}
+
+    # ----- 加载与增量维护 -----
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self._loaded:
+                return
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name, use_count FROM tags_dict")
+                counts = {row['name']: row['use_count'] for row in cursor.fetchall()}
+            self._rebuild(counts)
+            self._loaded = True
+
+    def _rebuild(self, counts: dict[str, int]):
+        self._reset()
+        self.counts = dict(counts)
+        for name in counts:
+            self.keys.extend((key, name) for key in self._index_keys(name))
+            self._add_grams(name)
+        self.keys.sort()
+
+    def refresh(self, counts: dict[str, int]):
+        """tags_dict 重建后的回调：按新旧词表差量更新"""
+        with self._lock:
+            if not self._loaded:
+                return
+            added = counts.keys() - self.counts.keys()
+            removed = self.counts.keys() - counts.keys()
+            if len(added) + len(removed) > len(counts) * REBUILD_RATIO:
+                self._rebuild(counts)
+                return
+
+            for name in removed:
+                for key in self._index_keys(name):
+                    pos = bisect_left(self.keys, (key, name))
+                    if pos < len(self.keys) and self.keys[pos] == (key, name):
+                        self.keys.pop(pos)
+                self._remove_grams(name)
+            for name in added:
+                for key in self._index_keys(name):
+                    insort(self.keys, (key, name))
+                self._add_grams(name)
+            self.counts = dict(counts)
+
+    def _add_grams(self, name: str):
+        lowered = ascii_lower(name)
+        for gram in ngrams(lowered):
+            self.grams.setdefault(gram, set()).add(name)
+        for gram in fuzzy_grams(lowered):
+            self.fuzzy_grams.setdefault(gram, set()).add(name)
+
+    def _remove_grams(self, name: str):
+        lowered = ascii_lower(name)
+        for index, grams in ((self.grams, ngrams(lowered)), (self.fuzzy_grams, fuzzy_grams(lowered))):
+            for gram in grams:
+                names = index.get(gram)
+                if names is not None:
+                    names.discard(name)
+                    if not names:
+                        del index[gram]
+
+    @staticmethod
+    def _index_keys(name: str) -> list[str]:
+        return [ascii_lower(name)] + pinyin_keys(name)
+
+    # ----- 查询 -----
+
+    def _prefix_matches(self, prefix: str) -> set[str]:
+        start = bisect_left(self.keys, (prefix,))
+        end = bisect_left(self.keys, (prefix + PREFIX_END,))
+        return {name for _, name in self.keys[start:end]}
+
+    def _substring_matches(self, query: str) -> set[str]:
+        postings = [self.grams.get(gram) for gram in query_grams(query)]
+        if not postings or any(p is None for p in postings):
+            return set()
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+        # 2-gram 交集只是候选，需校验连续子串
+        return {name for name in candidates if query in ascii_lower(name)}
+
+    def _top(self, names, limit: int) -> list[str]:
+        return heapq.nsmallest(limit, names, key=lambda name: (-self.counts.get(name, 0), name))
+
+    def suggest(self, query: str, limit: int = 10) -> list[dict]:
+        """
+        标签联想：前缀（含拼音）命中优先，其后补充任意位置的子串命中，
+        两部分各自按 use_count 降序。
+        """
+        query = ascii_lower(query.strip())
+        self.ensure_loaded()
+        with self._lock:
+            if not query:
+                ranked = self._top(self.counts, limit)
+            else:
+                prefix = self._prefix_matches(query)
+                ranked = self._top(prefix, limit)
+                if len(ranked) < limit:
+                    rest = self._substring_matches(query) - prefix
+                    ranked += self._top(rest, limit - len(ranked))
+            return [{"name": name, "use_count": self.counts.get(name, 0)} for name in ranked]
+
+    def fuzzy(self, query: str, limit: int = 10, max_distance: int | None = None) -> list[dict]:
+        """
+        拼写容错匹配：返回编辑距离不超过阈值的标签，按 (距离, -use_count) 排序。
+        候选只取与查询共享足够多首尾标记 2-gram 的标签（每处编辑最多破坏 2 个 gram），
+        不扫描整个词表。
+        """
+        query = ascii_lower(query.strip())
+        if not query:
+            return []
+        if max_distance is None:
+            max_distance = max_edit_distance(query)
+        self.ensure_loaded()
+
+        grams = fuzzy_grams(query)
+        min_shared = max(1, len(grams) - 2 * max_distance)
+        with self._lock:
+            shared: dict[str, int] = {}
+            for gram in grams:
+                for name in self.fuzzy_grams.get(gram, ()):
+                    shared[name] = shared.get(name, 0) + 1
+
+            matches = []
+            for name, count in shared.items():
+                if count < min_shared:
+                    continue
+                distance = edit_distance(query, ascii_lower(name), max_distance)
+                if distance <= max_distance:
+                    matches.append((distance, -self.counts.get(name, 0), name))
+            matches = heapq.nsmallest(limit, matches)
+            return [{"name": name, "use_count": -neg_count, "distance": distance} for distance, neg_count, name in matches]
+
+    def fuzzy_expand(self, tags: list[str]) -> list[str]:
+        """容错膨胀：每个标签加上词表中与其足够接近的标签"""
+        expanded = list(dict.fromkeys(tags))
+        for tag in tags:
+            expanded.extend(match["name"] for match in self.fuzzy(tag, limit=50))
+        return list(dict.fromkeys(expanded))
+
+
+tag_index = TagVocabularyIndex()
+add_tags_dict_listener(tag_index.refresh)
@@ -0,0 +1,187 @@
+"""
+视觉特征相似图片搜索（CPU，无模型）
+
+每张图片入库时由预览图计算一个 128 维视觉特征：
+- 颜色直方图：RGB 各 4 档共 64 格，取平方根（Hellinger）后归一化
+- 梯度方向直方图：32x32 灰度图按 4x4 网格、每格 4 个无符号方向统计梯度幅值（简化 HOG）
+两部分各自 L2 归一化后按权重拼接再整体归一化，余弦相似度即点积。
+
+特征以 float32 BLOB 存入 images.visual_signature，内存中保存为连续的 NumPy 矩阵，
+查询为一次矩阵-向量乘加 argpartition 取 Top-K。
+"""
+import threading
+
+import numpy as np
+from PIL import Image
+
+from .database import get_connection, add_images_listener
+
+# 颜色直方图每通道档数
+COLOR_BINS = 4
+
+# 梯度直方图：灰度图边长、网格边长、方向数
+GRADIENT_SIZE = 32
+GRADIENT_GRID = 4
+GRADIENT_ORIENTATIONS = 4
+
+SIGNATURE_DIM = COLOR_BINS ** 3 + GRADIENT_GRID * GRADIENT_GRID * GRADIENT_ORIENTATIONS
+
+# 颜色部分在拼接特征中的权重（梯度部分为 1 - COLOR_WEIGHT）
+COLOR_WEIGHT = 0.5
+
+# 矩阵初始容量
+INITIAL_CAPACITY = 1024
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else vector
+
+
+def compute_signature(preview: Image.Image) -> np.ndarray:
+    """由 RGB 预览图计算视觉特征（float32，L2 归一化）"""
+    rgb = np.asarray(preview.convert("RGB"), dtype=np.uint8)
+
+    # 颜色直方图
+    quantized = rgb.astype(np.int32) // (256 // COLOR_BINS)
+    codes = (quantized[..., 0] * COLOR_BINS + quantized[..., 1]) * COLOR_BINS + quantized[..., 2]
+    color = np.bincount(codes.ravel(), minlength=COLOR_BINS ** 3).astype(np.float32)
+    color = _normalize(np.sqrt(color / max(codes.size, 1)))
+
+    # 梯度方向直方图
+    gray = np.asarray(
+        preview.convert("L").resize((GRADIENT_SIZE, GRADIENT_SIZE), Image.BILINEAR),
+        dtype=np.float32,
+    )
+    dy, dx = np.gradient(gray)
+    magnitude = np.hypot(dx, dy)
+    orientation = np.mod(np.arctan2(dy, dx), np.pi)
+    bins = np.minimum((orientation / np.pi * GRADIENT_ORIENTATIONS).astype(np.int32), GRADIENT_ORIENTATIONS - 1)
+    cell = GRADIENT_SIZE // GRADIENT_GRID
+    rows, cols = np.indices(gray.shape)
+    cell_index = (rows // cell) * GRADIENT_GRID + cols // cell
+    gradient = np.bincount(
+        (cell_index * GRADIENT_ORIENTATIONS + bins).ravel(),
+        weights=magnitude.ravel(),
+        minlength=GRADIENT_GRID * GRADIENT_GRID * GRADIENT_ORIENTATIONS,
+    ).astype(np.float32)
+    gradient = _normalize(np.sqrt(gradient))
+
+    signature = np.concatenate([color * COLOR_WEIGHT, gradient * (1 - COLOR_WEIGHT)])
+    return _normalize(signature).astype(np.float32)
+
+
+def signature_to_blob(signature: np.ndarray) -> bytes:
+    return signature.astype(np.float32).tobytes()
+
+
+def signature_from_blob(blob: bytes) -> np.ndarray | None:
+    """BLOB -> 特征向量；维度不符（特征定义变更前的旧数据）时返回 None"""
+    vector = np.frombuffer(blob, dtype=np.float32)
+    return vector if vector.size == SIGNATURE_DIM else None
+
+
+class SignatureMatrix:
+    """视觉特征的内存矩阵：行 i 为图片 ids[i] 的特征，删除时用末行填补空位"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self, capacity: int = INITIAL_CAPACITY):
+        self.matrix = np.zeros((capacity, SIGNATURE_DIM), dtype=np.float32)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+        self.row_by_id: dict[int, int] = {}
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self._loaded:
+                return
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, visual_signature FROM images WHERE visual_signature IS NOT NULL")
+                rows = cursor.fetchall()
+            self._reset(max(INITIAL_CAPACITY, len(rows)))
+            for row in rows:
+                vector = signature_from_blob(row['visual_signature'])
+                if vector is not None:
+                    self._set(row['id'], vector)
+            self._loaded = True
+
+    def _set(self, image_id: int, vector: np.ndarray):
+        row = self.row_by_id.get(image_id)
+        if row is None:
+            if self.size == len(self.ids):
+                capacity = len(self.ids) * 2
+                self.matrix = np.resize(self.matrix, (capacity, SIGNATURE_DIM))
+                self.ids = np.resize(self.ids, capacity)
+            row = self.size
+            self.size += 1
+            self.row_by_id[image_id] = row
+            self.ids[row] = image_id
+        self.matrix[row] = vector
+
+    def _remove(self, image_id: int):
+        row = self.row_by_id.pop(image_id, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            moved_id = int(self.ids[last])
+            self.matrix[row] = self.matrix[last]
+            self.ids[row] = moved_id
+            self.row_by_id[moved_id] = row
+        self.size = last
+
+    def refresh_images(self, image_ids: list[int] | None):
+        """图片变更回调：按 ID 增量更新；None 表示批量变更，整体失效"""
+        with self._lock:
+            if not self._loaded:
+                return
+            if image_ids is None:
+                self._loaded = False
+                self._reset()
+                return
+
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                placeholders = ",".join(["?"] * len(image_ids))
+                cursor.execute(
+                    f"SELECT id, visual_signature FROM images WHERE id IN ({placeholders})",
+                    list(image_ids)
+                )
+                fresh = {row['id']: row['visual_signature'] for row in cursor.fetchall()}
+
+            for image_id in image_ids:
+                blob = fresh.get(image_id)
+                vector = signature_from_blob(blob) if blob is not None else None
+                if vector is None:
+                    self._remove(image_id)
+                else:
+                    self._set(image_id, vector)
+
+    def get(self, image_id: int) -> np.ndarray | None:
+        self.ensure_loaded()
+        with self._lock:
+            row = self.row_by_id.get(image_id)
+            return None if row is None else self.matrix[row].copy()
+
+    def nearest(self, vector: np.ndarray, limit: int, exclude_id: int | None = None) -> list[tuple[int, float]]:
+        """余弦相似度最高的 limit 张图片，返回 [(图片 ID, 相似度)]，按相似度降序"""
+        self.ensure_loaded()
+        with self._lock:
+            if self.size == 0:
+                return []
+            scores = self.matrix[:self.size] @ vector
+            if exclude_id is not None and exclude_id in self.row_by_id:
+                scores[self.row_by_id[exclude_id]] = -np.inf
+            k = min(limit, self.size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(int(self.ids[row]), float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+
+signature_matrix = SignatureMatrix()
+add_images_listener(signature_matrix.refresh_images)
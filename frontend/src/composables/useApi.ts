@@ -9,6 +9,12 @@ import type {
   RulesTree,
   AdvancedSearchRequest,
   AdvancedSearchResponse,
+  BatchSearchRequest,
+  BatchSearchResponse,
+  FacetRequest,
+  FacetResponse,
+  SimilarImage,
+  VisuallySimilarImage,
   LegacyRulesData,
   RuleGroup,
   RuleKeyword,
@@ -85,6 +91,22 @@ export function useImageApi() {
     })
   }
 
+  // 批量搜索（一次请求执行多个搜索，结果按顺序返回）
+  async function batchSearch(params: BatchSearchRequest): Promise<ApiResponse<BatchSearchResponse>> {
+    return request<BatchSearchResponse>('/search/batch', {
+      method: 'POST',
+      body: JSON.stringify(params),
+    })
+  }
+
+    // 分面统计（结果集内的标签 Top-N、扩展名与分辨率分布）
+  async function searchFacets(params: FacetRequest): Promise<ApiResponse<FacetResponse>> {
+    return request<FacetResponse>('/search/facets', {
+      method: 'POST',
+      body: JSON.stringify(params),
+    })
+  }
+
   // 获取单张图片
   async function getImage(id: number): Promise<ApiResponse<MemeImage>> {
     return request<MemeImage>(`/images/${id}`)
@@ -103,6 +125,19 @@ export function useImageApi() {
     })
   }
 
+  // 近似图片（感知哈希，查找重新编码/缩放过的同一张图）
+  async function findSimilarImages(md5: string, maxDistance?: number): Promise<ApiResponse<{ md5: string; results: SimilarImage[] }>> {
+    const params = new URLSearchParams({ md5 })
+    if (maxDistance !== undefined) params.set('max_distance', String(maxDistance))
+    return request<{ md5: string; results: SimilarImage[] }>(`/images/similar?${params}`)
+  }
+
+  // 视觉相似图片（颜色直方图 + 梯度特征，不依赖标签）
+  async function findVisuallySimilarImages(md5: string, limit = 20): Promise<ApiResponse<{ md5: string; results: VisuallySimilarImage[] }>> {
+    const params = new URLSearchParams({ md5, limit: String(limit) })
+    return request<{ md5: string; results: VisuallySimilarImage[] }>(`/images/visually-similar?${params}`)
+  }
+
   // 检查 MD5 是否存在
   async function checkMD5(md5: string, refreshTime: boolean = false): Promise<ApiResponse<{ exists: boolean; filename?: string; time_refreshed?: boolean }>> {
     return request<{ exists: boolean; filename?: string; time_refreshed?: boolean }>(`/images/check-md5/${md5}?refresh_time=${refreshTime}`)
@@ -135,8 +170,12 @@ export function useImageApi() {
   return {
     searchImages,
     advancedSearch,
+    batchSearch,
+    searchFacets,
     getImage,
     uploadImage,
+    findSimilarImages,
+    findVisuallySimilarImages,
     checkMD5,
     updateImageTags,
     deleteImage,
@@ -624,6 +663,18 @@ export function useSystemApi() {
     return request<string[]>('/meta/tags')
   }
 
+  // 标签联想（前缀/拼音/子串匹配，按使用次数取 Top-K）
+  async function suggestTags(q: string, limit = 10): Promise<ApiResponse<{ query: string; tags: { name: string; use_count: number }[] }>> {
+    const params = new URLSearchParams({ q, limit: String(limit) })
+    return request<{ query: string; tags: { name: string; use_count: number }[] }>(`/tags/suggest?${params}`)
+  }
+
+  // 拼写容错查询（did you mean），按编辑距离与使用次数排序
+  async function fuzzyTags(q: string, limit = 10): Promise<ApiResponse<{ query: string; tags: { name: string; use_count: number; distance: number }[] }>> {
+    const params = new URLSearchParams({ q, limit: String(limit) })
+    return request<{ query: string; tags: { name: string; use_count: number; distance: number }[] }>(`/tags/fuzzy?${params}`)
+  }
+
   // 导出数据
   async function exportData(): Promise<ApiResponse<Record<string, unknown>>> {
     return request<Record<string, unknown>>('/export/all')
@@ -662,6 +713,8 @@ export function useSystemApi() {
   return {
     getAllTags,
     getTagSuggestions,
+    suggestTags,
+    fuzzyTags,
     exportData,
     importData,
     updateTags,
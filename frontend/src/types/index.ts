@@ -12,6 +12,29 @@ export interface MemeImage {
   file_size?: number
   width?: number
   height?: number
+  frame_count?: number  // 动图帧数（0 表示尚未计算）
+  duration_ms?: number  // 动图总时长（毫秒）
+  is_animated?: boolean
+}
+
+// 近似图片（感知哈希汉明距离）
+export interface SimilarImage {
+  md5: string
+  filename: string
+  width: number
+  height: number
+  file_size: number
+  distance: number
+}
+
+// 视觉相似图片（颜色/梯度特征余弦相似度）
+export interface VisuallySimilarImage {
+  md5: string
+  filename: string
+  width: number
+  height: number
+  file_size: number
+  score: number
 }
 
 export interface ImageUploadRequest {
@@ -29,6 +52,12 @@ export interface ImageUpdateRequest {
 }
 
 // 搜索相关类型
+// 总数计算方式：exact 精确 / none 不计数 / estimate 上限截断 / cached 复用同条件已算总数
+export type CountMode = 'exact' | 'none' | 'estimate' | 'cached'
+
+// 宽高比分类：宽高之比 ≥ 1.25 为 wide，高宽之比 ≥ 1.25 为 tall，其余为 square
+export type AspectBucket = 'wide' | 'tall' | 'square'
+
 export interface SearchRequest {
   include_tags: string[]
   exclude_tags: string[]
@@ -41,6 +70,21 @@ export interface SearchRequest {
   extensions?: string[]
   exclude_extensions?: string[]
   expand?: boolean  // 是否启用关键词膨胀
+  match_mode?: 'substring' | 'token' | 'prefix'  // 关键词匹配方式
+  cursor?: string | null  // 键集分页游标（上一页的 next_cursor），提供时忽略 page
+  count_mode?: CountMode  // 总数计算方式
+  fuzzy?: boolean  // 容错模式：包含标签扩展为拼写相近的标签
+  seed?: number | null  // 随机排序（sort_by=random）的种子
+  animated?: boolean | null  // 动图筛选：true 仅动图，false 仅静态图
+  min_frames?: number | null
+  max_frames?: number | null
+  min_duration_ms?: number | null
+  max_duration_ms?: number | null
+  aspect?: AspectBucket[]  // 宽高比分类（多个为 OR）
+  min_width?: number | null
+  min_height?: number | null
+  min_megapixels?: number | null  // 像素数下限（百万像素）
+  max_megapixels?: number | null
 }
 
 // 高级搜索请求（兼容旧项目二维数组格式）
@@ -63,10 +107,30 @@ export interface AdvancedSearchRequest {
   // 标签数量筛选
   min_tags: number
   max_tags: number
+  // 关键词匹配方式
+  match_mode?: 'substring' | 'token' | 'prefix'
+  // 键集分页游标（上一页的 next_cursor），提供时忽略 offset
+  cursor?: string | null
+  // 总数计算方式（翻页时用 cached 复用首页的总数）
+  count_mode?: CountMode
+  // 随机排序（sort_by=random）的种子，未提供时由服务端生成
+  seed?: number | null
+  // 动图筛选：animated 为 true 仅动图、false 仅静态图；帧数与时长（毫秒）上下限
+  animated?: boolean | null
+  min_frames?: number | null
+  max_frames?: number | null
+  min_duration_ms?: number | null
+  max_duration_ms?: number | null
+  aspect?: AspectBucket[]  // 宽高比分类（多个为 OR）
+  min_width?: number | null
+  min_height?: number | null
+  min_megapixels?: number | null  // 像素数下限（百万像素）
+  max_megapixels?: number | null
 }
 
 export interface AdvancedSearchResponse {
-  total: number
+  total: number | null  // count_mode 为 none 时为 null
+  total_capped?: boolean  // estimate 模式下总数超过上限
   results: {
     md5: string
     filename: string
@@ -76,10 +140,15 @@ export interface AdvancedSearchResponse {
     size: number
     is_trash: boolean
   }[]
+  // 下一页游标（本页不满时为 null）
+  next_cursor?: string | null
+  // 随机排序使用的种子（翻页时回传）
+  seed?: number | null
 }
 
 export interface SearchResponse {
-  total: number
+  total: number | null  // count_mode 为 none 时为 null
+  total_capped?: boolean  // estimate 模式下总数超过上限
   results: {
     md5: string
     filename: string
@@ -89,6 +158,33 @@ export interface SearchResponse {
     size: number
     is_trash: boolean
   }[]
+  // 下一页游标（本页不满时为 null）
+  next_cursor?: string | null
+  // 随机排序使用的种子（翻页时回传）
+  seed?: number | null
+  // 无结果时，词表中不存在的包含标签的拼写建议
+  did_you_mean?: Record<string, string[]> | null
+}
+
+// 批量搜索：每项为一个简化或高级搜索请求，按顺序返回
+export interface BatchSearchRequest {
+  queries: (SearchRequest | AdvancedSearchRequest)[]
+}
+
+export interface BatchSearchResponse {
+  responses: (SearchResponse | AdvancedSearchResponse)[]
+}
+
+// 分面统计：与高级搜索相同的筛选条件
+export interface FacetRequest extends Partial<AdvancedSearchRequest> {
+  top_n?: number
+}
+
+export interface FacetResponse {
+  total: number
+  tags: { tag: string; count: number }[]
+  extensions: { ext: string; count: number }[]
+  resolutions: { bucket: string; count: number }[]  // 按长边分桶，从小到大
 }
 
 // 规则树相关类型